@@ -0,0 +1,184 @@
+import os
+import re
+import sqlite3
+import argparse
+from datetime import datetime
+
+archive_file = "archive.sqlite"
+term_pattern = re.compile(r"\w+")
+schema = [
+    "CREATE TABLE IF NOT EXISTS broadcasts (id INTEGER PRIMARY KEY, file TEXT NOT NULL, audio_hash TEXT NOT NULL, ingested TEXT NOT NULL, UNIQUE (file, audio_hash))",
+    "CREATE TABLE IF NOT EXISTS turns (broadcast_id INTEGER NOT NULL, turn INTEGER NOT NULL, speaker TEXT, start REAL, PRIMARY KEY (broadcast_id, turn)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, term TEXT NOT NULL UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS words (broadcast_id INTEGER NOT NULL, position INTEGER NOT NULL, term_id INTEGER NOT NULL, turn INTEGER NOT NULL, start_ms INTEGER NOT NULL, end_ms INTEGER NOT NULL, PRIMARY KEY (broadcast_id, position)) WITHOUT ROWID",
+    # The inverted index: every occurrence of a term, newest broadcast first like the hits of a search, so that no sort is needed before the limit
+    "DROP INDEX IF EXISTS words_by_term",
+    "CREATE INDEX IF NOT EXISTS words_by_term_newest ON words (term_id, broadcast_id DESC, position)",
+]
+
+class Archive:
+    """Append-only archive of the transcripts with an inverted index of their words.
+    For every word the broadcast, the speaker turn and the start time in the audio are stored, so that a hit leads to its moment in the audio.
+    """
+
+    def __init__(self, archive_path):
+        """Opens the archive and creates it if necessary
+
+        Args:
+            archive_path (str): path to the sqlite file of the archive
+        """
+        self.archive_path = archive_path
+        with self.connect() as connection:
+            for statement in schema:
+                connection.execute(statement)
+
+    def connect(self):
+        """Opens a new connection, so that every thread and process uses its own one
+
+        Returns:
+            sqlite3.Connection: the connection, used as context manager it commits or rolls back a transaction but stays open
+        """
+        connection = sqlite3.connect(self.archive_path, timeout=60)
+        # Readers aren't blocked while a transcript is ingested
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def ingest(self, source_file, audio_hash, tokens, first_speaker):
+        """Adds a transcript to the archive, a file that was already ingested with the same audio is skipped
+
+        Args:
+            source_file (str): path to the audio file of the broadcast
+            audio_hash (str): hash of the audio file
+            tokens (list): tokens of the transcript with the speaker changes, see RadioSummarizer.build_transcript()
+            first_speaker (str): speaker at the beginning of the broadcast, None without diarization
+
+        Returns:
+            bool: if the transcript was added
+        """
+        connection = self.connect()
+        try:
+            with connection:
+                name = os.path.basename(source_file)
+                cursor = connection.execute("INSERT OR IGNORE INTO broadcasts (file, audio_hash, ingested) VALUES (?, ?, ?)",
+                    (name, audio_hash, datetime.now().isoformat(timespec="seconds")))
+                if cursor.rowcount == 0:
+                    return False
+                broadcast_id = cursor.lastrowid
+                turns = [(broadcast_id, 0, first_speaker, 0.0)]
+                words = []
+                for token in tokens:
+                    if token.speaker_start is not None:
+                        turns.append((broadcast_id, len(turns), token.speaker, token.speaker_start))
+                    for term in normalize(token.word):
+                        words.append((term, len(turns) - 1, int(round(token.start * 1000)), int(round(token.end * 1000))))
+                connection.executemany("INSERT INTO turns (broadcast_id, turn, speaker, start) VALUES (?, ?, ?, ?)", turns)
+                term_ids = self.get_term_ids(connection, {word[0] for word in words}, True)
+                connection.executemany("INSERT INTO words (broadcast_id, position, term_id, turn, start_ms, end_ms) VALUES (?, ?, ?, ?, ?, ?)",
+                    ((broadcast_id, position, term_ids[term], turn, start_ms, end_ms) for position, (term, turn, start_ms, end_ms) in enumerate(words)))
+                return True
+        finally:
+            connection.close()
+
+    def get_term_ids(self, connection, terms, create = False):
+        """Looks up the ids of terms
+
+        Args:
+            connection (sqlite3.Connection): open connection to the archive
+            terms (set): the terms
+            create (bool, optional): if missing terms are added. Defaults to False.
+
+        Returns:
+            dict: id of every term that is in the archive
+        """
+        terms = list(terms)
+        if create:
+            connection.executemany("INSERT OR IGNORE INTO terms (term) VALUES (?)", ((term,) for term in terms))
+        term_ids = {}
+        # sqlite limits the number of parameters of a statement
+        for start in range(0, len(terms), 500):
+            part = terms[start:start + 500]
+            rows = connection.execute("SELECT term, id FROM terms WHERE term IN ({})".format(",".join("?" * len(part))), part)
+            term_ids.update(rows)
+        return term_ids
+
+    def search(self, query, limit = 20, context = 5):
+        """Finds the occurrences of a word or a phrase, newest broadcasts first
+
+        Args:
+            query (str): the word or the consecutive words to find
+            limit (int, optional): maximum number of hits. Defaults to 20.
+            context (int, optional): number of words shown in front of and after each hit. Defaults to 5.
+
+        Returns:
+            list: file, start time in ms, speaker and text around the hit of every hit
+        """
+        terms = normalize(query)
+        if len(terms) == 0:
+            return []
+        connection = self.connect()
+        try:
+            term_ids = self.get_term_ids(connection, set(terms))
+            if len(term_ids) < len(set(terms)):
+                return []
+            # Every further word of a phrase has to follow at the next position of the same broadcast
+            joins = "".join(" JOIN words AS w{0} ON w{0}.broadcast_id = w0.broadcast_id AND w{0}.position = w0.position + {0} AND w{0}.term_id = ?".format(index)
+                for index in range(1, len(terms)))
+            rows = connection.execute("SELECT w0.broadcast_id, w0.position, w0.start_ms, b.file, t.speaker FROM words AS w0" + joins +
+                " JOIN broadcasts AS b ON b.id = w0.broadcast_id JOIN turns AS t ON t.broadcast_id = w0.broadcast_id AND t.turn = w0.turn"
+                " WHERE w0.term_id = ? ORDER BY w0.broadcast_id DESC, w0.position LIMIT ?",
+                [term_ids[term] for term in terms[1:]] + [term_ids[terms[0]], limit]).fetchall()
+            hits = []
+            for broadcast_id, position, start_ms, file, speaker in rows:
+                words = connection.execute("SELECT t.term FROM words AS w JOIN terms AS t ON t.id = w.term_id WHERE w.broadcast_id = ? AND w.position BETWEEN ? AND ? ORDER BY w.position",
+                    (broadcast_id, position - context, position + len(terms) - 1 + context)).fetchall()
+                hits.append((file, start_ms, speaker, " ".join(word for word, in words)))
+            return hits
+        finally:
+            connection.close()
+
+def normalize(text):
+    """Splits a text into the lower case terms used by the index
+
+    Args:
+        text (str): the text
+
+    Returns:
+        list: the terms of the text
+    """
+    return term_pattern.findall(text.lower())
+
+def format_time(ms):
+    """Formats a time in ms as hours, minutes, seconds and ms
+
+    Args:
+        ms (int): the time in ms
+
+    Returns:
+        str: the formatted time
+    """
+    return "{:02d}:{:02d}:{:02d}.{:03d}".format(ms // 3600000, ms // 60000 % 60, ms // 1000 % 60, ms % 1000)
+
+def setup_args():
+    """Sets up the flag arguments used by the search
+
+    Returns:
+        argparse.Namespace: Contains the arguments provided by the user
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-a", "--archive", dest = "archive", default = os.path.join("output", archive_file), help="Path to the archive")
+    parser.add_argument("-c", "--context", dest = "context", type = int, default = 5, help="Number of words shown in front of and after each hit")
+    parser.add_argument("-n", "--limit", dest = "limit", type = int, default = 20, help="Maximum number of hits")
+    parser.add_argument("-q", "--query", dest = "query", nargs = "+", required = True, help="Word or phrase to search for")
+    return parser.parse_args()
+
+def main():
+    """Prints the hits of a search in the archive"""
+    args = setup_args()
+    if not os.path.exists(args.archive):
+        print("{} doesn't exist".format(args.archive))
+        exit(2)
+    for file, start_ms, speaker, text in Archive(args.archive).search(" ".join(args.query), args.limit, args.context):
+        print("{} {} ({} ms) {}: {}".format(file, format_time(start_ms), start_ms, speaker, text))
+
+if __name__ == "__main__":
+    main()
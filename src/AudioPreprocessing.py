@@ -1,10 +1,21 @@
 import os
 import logging
 import numpy as np
-import librosa
-from scipy import signal
 from pydub import AudioSegment
 import glob
+import re
+import hashlib
+import subprocess
+import wave
+import traceback
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from Cache import Cache
+from Instrumentation import setup_instrumentation, get_instrumentation_settings, is_enabled, measure_stage, get_audio_duration
+
+template_bank_version = 3
 
 def setup_logging_preprocessing(log_level):
     """Sets up the logger for this module
@@ -26,6 +37,182 @@ def setup_logging_preprocessing(log_level):
     ch.setFormatter(formatter)
     logger.addHandler(ch)
     
+class RecordCollector(logging.Handler):
+    """Collects the log records of a worker process, so that they can be emitted together by the main process"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        #Arguments are merged into the message, because they might not be picklable
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+def preprocess_file(source_file, output_dir, trim_file, begin_templates = None, end_templates = None, correlation_threshold = -1, multi = False, streaming = False, coarse_candidates = 0, coarse_factor = 8, begin_window = None, end_window = None, cache_dir = None):
+    """Trims or converts a single source file, so that it can be used for the conversion to text
+
+    Args:
+        source_file (str): path to the source file
+        output_dir (str): path to the output directory
+        trim_file (bool): if the file should be trimmed
+        begin_templates (list, optional): templates of the sound samples played at the begin of a broadcast. Defaults to None.
+        end_templates (list, optional): templates of the sound samples played at the end of a broadcast. Defaults to None.
+        correlation_threshold (float, optional): minimum normalized correlation a sound sample has to have so that it is valid. Defaults to -1.
+        multi (bool, optional): if every broadcast of the file should be trimmed. Defaults to False.
+        streaming (bool, optional): if the file should be trimmed block by block. Defaults to False.
+        coarse_candidates (int, optional): number of candidates kept by the coarse search. Defaults to 0.
+        coarse_factor (int, optional): decimation factor of the coarse search. Defaults to 8.
+        begin_window (float, optional): seconds at the begin of the file that are searched for the begin sound samples first, None searches the whole file. Not used for multi. Defaults to None.
+        end_window (float, optional): seconds at the end of the file that are searched for the end sound samples first, None searches the whole file. Not used for multi. Defaults to None.
+        cache_dir (str, optional): path to the cache of the preprocessing results, None disables the cache. Defaults to None.
+
+    Returns:
+        bool: if the file was trimmed or converted successfully
+        list: paths to the created files
+    """
+    if cache_dir is None:
+        return process_file(source_file, output_dir, trim_file, begin_templates, end_templates, correlation_threshold, multi, streaming, coarse_candidates, coarse_factor, begin_window, end_window)
+    cache = Cache(cache_dir)
+    #Streaming only changes how the file is read, not the result. The trim settings are only part of the key if the file is trimmed
+    settings = {"trim_file": trim_file}
+    if trim_file:
+        settings["multi"] = multi
+        settings["correlation_threshold"] = correlation_threshold
+        settings["coarse_candidates"] = coarse_candidates if not multi else 0
+        settings["coarse_factor"] = coarse_factor if not multi and coarse_candidates > 0 else 0
+        #The windows are only part of the key if they are used, so that the entries of full searches stay valid
+        for name, window in [("begin_window", begin_window), ("end_window", end_window)]:
+            if not multi and window is not None:
+                settings[name] = window
+        settings["begin_templates"] = [str(template["file_hash"]) for template in begin_templates]
+        settings["end_templates"] = [str(template["file_hash"]) for template in end_templates]
+    key = cache.key("preprocess", hash_file(source_file), os.path.basename(source_file), settings)
+    is_processed, files = cache.load_files(key, output_dir)
+    #Failed trims stored by earlier versions are computed again as well
+    if is_processed:
+        logger.info("Using the cached preprocessing of {}".format(os.path.basename(source_file)))
+        return is_processed, files
+    is_processed, files = process_file(source_file, output_dir, trim_file, begin_templates, end_templates, correlation_threshold, multi, streaming, coarse_candidates, coarse_factor, begin_window, end_window)
+    #A failed trim is tried again on the next run instead of being replayed from the cache
+    if is_processed:
+        cache.save_files(key, is_processed, files)
+    return is_processed, files
+
+def process_file(source_file, output_dir, trim_file, begin_templates, end_templates, correlation_threshold, multi, streaming, coarse_candidates, coarse_factor, begin_window, end_window):
+    """Trims or converts a single source file without using the cache, see preprocess_file()
+
+    Returns:
+        bool: if the file was trimmed or converted successfully
+        list: paths to the created files
+    """
+    stage = "trim" if trim_file else "convert"
+    #Determining the duration of a compressed file needs ffprobe, so it is only done if the stage is measured
+    audio_duration = get_audio_duration(source_file) if is_enabled(stage) else None
+    with measure_stage(stage, source_file, audio_duration):
+        if trim_file and multi:
+            return trim_audio_segments(source_file, begin_templates, end_templates, output_dir, correlation_threshold, streaming = streaming)
+        elif trim_file:
+            is_trimmed, trimmed_file = trim_audio(source_file, begin_templates, end_templates, output_dir, correlation_threshold, streaming = streaming, coarse_candidates = coarse_candidates, coarse_factor = coarse_factor,
+                begin_window = begin_window, end_window = end_window)
+            return is_trimmed, [trimmed_file] if is_trimmed else []
+        return True, [change_rate(source_file, output_dir)]
+
+def preprocess_files(source_files, jobs, log_level, **options):
+    """Trims or converts the source files with a pool of jobs processes.
+    The log records of each file are emitted together once the file is finished.
+
+    Args:
+        source_files (list): paths to the source files
+        jobs (int): number of processes, 1 processes the files in the current process
+        log_level (str): the selected loglevel
+        **options: arguments passed to preprocess_file()
+
+    Yields:
+        str: path to the source file, in the order of source_files
+        bool: if the file was trimmed or converted successfully
+        list: paths to the created files
+        str: the error message if processing failed, otherwise None
+    """
+    if jobs <= 1:
+        for source_file in source_files:
+            try:
+                is_processed, files = preprocess_file(source_file, **options)
+                yield source_file, is_processed, files, None
+            except Exception as e:
+                logger.debug(traceback.format_exc())
+                yield source_file, False, [], str(e)
+        return
+    remaining_files = list(source_files)
+    is_isolated = False
+    while len(remaining_files) > 0:
+        # After a worker process died, the next file runs alone, since the pool can't tell which of its files killed the worker
+        batch = remaining_files[:1] if is_isolated else remaining_files
+        with ProcessPoolExecutor(max_workers=1 if is_isolated else jobs, initializer=setup_preprocessing_worker, initargs=(log_level, options, get_instrumentation_settings())) as executor:
+            futures = [executor.submit(preprocess_file_in_worker, source_file) for source_file in batch]
+            for index, (source_file, future) in enumerate(zip(batch, futures)):
+                try:
+                    is_processed, files, error, records = future.result()
+                except BrokenProcessPool as e:
+                    #A worker process died, e.g. killed for using too much memory, the remaining files are processed by a new pool
+                    if is_isolated:
+                        yield source_file, False, [], str(e)
+                        index += 1
+                    remaining_files = remaining_files[index:]
+                    is_isolated = not is_isolated
+                    break
+                except Exception as e:
+                    yield source_file, False, [], str(e)
+                    continue
+                for record in records:
+                    logger.handle(record)
+                yield source_file, is_processed, files, error
+            else:
+                remaining_files = remaining_files[len(batch):]
+                is_isolated = False
+
+def setup_preprocessing_worker(log_level, options, instrumentation_settings):
+    """Sets up a worker process of preprocess_files()
+
+    Args:
+        log_level (str): the selected loglevel
+        options (dict): arguments passed to preprocess_file()
+        instrumentation_settings (dict): settings of the instrumentation of the main process, see get_instrumentation_settings()
+    """
+    setup_instrumentation(**instrumentation_settings)
+    global logger
+    global worker_options
+    global worker_collector
+    worker_options = options
+    worker_collector = RecordCollector()
+    logger = logging.getLogger('AudioPreprocessing')
+    logger.propagate = False
+    logger.handlers = [worker_collector]
+    logger.setLevel(logging.DEBUG if log_level == "DEBUG" else logging.INFO)
+
+def preprocess_file_in_worker(source_file):
+    """Processes a single source file in a worker process of preprocess_files()
+
+    Args:
+        source_file (str): path to the source file
+
+    Returns:
+        bool: if the file was trimmed or converted successfully
+        list: paths to the created files
+        str: the error message if processing failed, otherwise None
+        list: the log records of the file
+    """
+    worker_collector.records = []
+    try:
+        is_processed, files = preprocess_file(source_file, **worker_options)
+        error = None
+    except Exception as e:
+        logger.debug(traceback.format_exc())
+        is_processed, files, error = False, [], str(e)
+    return is_processed, files, error, worker_collector.records
+
 def change_rate(source_file, output_dir, new_rate = 16000):
     """Stores the source_file in the intermeditate_dir_path as a .wav with new_rate as its sample rate
 
@@ -43,62 +230,402 @@ def change_rate(source_file, output_dir, new_rate = 16000):
     new_audio.export(output_file, format="wav", parameters=["-ac", str(1), "-ar", str(new_rate)])
     return output_file
 
-def trim_audio(source_file, begin_sounds_dir, end_sounds_dir, output_dir, correlation_threshold, new_rate = 16000):
+def trim_audio(source_file, begin_templates, end_templates, output_dir, correlation_threshold, new_rate = 16000, streaming = False, coarse_candidates = 0, coarse_factor = 8, begin_window = None, end_window = None):
     """Trims the source file and saves it with a new rate
 
     Args:
         source_file (str): path to the source file
-        begin_sounds_dir (str): path to the directory containing the sound samples played at the begin of a broadcast
-        end_sounds_dir (str): path to the directory containing the sound samples played at the end of a broadcast
+        begin_templates (list): templates of the sound samples played at the begin of a broadcast, see load_template_bank()
+        end_templates (list): templates of the sound samples played at the end of a broadcast, see load_template_bank()
         output_dir (str): path to the output directory
-        correlation_threshold (int): minimum correlation a sound sample has to have so that it is valid
+        correlation_threshold (float): minimum normalized correlation a sound sample has to have so that it is valid
         new_rate (int, optional): the new rate of the trimmed file. Defaults to 16000.
+        streaming (bool, optional): if the source file should be processed block by block instead of being loaded into memory. Defaults to False.
+        coarse_candidates (int, optional): number of candidates kept by the coarse search, 0 searches the whole file at full resolution. Not used when streaming. Defaults to 0.
+        coarse_factor (int, optional): decimation factor of the coarse search. Defaults to 8.
+        begin_window (float, optional): seconds at the begin of the file that are searched for the begin sound samples, None searches the whole file. Defaults to None.
+        end_window (float, optional): seconds at the end of the file, but after the begin, that are searched for the end sound samples, None searches the whole file. Defaults to None.
 
     Returns:
         bool: if trimming was successful
         str: path to the trimmed file
     """
     logger.info("Trimming file {}".format(os.path.basename(source_file)))
-    y_source_audio, sr_source_audio = librosa.load(source_file)
-    
-    #Find the begin sample that has the highest correlation with the source audio 
-    begin_max_correlation, begin_offset, begin_file = find_best_correlation(y_source_audio, sr_source_audio, begin_sounds_dir, correlation_threshold, True)
+    if template_sample_rate(begin_templates + end_templates) != new_rate:
+        raise ValueError("Templates have to be sampled with the new rate of {}".format(new_rate))
+    sr_source_audio = new_rate
+
+    #Only the windows are decoded, the whole file is only searched if no sound sample in a window is valid
+    begin_result = None
+    end_result = None
+    if begin_window is not None:
+        begin_result = search_window(source_file, begin_templates, 0, begin_window, sr_source_audio, correlation_threshold, True)
+        if begin_result[0] <= 0:
+            logger.info("No valid begin sound sample in the first {}s, searching the whole file".format(begin_window))
+            begin_result = None
+    duration = get_source_duration(source_file) if end_window is not None else None
+    if end_window is not None and duration is None:
+        logger.warning("Duration of {} is unknown, searching the whole file for the end sound samples".format(source_file))
+    if duration is not None:
+        window_start = max(duration - end_window, begin_result[1] if begin_result is not None else 0)
+        end_result = search_window(source_file, end_templates, window_start, None, sr_source_audio, correlation_threshold)
+        if end_result[0] <= 0:
+            logger.info("No valid end sound sample in the last {}s, searching the whole file".format(end_window))
+            end_result = None
+
+    open_blocks = None
+    if begin_result is None or end_result is None:
+        if streaming:
+            #The source file is read twice, but only a few blocks are kept in memory
+            open_blocks = lambda: read_audio_blocks(source_file, new_rate)
+        else:
+            #The decoded audio is used for the correlation search and for the trimmed file
+            samples = decode_audio(source_file, new_rate)
+            open_blocks = lambda: [samples]
+        search_begin_templates = begin_templates if begin_result is None else []
+        search_end_templates = end_templates if end_result is None else []
+
+        #Correlate all begin and end samples that weren't found in their window with the source audio in one pass
+        if streaming or coarse_candidates == 0:
+            peaks = best_peaks(match_templates(open_blocks(), search_begin_templates + search_end_templates))
+        else:
+            peaks = find_peaks_coarse_to_fine(samples, search_begin_templates + search_end_templates, coarse_candidates, coarse_factor)
+
+        #Find the begin sample that has the highest correlation with the source audio
+        if begin_result is None:
+            begin_result = find_best_correlation(peaks[:len(search_begin_templates)], sr_source_audio, begin_templates, correlation_threshold, True)
+        #Find the end sample that has the highest correlation with the source audio
+        if end_result is None:
+            end_result = find_best_correlation(peaks[len(search_begin_templates):], sr_source_audio, end_templates, correlation_threshold)
+
+    begin_max_correlation, begin_offset, begin_file = begin_result
     if begin_max_correlation <= 0:
         logger.error("No valid begin sound sample")
         return False, source_file
     logger.debug("Begin sound file is: " + os.path.basename(begin_file))
-    
-    #Find the end sample that has the highest correlation with the source audio 
-    end_max_correlation, end_offset, end_file = find_best_correlation(y_source_audio, sr_source_audio, end_sounds_dir, correlation_threshold)
+
+    end_max_correlation, end_offset, end_file = end_result
     if end_max_correlation <= 0:
         logger.error("No valid end sound sample")
         return False, source_file
     logger.debug("End sound file is: " + os.path.basename(end_file))
 
-    begin_time = begin_offset * 1000
-    end_time = end_offset * 1000
+    begin_sample = int(round(begin_offset * sr_source_audio))
+    end_sample = int(round(end_offset * sr_source_audio))
 
     file_name = os.path.basename(source_file).replace(".mp3", "")
     output_file = os.path.join(output_dir, file_name + "_trimmed.wav") 
 
     #Trimming of the audio at the locations of the begin and end sample
-    new_audio = AudioSegment.from_mp3(source_file)
-    if(begin_time >= end_time):
+    if(begin_sample >= end_sample):
         logger.error("Audio could not be trimmed")
         return False, source_file
-    new_audio = new_audio[begin_time:end_time]
-    new_audio.export(output_file, format="wav", parameters=["-ac", str(1), "-ar", str(new_rate)])
+    if open_blocks is None:
+        #Only the broadcast itself is decoded
+        write_wav(output_file, decode_audio(source_file, new_rate, begin_sample / sr_source_audio, (end_sample - begin_sample) / sr_source_audio), new_rate)
+    else:
+        write_wav_ranges([output_file], open_blocks(), new_rate, [(begin_sample, end_sample)])
     return True, output_file
+
+def search_window(source_file, templates, start, duration, sample_rate, correlation_threshold, bIsBeginn = False):
+    """Searches a part of the source file for the sound sample with the highest correlation, only this part is decoded
+
+    Args:
+        source_file (str): path to the source file
+        templates (list): templates of the sound samples, see load_template_bank()
+        start (float): time in seconds at which the part starts
+        duration (float): length of the part in seconds, None for the rest of the file
+        sample_rate (int): sample rate of the templates
+        correlation_threshold (float): minimum normalized correlation a sound sample has to have so that it is valid
+        bIsBeginn (bool, optional): if the templates contain sound samples played at the beginning of broadcast. Defaults to False.
+
+    Returns:
+        float: highest correlation
+        float: offset in the whole file at which the highest correlation is located
+        str: path to the file with the highest correlation
+    """
+    first_sample = int(round(start * sample_rate))
+    samples = decode_audio(source_file, sample_rate, first_sample / sample_rate, duration)
+    #The positions are moved from the part to the whole file before they are rounded to offsets
+    peaks = [(correlation, position + first_sample if position >= 0 else position) for correlation, position in best_peaks(match_templates([samples], templates))]
+    return find_best_correlation(peaks, sample_rate, templates, correlation_threshold, bIsBeginn)
+
+def trim_audio_segments(source_file, begin_templates, end_templates, output_dir, correlation_threshold, new_rate = 16000, streaming = False):
+    """Trims every broadcast of the source file and saves each of them with a new rate
+
+    Args:
+        source_file (str): path to the source file
+        begin_templates (list): templates of the sound samples played at the begin of a broadcast, see load_template_bank()
+        end_templates (list): templates of the sound samples played at the end of a broadcast, see load_template_bank()
+        output_dir (str): path to the output directory
+        correlation_threshold (float): minimum normalized correlation a sound sample has to have so that it is valid
+        new_rate (int, optional): the new rate of the trimmed files. Defaults to 16000.
+        streaming (bool, optional): if the source file should be processed block by block instead of being loaded into memory. Defaults to False.
+
+    Returns:
+        bool: if at least one broadcast was trimmed
+        list: paths to the trimmed files
+    """
+    logger.info("Trimming all broadcasts of file {}".format(os.path.basename(source_file)))
+    if template_sample_rate(begin_templates + end_templates) != new_rate:
+        raise ValueError("Templates have to be sampled with the new rate of {}".format(new_rate))
+    if streaming:
+        open_blocks = lambda: read_audio_blocks(source_file, new_rate)
+    else:
+        samples = decode_audio(source_file, new_rate)
+        open_blocks = lambda: [samples]
+
+    #Find every occurrence of all begin and end samples in one pass
+    candidates = match_templates(open_blocks(), begin_templates + end_templates, None, correlation_threshold)
+    begin_peaks = suppress_peaks(candidates[:len(begin_templates)], begin_templates, True)
+    end_peaks = suppress_peaks(candidates[len(begin_templates):], end_templates)
+    logger.debug("Found {} begin and {} end sound samples".format(len(begin_peaks), len(end_peaks)))
+    ranges = pair_peaks(begin_peaks, end_peaks)
+    if len(ranges) == 0:
+        logger.error("No broadcast found")
+        return False, []
+
+    file_name = os.path.basename(source_file).replace(".mp3", "")
+    output_files = []
+    for index, (begin_sample, end_sample) in enumerate(ranges):
+        logger.debug("Broadcast {} lasts from {:.2f}s to {:.2f}s".format(index + 1, begin_sample / new_rate, end_sample / new_rate))
+        output_files.append(os.path.join(output_dir, "{}_trimmed_{:02d}.wav".format(file_name, index + 1)))
+    write_wav_ranges(output_files, open_blocks(), new_rate, ranges)
+    logger.info("Found {} broadcasts".format(len(output_files)))
+    return True, output_files
+
+def suppress_peaks(candidates, templates, bIsBeginn = False):
+    """Combines the peaks of all templates and keeps only the highest one of overlapping peaks
+
+    Args:
+        candidates (list): peak candidates of each template, see match_templates()
+        templates (list): templates of the sound samples, see load_template_bank()
+        bIsBeginn (bool, optional): if the templates contain sound samples played at the beginning of broadcast. Defaults to False.
+
+    Returns:
+        list: correlation and position of the remaining peaks, sorted by position.
+            For sound samples played at the beginning, the position is at the end of the sound sample.
+    """
+    peaks = []
+    for template_peaks, template in zip(candidates, templates):
+        shift = len(template["samples"]) if bIsBeginn else 0
+        peaks += [(correlation, index + shift) for correlation, index in template_peaks]
+    min_distance = max(len(template["samples"]) for template in templates)
+    return sorted(merge_peaks([], peaks, None, min_distance), key=lambda peak: peak[1])
+
+def pair_peaks(begin_peaks, end_peaks):
+    """Pairs every begin peak with the first end peak before the next begin peak
+
+    Args:
+        begin_peaks (list): correlation and position of the begin peaks, sorted by position
+        end_peaks (list): correlation and position of the end peaks, sorted by position
+
+    Returns:
+        list: index of the first sample and index after the last sample of each broadcast
+    """
+    ranges = []
+    end_index = 0
+    for index, (_, begin_sample) in enumerate(begin_peaks):
+        next_begin_sample = begin_peaks[index + 1][1] if index + 1 < len(begin_peaks) else float("inf")
+        while end_index < len(end_peaks) and end_peaks[end_index][1] <= begin_sample:
+            end_index += 1
+        if end_index < len(end_peaks) and end_peaks[end_index][1] < next_begin_sample:
+            ranges.append((begin_sample, end_peaks[end_index][1]))
+            end_index += 1
+        else:
+            logger.warning("No end sound sample found for the broadcast at {} samples".format(begin_sample))
+    return ranges
+
+def decode_audio(source_file, sample_rate = 16000, start = 0, duration = None):
+    """Decodes the source file with ffmpeg to mono 16 bit samples with the given sample rate.
+    A part of the file is decoded by seeking to its start, matching .wav files are memory-mapped instead.
+
+    Args:
+        source_file (str): path to the source file
+        sample_rate (int, optional): sample rate of the decoded audio. Defaults to 16000.
+        start (float, optional): time in seconds at which the decoding starts. Defaults to 0.
+        duration (float, optional): seconds to decode, None decodes until the end of the file. Defaults to None.
+
+    Returns:
+        np.ndarray: decoded int16 samples
+    """
+    if ".wav" in source_file and (start > 0 or duration is not None):
+        samples, wav_rate = map_wav(source_file)
+        if wav_rate == sample_rate:
+            first_sample = int(round(start * sample_rate))
+            last_sample = len(samples) if duration is None else first_sample + int(round(duration * sample_rate))
+            return samples[first_sample:last_sample]
+    seek = ["-ss", str(start)] if start > 0 else []
+    if duration is not None:
+        seek += ["-t", str(duration)]
+    command = [AudioSegment.converter, "-v", "error"] + seek + ["-i", source_file, "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate), "-"]
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise RuntimeError("Decoding of {} failed: {}".format(source_file, process.stderr.decode(errors="replace").strip()))
+    return np.frombuffer(process.stdout, dtype=np.int16)
+
+def get_source_duration(source_file):
+    """Returns the duration of the source file from its header, from ffprobe or from the header ffmpeg reads before decoding,
+    so that the duration is known even if ffprobe isn't installed
+
+    Args:
+        source_file (str): path to the source file
+
+    Returns:
+        float: duration in seconds, None if it can't be determined
+    """
+    duration = get_audio_duration(source_file)
+    if duration is not None:
+        return duration
+    try:
+        #Without an output file ffmpeg only prints the information of the input and exits with an error
+        process = subprocess.run([AudioSegment.converter, "-hide_banner", "-i", source_file], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except OSError:
+        return None
+    return parse_ffmpeg_duration(process.stderr.decode(errors="replace"))
+
+def parse_ffmpeg_duration(output):
+    """Reads the duration of the input from the output of ffmpeg
+
+    Args:
+        output (str): the information ffmpeg printed about the input
+
+    Returns:
+        float: duration in seconds, None if the output contains no duration
+    """
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", output)
+    if match is None:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def read_audio_blocks(source_file, sample_rate = 16000, block_size = 1 << 20):
+    """Reads the source file block by block as mono 16 bit samples with the given sample rate.
+    Matching .wav files are memory-mapped, all other files are decoded through a pipe from ffmpeg.
+
+    Args:
+        source_file (str): path to the source file
+        sample_rate (int, optional): sample rate of the decoded audio. Defaults to 16000.
+        block_size (int, optional): number of samples per block. Defaults to 1 << 20.
+
+    Yields:
+        np.ndarray: consecutive blocks of int16 samples
+    """
+    if ".wav" in source_file:
+        samples, wav_rate = map_wav(source_file)
+        if wav_rate == sample_rate:
+            for start in range(0, len(samples), block_size):
+                yield samples[start:start + block_size]
+            return
+    command = [AudioSegment.converter, "-v", "error", "-i", source_file, "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate), "-"]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while True:
+            data = process.stdout.read(2 * block_size)
+            if len(data) == 0:
+                break
+            yield np.frombuffer(data[:len(data) - len(data) % 2], dtype=np.int16)
+        error = process.stderr.read()
+        if process.wait() != 0:
+            raise RuntimeError("Decoding of {} failed: {}".format(source_file, error.decode(errors="replace").strip()))
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+def map_wav(source_file):
+    """Memory-maps the samples of a mono 16 bit PCM .wav file
+
+    Args:
+        source_file (str): path to the .wav file
+
+    Returns:
+        np.ndarray: read-only int16 samples of the file
+        int: sample rate of the file
+    """
+    with open(source_file, "rb") as f:
+        header = f.read(12)
+        if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            raise ValueError("{} is not a .wav file".format(source_file))
+        sample_rate = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError("{} contains no data chunk".format(source_file))
+            chunk_id = chunk_header[:4]
+            chunk_size = int.from_bytes(chunk_header[4:], "little")
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size + chunk_size % 2)
+                audio_format = int.from_bytes(fmt[0:2], "little")
+                channels = int.from_bytes(fmt[2:4], "little")
+                sample_rate = int.from_bytes(fmt[4:8], "little")
+                bits = int.from_bytes(fmt[14:16], "little")
+                if audio_format != 1 or channels != 1 or bits != 16:
+                    raise ValueError("{} is not a mono 16 bit PCM .wav file".format(source_file))
+            elif chunk_id == b"data":
+                if sample_rate is None:
+                    raise ValueError("{} contains no format chunk".format(source_file))
+                offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+    #The size of the data chunk is not reliable for files that were written as a stream
+    sample_count = min(chunk_size, os.path.getsize(source_file) - offset) // 2
+    if sample_count == 0:
+        return np.zeros(0, dtype=np.int16), sample_rate
+    return np.memmap(source_file, dtype="<i2", mode="r", offset=offset, shape=(sample_count,)), sample_rate
+
+def write_wav(output_file, samples, sample_rate):
+    """Writes mono int16 samples to a .wav file
+
+    Args:
+        output_file (str): path to the output file
+        samples (np.ndarray): int16 samples to write
+        sample_rate (int): sample rate of the samples
+    """
+    write_wav_ranges([output_file], [samples], sample_rate, [(0, len(samples))])
+
+def write_wav_ranges(output_files, blocks, sample_rate, ranges):
+    """Writes the samples of each range of consecutive blocks to its own .wav file
+
+    Args:
+        output_files (list): paths to the output files, one for each range
+        blocks (iterable): consecutive blocks of int16 samples
+        sample_rate (int): sample rate of the samples
+        ranges (list): index of the first sample and index after the last sample of each range
+    """
+    wave_files = []
+    try:
+        for output_file in output_files:
+            wf = wave.open(output_file, "wb")
+            wave_files.append(wf)
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(sample_rate)
+        last_sample = max(end_sample for _, end_sample in ranges)
+        position = 0
+        for block in blocks:
+            for wf, (begin_sample, end_sample) in zip(wave_files, ranges):
+                start = max(begin_sample - position, 0)
+                end = min(end_sample - position, len(block))
+                if start < end:
+                    wf.writeframes(np.ascontiguousarray(block[start:end], dtype="<i2").tobytes())
+            position += len(block)
+            if position >= last_sample:
+                break
+    finally:
+        for wf in wave_files:
+            wf.close()
     
-def find_best_correlation(y_source_audio, sr_source_audio, sounds_dir, threshold, bIsBeginn = False):
-    """Finds the time in the source_audio with the highest correlation with a sound sample in the sourc_dir
+def find_best_correlation(peaks, sr_source_audio, templates, threshold, bIsBeginn = False):
+    """Finds the time in the source_audio with the highest correlation with one of the templates
 
     Args:
-        y_source_audio (np.ndarray): audio time series of source_audio
+        peaks (list): highest normalized correlation and its position for each template, see best_peaks()
         sr_source_audio (int): sampling rate of source_audio
-        sounds_dir (str): path to the directory containing the sound samples
-        threshold (int): values below this threshold are not valid
-        bIsBeginn (bool, optional): if sounds_dir contains sound samples played at the beginning of broadcast. Defaults to False.
+        templates (list): templates of the sound samples, see load_template_bank()
+        threshold (float): values below this threshold are not valid
+        bIsBeginn (bool, optional): if the templates contain sound samples played at the beginning of broadcast. Defaults to False.
 
     Returns:
         float: highest correlation
@@ -108,44 +635,458 @@ def find_best_correlation(y_source_audio, sr_source_audio, sounds_dir, threshold
     max_correlation = -1
     offset = -1
     file = None
-    sound_files = glob.glob(os.path.join(sounds_dir, "*"))
-    #Iteration through all .mp3 in the provided directory
-    for sound_file in sound_files:
-        if ".mp3" in sound_file:
-            y_current_signal, sr_current_signal = librosa.load(sound_file)
-            current_correlation, current_offset = find_offset(y_source_audio, sr_source_audio, y_current_signal, threshold, os.path.basename(sound_file)) 
-            if bIsBeginn:
-                current_offset += librosa.get_duration(y=y_current_signal, sr=sr_current_signal)
-            #Update output if higher correlation is found
-            if(current_correlation > max_correlation):
-                max_correlation = current_correlation
-                offset = current_offset
-                file = sound_file
+    #Iteration through all templates of the bank
+    for peak, template in zip(peaks, templates):
+        current_correlation, current_offset = find_offset(peak, sr_source_audio, template, threshold)
+        if bIsBeginn:
+            current_offset += template["duration"]
+        #Update output if higher correlation is found
+        if(current_correlation > max_correlation):
+            max_correlation = current_correlation
+            offset = current_offset
+            file = template["source_file"]
     return max_correlation, offset, file
 
-def find_offset(y_source_audio, sr_source_audio, y_sound_sample, correlation_threshold, name):
-    """Finds the highest correlation between a single sound sample and the source audio
+def find_offset(peak, sr_source_audio, template, correlation_threshold):
+    """Checks the highest correlation between a single sound sample and the source audio
 
     Args:
-        y_source_audio (np.ndarray): audio time series of source_audio
+        peak (tuple): highest normalized correlation and its position, see best_peaks()
         sr_source_audio (int): sampling rate of source_audio
-        y_sound_sample (np.ndarray): values below this threshold are not valid
-        correlation_threshold (int): values below this threshold are not valid
-        name (str): the name of the current sample file
+        template (dict): template of the sound sample, see load_template_bank()
+        correlation_threshold (float): values below this threshold are not valid
 
     Returns:
         float: highest correlation
         float: offset at which the highest correlation is located
     """
-    correlation = signal.correlate(y_source_audio, y_sound_sample, mode='valid', method='fft')
-    max_correlation = max(correlation)
+    name = os.path.basename(template["source_file"])
+    max_correlation, peak_index = peak
+    if peak_index < 0:
+        logger.debug("Source audio is shorter than {}".format(name))
+        return -1, -1
     #Excluded files below the correlation threshold if it is provided
     if  correlation_threshold != -1 and max_correlation < correlation_threshold:
         logger.debug("Couldn't find valid trimming point for {}".format(name))
         return -1, -1
     else:
         logger.debug("Current correlation for {} is: {}".format(name ,max_correlation))
-    peak = np.argmax(correlation)
-    offset = round(peak/sr_source_audio, 2)  
+    offset = round(peak_index/sr_source_audio, 2)  
     return max_correlation, offset
 
+def match_templates(blocks, templates, candidate_count = 1, threshold = None):
+    """Computes the normalized cross-correlation of all templates with the source audio in a single overlap-save pass.
+    Every block of the source audio is transformed once and correlated with the spectra of all templates at the same time.
+    Only the running peak candidates of every template are kept, so the memory depends on the template length and not on the length of the source audio.
+
+    Args:
+        blocks (iterable): consecutive blocks of samples of the source audio
+        templates (list): templates of the sound samples, see load_template_bank()
+        candidate_count (int, optional): number of peaks that are kept for each template, None for no limit. Defaults to 1.
+        threshold (float, optional): peaks below this threshold are not kept. Defaults to None.
+
+    Returns:
+        list: highest normalized correlations and their positions in samples for each template, sorted by correlation.
+            Peaks of a template are at least one template length apart. The list is empty if the source audio is shorter than the template.
+    """
+    matcher = TemplateMatcher(templates, candidate_count, threshold)
+    for block in blocks:
+        matcher.feed(block)
+    matcher.finish()
+    return matcher.candidates
+
+class TemplateMatcher:
+    """Incremental form of match_templates(), which gets the source audio block by block as it arrives"""
+
+    def __init__(self, templates, candidate_count = 1, threshold = None):
+        """Prepares the spectra of the templates
+
+        Args:
+            templates (list): templates of the sound samples, see load_template_bank()
+            candidate_count (int, optional): number of peaks that are kept for each template, None for no limit. Defaults to 1.
+            threshold (float, optional): peaks below this threshold are not kept. Defaults to None.
+        """
+        self.fft_size = max(template["fft_size"] for template in templates)
+        self.spectra = np.stack([get_template_spectrum(template, self.fft_size) for template in templates])
+        self.template_lens = np.array([len(template["samples"]) for template in templates])
+        self.step = int(self.fft_size - self.template_lens.max() + 1)
+        self.candidates = [[] for _ in templates]
+        self.candidate_count = candidate_count
+        self.threshold = threshold
+        self.full_counts = np.full(len(templates), self.step)
+        self.buffer = np.zeros(0, dtype=np.float32)
+        #Position of the first sample of the buffer, all earlier positions are correlated
+        self.position = 0
+
+    def feed(self, block):
+        """Correlates the templates with every position that is complete with the new block
+
+        Args:
+            block (np.ndarray): next samples of the source audio
+        """
+        self.buffer = block if len(self.buffer) == 0 else np.concatenate((self.buffer, block))
+        while len(self.buffer) >= self.fft_size:
+            update_peaks(self.buffer[:self.fft_size], self.position, self.full_counts, self.spectra, self.template_lens, self.candidates, self.candidate_count, self.threshold)
+            self.buffer = self.buffer[self.step:]
+            self.position += self.step
+
+    def finish(self):
+        """Correlates the templates with the remaining positions at the end of the source audio"""
+        #The last positions only have as many samples left as the source audio provides
+        while len(self.buffer) >= self.template_lens.min():
+            counts = np.minimum(self.step, len(self.buffer) - self.template_lens + 1)
+            update_peaks(self.buffer, self.position, counts, self.spectra, self.template_lens, self.candidates, self.candidate_count, self.threshold)
+            self.buffer = self.buffer[self.step:]
+            self.position += self.step
+
+    def pop_final_peaks(self):
+        """Removes and returns the peaks that can't be replaced by a higher peak of the audio still to come,
+        because the next positions to correlate are at least one template length away
+
+        Returns:
+            list: correlation and position of the final peaks of each template
+        """
+        final_peaks = []
+        for row, template_len in enumerate(self.template_lens):
+            final_peaks.append([peak for peak in self.candidates[row] if peak[1] + template_len <= self.position])
+            self.candidates[row] = [peak for peak in self.candidates[row] if peak[1] + template_len > self.position]
+        return final_peaks
+
+def update_peaks(source_block, position, counts, spectra, template_lens, candidates, candidate_count, threshold):
+    """Correlates one block of the source audio with all templates and updates their running peak candidates
+
+    Args:
+        source_block (np.ndarray): samples of the source audio, at most as long as the fft size
+        position (int): position of the first sample of source_block in the source audio
+        counts (np.ndarray): number of valid positions in the block for each template
+        spectra (np.ndarray): conjugated spectra of the normalized templates, see compute_spectrum()
+        template_lens (np.ndarray): number of samples of each template
+        candidates (list): peak candidates found so far for each template, updated in place
+        candidate_count (int): number of peaks that are kept for each template, None for no limit
+        threshold (float): peaks below this threshold are not kept, None to keep all
+    """
+    fft_size = 2 * (spectra.shape[1] - 1)
+    step = counts.max()
+    block = np.zeros(fft_size, dtype=np.float64)
+    block[:len(source_block)] = source_block
+    numerators = np.fft.irfft(spectra * np.fft.rfft(block), fft_size, axis=-1)[:, :step]
+    #Running sums for the energy of the source audio below each template position
+    sums = np.concatenate(([0.0], np.cumsum(block)))
+    square_sums = np.concatenate(([0.0], np.cumsum(block * block)))
+    for template_len in np.unique(template_lens):
+        rows = np.flatnonzero(template_lens == template_len)
+        count = counts[rows[0]]
+        if count <= 0:
+            continue
+        window_sums = sums[template_len:template_len + count] - sums[:count]
+        energies = square_sums[template_len:template_len + count] - square_sums[:count] - window_sums * window_sums / template_len
+        norms = np.sqrt(np.maximum(energies, 0))
+        correlations = np.divide(numerators[rows, :count], norms, out=np.zeros((len(rows), count)), where=norms > 1e-6)
+        for row, row_correlations in zip(rows, correlations):
+            block_peaks = select_peaks(row_correlations, candidate_count, template_len, threshold)
+            block_peaks = [(correlation, position + index) for correlation, index in block_peaks]
+            candidates[row] = merge_peaks(candidates[row], block_peaks, candidate_count, template_len)
+
+def select_peaks(correlations, candidate_count, min_distance, threshold = None):
+    """Selects the highest peaks of a correlation that are at least min_distance apart
+
+    Args:
+        correlations (np.ndarray): correlation for each position
+        candidate_count (int): maximum number of peaks, None for no limit
+        min_distance (int): minimum distance between two peaks in samples
+        threshold (float, optional): peaks below this threshold are not selected. Defaults to None.
+
+    Returns:
+        list: correlation and position of the peaks, sorted by correlation
+    """
+    if candidate_count == 1 and threshold is None:
+        index = int(np.argmax(correlations))
+        return [(float(correlations[index]), index)]
+    correlations = correlations.copy()
+    peaks = []
+    while candidate_count is None or len(peaks) < candidate_count:
+        index = int(np.argmax(correlations))
+        if correlations[index] == -np.inf or (threshold is not None and correlations[index] < threshold):
+            break
+        peaks.append((float(correlations[index]), index))
+        correlations[max(index - min_distance + 1, 0):index + min_distance] = -np.inf
+    return peaks
+
+def merge_peaks(peaks, new_peaks, candidate_count, min_distance):
+    """Merges two lists of peaks, so that only the highest peaks that are at least min_distance apart are kept
+
+    Args:
+        peaks (list): correlation and position of the current peaks
+        new_peaks (list): correlation and position of the new peaks
+        candidate_count (int): maximum number of peaks, None for no limit
+        min_distance (int): minimum distance between two peaks in samples
+
+    Returns:
+        list: correlation and position of the merged peaks, sorted by correlation
+    """
+    merged = []
+    #On equal correlations the earlier peak is kept
+    for peak in sorted(peaks + new_peaks, key=lambda peak: -peak[0]):
+        if candidate_count is not None and len(merged) == candidate_count:
+            break
+        if all(abs(peak[1] - kept[1]) >= min_distance for kept in merged):
+            merged.append(peak)
+    return merged
+
+def best_peaks(candidates):
+    """Returns the highest peak of every template
+
+    Args:
+        candidates (list): peak candidates of each template, see match_templates()
+
+    Returns:
+        list: highest correlation and its position for each template, (-1, -1) if a template has no peak
+    """
+    return [peaks[0] if len(peaks) > 0 else (-1, -1) for peaks in candidates]
+
+def find_peaks_coarse_to_fine(samples, templates, candidate_count, factor):
+    """Finds the highest peak of every template in two stages.
+    The templates are first correlated with a decimated version of the source audio to find candidate windows.
+    The exact positions are then searched at the full sample rate only inside of these windows.
+
+    Args:
+        samples (np.ndarray): samples of the source audio
+        templates (list): templates of the sound samples, see load_template_bank()
+        candidate_count (int): number of candidate windows that are kept for each template by the first stage
+        factor (int): decimation factor of the first stage
+
+    Returns:
+        list: highest correlation and its position for each template, (-1, -1) if a template has no peak
+    """
+    # scipy.signal takes long to import and is only needed by the coarse search
+    from scipy import signal
+    decimated_samples = signal.resample_poly(np.asarray(samples, dtype=np.float32), 1, factor)
+    decimated_templates = [decimate_template(template, factor) for template in templates]
+    coarse_candidates = match_templates([decimated_samples], decimated_templates, candidate_count)
+
+    peaks = []
+    radius = 4 * factor
+    for template, candidates in zip(templates, coarse_candidates):
+        template_len = len(template["samples"])
+        windows = []
+        for _, index in candidates:
+            begin = max(index * factor - radius, 0)
+            end = min(index * factor + radius + template_len, len(samples))
+            if end - begin >= template_len:
+                windows.append((begin, end))
+        #Candidates of the same window only have to be searched once
+        fine_peaks = []
+        for begin, end in sorted(set(windows)):
+            window_peaks = match_templates([samples[begin:end]], [template])[0]
+            fine_peaks += [(correlation, begin + index) for correlation, index in window_peaks]
+        fine_peaks = merge_peaks([], fine_peaks, 1, template_len)
+        peaks.append(fine_peaks[0] if len(fine_peaks) > 0 else (-1, -1))
+    return peaks
+
+def decimate_template(template, factor):
+    """Creates a decimated version of a template for the coarse search
+
+    Args:
+        template (dict): template of the sound sample, see load_template_bank()
+        factor (int): decimation factor
+
+    Returns:
+        dict: the decimated template
+    """
+    from scipy import signal
+    samples = signal.resample_poly(template["samples"], 1, factor)
+    fft_size = get_fft_size(len(samples))
+    return {
+        "source_file": template["source_file"],
+        "sample_rate": template["sample_rate"] // factor,
+        "samples": samples,
+        "duration": template["duration"],
+        "fft_size": fft_size,
+        "spectrum": compute_spectrum(samples, fft_size),
+    }
+
+def get_template_spectrum(template, fft_size):
+    """Returns the spectrum of the normalized template for the given fft size
+
+    Args:
+        template (dict): template of the sound sample, see load_template_bank()
+        fft_size (int): size of the fft
+
+    Returns:
+        np.ndarray: conjugated spectrum of the zero mean, unit norm template
+    """
+    if template["fft_size"] == fft_size:
+        return template["spectrum"]
+    return compute_spectrum(template["samples"], fft_size)
+
+def compute_spectrum(samples, fft_size):
+    """Computes the conjugated spectrum of the zero mean, unit norm version of the samples
+
+    Args:
+        samples (np.ndarray): samples of the sound sample
+        fft_size (int): size of the fft
+
+    Returns:
+        np.ndarray: conjugated spectrum used for the normalized cross-correlation
+    """
+    normalized = samples - np.mean(samples)
+    norm = np.linalg.norm(normalized)
+    if norm > 0:
+        normalized = normalized / norm
+    return np.conj(np.fft.rfft(normalized, fft_size)).astype(np.complex64)
+
+def template_sample_rate(templates):
+    """Returns the sample rate shared by all templates
+
+    Args:
+        templates (list): templates of the sound samples, see load_template_bank()
+
+    Returns:
+        int: sample rate of the templates
+    """
+    sample_rates = set(template["sample_rate"] for template in templates)
+    if len(sample_rates) != 1:
+        raise ValueError("Templates need exactly one common sample rate, got {}".format(sorted(sample_rates)))
+    return sample_rates.pop()
+
+def load_template_bank(sounds_dir, bank_dir, sample_rate = 16000):
+    """Loads the templates of all .mp3 sound samples in sounds_dir.
+    Decoded samples and their spectra are stored in bank_dir and only recomputed if a sound sample changed.
+
+    Args:
+        sounds_dir (str): path to the directory containing the sound samples
+        bank_dir (str): path to the directory in which the templates are stored
+        sample_rate (int, optional): sample rate the templates are resampled to. Defaults to 16000.
+
+    Returns:
+        list: templates containing the samples, their spectrum and the metadata of each sound sample
+    """
+    if not os.path.exists(bank_dir):
+        os.makedirs(bank_dir)
+    templates = []
+    for sound_file in sorted(glob.glob(os.path.join(sounds_dir, "*"))):
+        if ".mp3" in sound_file:
+            templates.append(load_template(sound_file, bank_dir, sample_rate))
+    logger.debug("Loaded {} templates from {}".format(len(templates), sounds_dir))
+    return templates
+
+def load_template(sound_file, bank_dir, sample_rate):
+    """Loads the template of a single sound sample from the bank or creates it if it is missing or outdated
+
+    Args:
+        sound_file (str): path to the sound sample
+        bank_dir (str): path to the directory in which the templates are stored
+        sample_rate (int): sample rate the template is resampled to
+
+    Returns:
+        dict: the template of the sound sample
+    """
+    sound_file = os.path.abspath(sound_file)
+    path_hash = hashlib.sha1(sound_file.encode("utf-8")).hexdigest()[:12]
+    bank_file = os.path.join(bank_dir, "{}_{}_{}.npz".format(os.path.basename(sound_file).replace(".mp3", ""), path_hash, sample_rate))
+    stat = os.stat(sound_file)
+    file_hash = None
+    template = None
+    if os.path.exists(bank_file):
+        try:
+            with np.load(bank_file) as stored:
+                template = {key: stored[key] for key in stored.files}
+            int(template["version"])
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as e:
+            #A damaged template is created again
+            logger.warning("Can't read {} from the template bank: {}".format(os.path.basename(bank_file), e))
+            template = None
+    if template is not None and int(template["version"]) == template_bank_version:
+        if float(template["mtime"]) == stat.st_mtime and int(template["size"]) == stat.st_size:
+            return to_template(template, sound_file)
+        #The modification time changed, but the content might still be the same
+        file_hash = hash_file(sound_file)
+        if str(template["file_hash"]) == file_hash:
+            template["mtime"] = stat.st_mtime
+            template["size"] = stat.st_size
+            save_template(bank_file, template)
+            return to_template(template, sound_file)
+    logger.debug("Adding {} to the template bank".format(os.path.basename(sound_file)))
+    if file_hash is None:
+        file_hash = hash_file(sound_file)
+    samples = decode_audio(sound_file, sample_rate).astype(np.float32) / 32768
+    fft_size = get_fft_size(len(samples))
+    template = {
+        "version": template_bank_version,
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "file_hash": file_hash,
+        "sample_rate": sample_rate,
+        "samples": samples,
+        "fft_size": fft_size,
+        "spectrum": compute_spectrum(samples, fft_size),
+    }
+    save_template(bank_file, template)
+    return to_template(template, sound_file)
+
+def save_template(bank_file, template):
+    """Writes a template to a temporary file first, so that other processes never read a partially written template
+
+    Args:
+        bank_file (str): path to the file of the template in the bank
+        template (dict): the arrays of the template
+    """
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(bank_file), suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as file:
+            np.savez(file, **template)
+        os.replace(temp_path, bank_file)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def to_template(stored, sound_file):
+    """Converts the arrays stored in the bank to a template
+
+    Args:
+        stored (dict): the arrays stored in the bank
+        sound_file (str): path to the sound sample
+
+    Returns:
+        dict: the template of the sound sample
+    """
+    sample_rate = int(stored["sample_rate"])
+    samples = np.asarray(stored["samples"])
+    return {
+        "source_file": sound_file,
+        "file_hash": str(stored["file_hash"]),
+        "sample_rate": sample_rate,
+        "samples": samples,
+        "duration": len(samples) / sample_rate,
+        "fft_size": int(stored["fft_size"]),
+        "spectrum": np.asarray(stored["spectrum"]),
+    }
+
+def get_fft_size(template_len):
+    """Returns the fft size used for the overlap-save correlation of a template
+
+    Args:
+        template_len (int): number of samples of the template
+
+    Returns:
+        int: the smallest power of two that is at least four times the template length
+    """
+    fft_size = 1
+    while fft_size < 4 * template_len:
+        fft_size *= 2
+    return fft_size
+
+def hash_file(file):
+    """Computes the sha1 hash of a file
+
+    Args:
+        file (str): path to the file
+
+    Returns:
+        str: hex digest of the file content
+    """
+    sha1 = hashlib.sha1()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
@@ -0,0 +1,721 @@
+import argparse
+import os
+import time
+import tempfile
+import random
+import json
+import sys
+import tracemalloc
+from pydub import AudioSegment
+from AudioPreprocessing import decode_audio, write_wav, load_template_bank, match_templates, best_peaks, find_peaks_coarse_to_fine, setup_logging_preprocessing
+from Synthetic import generate_transcript, punctuate_synthetic
+
+def time_call(function, repeats):
+    """Measures the wall time of a function
+
+    Args:
+        function (callable): function without arguments to measure
+        repeats (int): number of measured calls
+
+    Returns:
+        float: the fastest wall time in seconds
+    """
+    best_time = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best_time = min(best_time, time.perf_counter() - start)
+    return best_time
+
+def print_result(name, legacy_time, current_time):
+    """Prints the timings of the legacy and the current implementation
+
+    Args:
+        name (str): name of the benchmark
+        legacy_time (float): wall time of the legacy implementation in seconds
+        current_time (float): wall time of the current implementation in seconds
+    """
+    print("{}: legacy {:.3f}s, current {:.3f}s, speedup {:.2f}x".format(name, legacy_time, current_time, legacy_time / current_time))
+
+def benchmark_decode(source_file, repeats):
+    """Compares the double decode of the former trim_audio with the single decode of decode_audio
+
+    Args:
+        source_file (str): path to a .mp3 file
+        repeats (int): number of measured calls
+    """
+    import librosa
+    output_file = os.path.join(tempfile.mkdtemp(), "benchmark.wav")
+
+    def legacy():
+        librosa.load(source_file)
+        AudioSegment.from_mp3(source_file).export(output_file, format="wav", parameters=["-ac", str(1), "-ar", str(16000)])
+
+    def current():
+        write_wav(output_file, decode_audio(source_file, 16000), 16000)
+
+    print_result("decode", time_call(legacy, repeats), time_call(current, repeats))
+
+def benchmark_search(source_file, begin_sounds_dir, end_sounds_dir, candidate_count, factor, repeats):
+    """Compares the full resolution search for the sound samples with the coarse-to-fine search
+
+    Args:
+        source_file (str): path to the source file
+        begin_sounds_dir (str): path to the directory containing the sound samples played at the begin of a broadcast
+        end_sounds_dir (str): path to the directory containing the sound samples played at the end of a broadcast
+        candidate_count (int): number of candidates kept by the coarse search
+        factor (int): decimation factor of the coarse search
+        repeats (int): number of measured calls
+    """
+    bank_dir = tempfile.mkdtemp()
+    templates = load_template_bank(begin_sounds_dir, bank_dir) + load_template_bank(end_sounds_dir, bank_dir)
+    samples = decode_audio(source_file, 16000)
+    full_peaks = best_peaks(match_templates([samples], templates))
+    coarse_peaks = find_peaks_coarse_to_fine(samples, templates, candidate_count, factor)
+    for template, full_peak, coarse_peak in zip(templates, full_peaks, coarse_peaks):
+        difference = abs(full_peak[1] - coarse_peak[1]) * 1000 / 16000
+        print("{}: full {:.3f} at {}, coarse {:.3f} at {}, difference {:.1f}ms{}".format(os.path.basename(template["source_file"]),
+            full_peak[0], full_peak[1], coarse_peak[0], coarse_peak[1], difference, "" if difference <= 10 else " (MISMATCH)"))
+    legacy_time = time_call(lambda: match_templates([samples], templates), repeats)
+    current_time = time_call(lambda: find_peaks_coarse_to_fine(samples, templates, candidate_count, factor), repeats)
+    print_result("search", legacy_time, current_time)
+
+def word_error_rate(reference, hypothesis):
+    """Computes the word error rate of a hypothesis compared to a reference
+
+    Args:
+        reference (list): words of the reference
+        hypothesis (list): words of the hypothesis
+
+    Returns:
+        float: number of substitutions, deletions and insertions divided by the length of the reference
+    """
+    distances = list(range(len(hypothesis) + 1))
+    for i, reference_word in enumerate(reference, 1):
+        previous_diagonal, distances[0] = distances[0], i
+        for j, hypothesis_word in enumerate(hypothesis, 1):
+            substitution = previous_diagonal + (reference_word != hypothesis_word)
+            previous_diagonal = distances[j]
+            distances[j] = min(distances[j] + 1, distances[j - 1] + 1, substitution)
+    return distances[-1] / max(len(reference), 1)
+
+def benchmark_stt(source_file, model_path, thread_count, repeats):
+    """Compares the sequential speech-to-text conversion with the chunk-parallel one
+
+    Args:
+        source_file (str): path to a 16KHz mono .wav file
+        model_path (str): path to the vosk model
+        thread_count (int): number of threads of the parallel conversion
+        repeats (int): number of measured calls
+    """
+    from vosk import Model, SetLogLevel
+    from RadioSummarizer import generate_text, setup_logging_summarizer
+    setup_logging_summarizer("ERROR")
+    SetLogLevel(-1)
+    model = Model(model_path)
+    sequential_words = [word[0] for word in generate_text(source_file, model)]
+    parallel_words = [word[0] for word in generate_text(source_file, model, thread_count)]
+    print("stt: word error rate of the parallel conversion compared to the sequential one: {:.2%}".format(word_error_rate(sequential_words, parallel_words)))
+    legacy_time = time_call(lambda: generate_text(source_file, model), repeats)
+    current_time = time_call(lambda: generate_text(source_file, model, thread_count), repeats)
+    print_result("stt", legacy_time, current_time)
+
+def benchmark_split(source_file, repeats):
+    """Compares pydub's split_on_silence with the vectorized split_audio
+
+    Args:
+        source_file (str): path to a 16 bit mono .wav file
+        repeats (int): number of measured calls
+    """
+    from pydub.silence import split_on_silence
+    from RadioSummarizer import split_audio
+
+    def legacy():
+        chunks = split_on_silence(AudioSegment.from_wav(source_file), min_silence_len=500, silence_thresh=-20)
+        return [int(chunk.frame_count()) for chunk in chunks]
+
+    if legacy() != split_audio(source_file, 500, -20):
+        print("split: MISMATCH between the chunks of split_on_silence and split_audio")
+    print_result("split", time_call(legacy, repeats), time_call(lambda: split_audio(source_file, 500, -20), repeats))
+
+def legacy_merge_splits(frames, max_split_count):
+    """Former quadratic implementation of merge_splits, used as reference
+
+    Args:
+        frames (list): list containing the separated frames
+        max_split_count (int): number of maximum splits
+
+    Returns:
+        list: updated list of frames
+    """
+    temp = []
+    while len(frames) > max_split_count:
+        temp = [];
+        smallest_index = 0
+        merge_index = -1
+        for index in range(0, len(frames)):
+            if(frames[index] <= frames[smallest_index]):
+                smallest_index = index
+                if(index == 0 and index + 1 == len(frames)):
+                    merge_index = -1
+                elif(index == 0):
+                    merge_index = index + 1
+                elif(index + 1 == len(frames)):
+                    merge_index = index - 1
+                else:
+                    prev_value = frames[index - 1]
+                    next_value = frames[index + 1]
+                    if (prev_value > next_value):
+                        merge_index = index + 1
+                    else:
+                        merge_index = index - 1
+        if(merge_index == -1): 
+            break
+        for index in range(0, len(frames)):
+            if(index == merge_index):
+                continue
+            if(index == smallest_index):
+                temp.append(frames[smallest_index] + frames[merge_index])
+            else:
+                temp.append(frames[index])
+        frames = temp.copy()
+    return frames   
+
+def benchmark_merge(sizes, legacy_max_size, check_count, repeats):
+    """Checks that merge_splits returns the same as its former implementation on random inputs and compares their speed
+
+    Args:
+        sizes (list): numbers of splits to measure
+        legacy_max_size (int): the former implementation is only measured up to this number of splits
+        check_count (int): number of random inputs that are compared
+        repeats (int): number of measured calls
+    """
+    from RadioSummarizer import merge_splits
+    generator = random.Random(0)
+    for _ in range(check_count):
+        #Small value ranges produce many ties
+        frames = [generator.randint(0, generator.choice([3, 10, 100000])) for _ in range(generator.randint(0, 40))]
+        max_split_count = generator.randint(-1, len(frames) + 1)
+        if merge_splits(frames, max_split_count) != legacy_merge_splits(frames, max_split_count):
+            print("merge: MISMATCH for {} with at most {} splits".format(frames, max_split_count))
+            return
+    print("merge: {} random inputs are merged identically".format(check_count))
+    for size in sizes:
+        frames = [generator.randint(8000, 160000) for _ in range(size)]
+        current_time = time_call(lambda: merge_splits(frames, 10), repeats)
+        if size <= legacy_max_size:
+            print_result("merge {}".format(size), time_call(lambda: legacy_merge_splits(frames, 10), repeats), current_time)
+        else:
+            print("merge {}: current {:.3f}s".format(size, current_time))
+
+def legacy_insert_speakers(word_list, diarization_list):
+    """Former implementation of insert_speakers, used as reference
+
+    Args:
+        word_list (list): recognized words and their start and end time
+        diarization_list (list): recognized speakers and their start and end time
+
+    Returns:
+        str: generated text
+    """
+    word_index = 0
+    word_list_len = len(word_list)
+    speaker_index = 1
+    offset = 0.1
+    result = "<---New Speaker 00:00--->"
+    
+    while word_index < word_list_len:
+        # If the time of the current word is greater than the time of the next speaker, then add a speaker change to the text
+        if word_list[word_index][1] and speaker_index < len(diarization_list) and diarization_list[speaker_index][0] - offset<= word_list[word_index][2]:
+            minutes = int(diarization_list[speaker_index][0] / 60)
+            seconds = int(diarization_list[speaker_index][0]) % 60
+            new_speaker_text = "<---New Speaker "
+            if minutes < 10:
+                new_speaker_text += "0" + str(minutes) + ":"
+            else:
+                new_speaker_text += str(minutes) + ":"
+            if seconds < 10:
+                new_speaker_text += "0" + str(seconds) + ":"
+            else:
+               new_speaker_text += str(seconds) + ":"
+            new_speaker_text += "--->"
+            result = result + new_speaker_text
+            speaker_index += 1
+        result = result + " " + word_list[word_index][0]
+        word_index += 1
+    return result 
+    
+def legacy_adjust_text_after_punctuation(text):
+    """Former implementation of adjust_text_after_punctuation, used as reference
+
+    Args:
+        text (str): text to clean up
+
+    Returns:
+        str: cleaned up version of the text
+    """
+    text = text.replace(". <---", " <---")
+    text = text.replace(" <---", ". <---")
+    text = text.replace("<---", ". <---")
+    text = text.replace("--->.", "---> ")
+    text = text.replace("--->,", "---> ")
+    text = text.replace("--->!", "---> ")
+    text = text.replace("--->?", "---> ")
+    text = text.replace("--->:", "---> ")
+    text = text.replace("Speaker-", "Speaker")
+    text = text.replace("Speaker.", "Speaker")
+    text = text.replace("Speaker:", "Speaker")
+    text = text.replace("Speaker,", "Speaker")
+    text = text.replace("Speaker?", "Speaker")
+    text = text.replace(":--->", "--->")
+    return text
+
+def legacy_adjust_text_after_capitalization(text):
+    """Former implementation of adjust_text_after_capitalization, used as reference
+
+    Args:
+        text (str): text to clean up
+
+    Returns:
+        str: cleaned up version of the text
+    """
+    text = text.replace(" >",">")
+    text = text.replace("--->.","--->")
+    text = text.replace("---> .","--->")
+    text = text.replace("--->", "--->\n")
+    text = text.replace("<--- ", "\n<---")
+    text = text.replace(".", ".\n")
+    #text = text.replace(":", ":\n")
+    text = text.replace("!", "!\n")
+    text = text.replace("?", "?\n")
+    return text
+
+def check_golden_corpus(corpus_file):
+    """Checks that every stage of the text generation returns exactly the texts stored in the golden corpus.
+    The corpus contains the outputs of the models, so that the check runs without them.
+
+    Args:
+        corpus_file (str): path to the JSON file with the golden transcripts
+
+    Returns:
+        int: number of mismatching transcripts
+    """
+    from RadioSummarizer import insert_speakers, adjust_text_after_punctuation, capitalize_words, adjust_text_after_capitalization, setup_logging_summarizer
+    setup_logging_summarizer("ERROR")
+    with open(corpus_file, "r", encoding="utf-8") as file:
+        cases = json.load(file)["cases"]
+    mismatch_count = 0
+    for case in cases:
+        capitalized_text = capitalize_words([tuple(word) for word in case["tagged_words"]])
+        results = {"text": insert_speakers(case["word_list"], case["diarization_list"]),
+            "text_after_punctuation": adjust_text_after_punctuation(case["punctuated_text"]),
+            "capitalized_text": capitalized_text,
+            "final_text": adjust_text_after_capitalization(capitalized_text)}
+        mismatches = [name for name, result in results.items() if result != case[name]]
+        if mismatches:
+            print("text: MISMATCH of {} in the golden transcript {}".format(", ".join(mismatches), case["name"]))
+            mismatch_count += 1
+    print("text: {} of {} golden transcripts are generated identically".format(len(cases) - mismatch_count, len(cases)))
+    return mismatch_count
+
+def benchmark_text(hours, check_count, repeats):
+    """Checks that the transcript is generated and cleaned up identically to the former implementation and compares their speed
+
+    Args:
+        hours (list): lengths of the measured transcripts in hours
+        check_count (int): number of random transcripts that are compared
+        repeats (int): number of measured calls
+    """
+    from RadioSummarizer import insert_speakers, adjust_text_after_punctuation, adjust_text_after_capitalization, setup_logging_summarizer
+    setup_logging_summarizer("ERROR")
+    generator = random.Random(0)
+    for _ in range(check_count):
+        word_list, diarization_list = generate_transcript(generator, generator.uniform(0.0, 0.05))
+        text = insert_speakers(word_list, diarization_list)
+        punctuated_text = punctuate_synthetic(text, generator)
+        if (text != legacy_insert_speakers(word_list, diarization_list)
+            or adjust_text_after_punctuation(punctuated_text) != legacy_adjust_text_after_punctuation(punctuated_text)
+            or adjust_text_after_capitalization(punctuated_text) != legacy_adjust_text_after_capitalization(punctuated_text)):
+            print("text: MISMATCH for {} words and {} speaker turns".format(len(word_list), len(diarization_list)))
+            return
+    print("text: {} random transcripts are generated identically".format(check_count))
+    for length in hours:
+        word_list, diarization_list = generate_transcript(generator, length)
+        punctuated_text = punctuate_synthetic(legacy_insert_speakers(word_list, diarization_list), generator)
+
+        def legacy():
+            legacy_insert_speakers(word_list, diarization_list)
+            legacy_adjust_text_after_capitalization(legacy_adjust_text_after_punctuation(punctuated_text))
+
+        def current():
+            insert_speakers(word_list, diarization_list)
+            adjust_text_after_capitalization(adjust_text_after_punctuation(punctuated_text))
+
+        print_result("text {}h".format(length), time_call(legacy, repeats), time_call(current, repeats))
+
+def benchmark_punctuation(source_file, language, repeats):
+    """Compares the punctuation and capitalization of the whole text with the windowed batched one
+
+    Args:
+        source_file (str): path to a text file containing a transcript without punctuation
+        language (str): language code of the transcript
+        repeats (int): number of measured calls
+    """
+    import stanza
+    from deepmultilingualpunctuation import PunctuationModel
+    from RadioSummarizer import punctuate_text, correct_capitalization, setup_logging_summarizer
+    setup_logging_summarizer("ERROR")
+    with open(source_file, "r", encoding="utf-8") as file:
+        text = file.read()
+    punctuation_model = PunctuationModel()
+    stanza.download(lang = language, logging_level="ERROR")
+    capitalization_pipeline = stanza.Pipeline(processors="tokenize,pos", lang=language, logging_level="ERROR")
+    punctuated_text = punctuation_model.restore_punctuation(text)
+    if punctuate_text(text, punctuation_model) != punctuated_text:
+        print("punctuation: MISMATCH between the whole text and the windowed punctuation")
+    # A window size larger than the text processes the whole text at once
+    if correct_capitalization(punctuated_text, capitalization_pipeline) != correct_capitalization(punctuated_text, capitalization_pipeline, len(punctuated_text) + 1):
+        print("capitalization: MISMATCH between the whole text and the windowed capitalization")
+    print_result("punctuation", time_call(lambda: punctuation_model.restore_punctuation(text), repeats),
+        time_call(lambda: punctuate_text(text, punctuation_model), repeats))
+    print_result("capitalization", time_call(lambda: correct_capitalization(punctuated_text, capitalization_pipeline, len(punctuated_text) + 1), repeats),
+        time_call(lambda: correct_capitalization(punctuated_text, capitalization_pipeline), repeats))
+
+def reference_labels(text, model):
+    """Derives the punctuation labels of a punctuated transcript, aligned with the words the model gets
+
+    Args:
+        text (str): transcript with punctuation
+        model (deepmultilingualpunctuation.punctuationmodel.PunctuationModel): the model whose preprocessing is used
+
+    Returns:
+        list: words of the transcript without punctuation
+        list: label of every word, "0" for no punctuation
+    """
+    words = []
+    labels = []
+    for token in text.split():
+        label = token[-1] if token[-1] in ".,?-:" else "." if token[-1] in "!;" else "0"
+        # Punctuation separated by spaces belongs to the previous word
+        token_words = [] if all(char in ".,?-:!;" for char in token) else model.preprocess(token)
+        if len(token_words) > 0:
+            words += token_words
+            labels += ["0"] * (len(token_words) - 1) + [label]
+        elif len(labels) > 0 and label != "0":
+            labels[-1] = label
+    return words, labels
+
+def measure_punctuation_backend(backend, source_files, thread_count, repeats):
+    """Loads the punctuation model with a backend and measures it, called in a new process for every backend
+
+    Args:
+        backend (str): backend of the punctuation model, see load_punctuation_model()
+        source_files (list): paths to the text files of the held-out transcripts with punctuation
+        thread_count (int): number of threads used by the model, None for the default of torch
+        repeats (int): number of measured calls
+
+    Returns:
+        dict: reference and predicted labels of every transcript, the wall time of the punctuation, the peak memory after loading and after the punctuation
+    """
+    from RadioSummarizer import load_punctuation_model, punctuate_text, predict_punctuation, punctuation_batch_size, setup_logging_summarizer
+    from Instrumentation import get_peak_rss
+    setup_logging_summarizer("ERROR")
+    model = load_punctuation_model(backend)
+    load_rss = get_peak_rss()
+    if thread_count is not None:
+        import torch
+        torch.set_num_threads(thread_count)
+    result = {"reference": [], "labels": [], "latency": 0.0, "load_rss": load_rss}
+    for source_file in source_files:
+        with open(source_file, "r", encoding="utf-8") as file:
+            words, labels = reference_labels(file.read(), model)
+        result["reference"] += labels
+        result["labels"] += [label for _, label, _ in predict_punctuation(words, model, punctuation_batch_size)]
+        result["latency"] += time_call(lambda: punctuate_text(" ".join(words), model), repeats)
+    result["peak_rss"] = get_peak_rss()
+    return result
+
+def f1_scores(reference, prediction):
+    """Computes the F1 score of every punctuation label
+
+    Args:
+        reference (list): reference label of every word
+        prediction (list): predicted label of every word
+
+    Returns:
+        dict: F1 score of every punctuation label that occurs in the reference or the prediction
+    """
+    scores = {}
+    for label in sorted((set(reference) | set(prediction)) - {"0"}):
+        true_positives = sum(1 for expected, predicted in zip(reference, prediction) if expected == label and predicted == label)
+        reference_count = reference.count(label)
+        prediction_count = prediction.count(label)
+        scores[label] = 2 * true_positives / (reference_count + prediction_count) if reference_count + prediction_count > 0 else 0.0
+    return scores
+
+def benchmark_quantization(source_files, thread_count, repeats):
+    """Compares the quantized punctuation backend with the full precision model on held-out transcripts.
+    Every backend runs in its own process, so that the memory of one model doesn't count for the other.
+
+    Args:
+        source_files (list): paths to the text files of the held-out transcripts with punctuation
+        thread_count (int): number of threads used by the model, None for the default of torch
+        repeats (int): number of measured calls
+    """
+    import subprocess
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for backend in ["torch", "int8"]:
+        code = "import json, Benchmark\nprint(json.dumps(Benchmark.measure_punctuation_backend({!r}, {!r}, {!r}, {!r})))".format(backend,
+            [os.path.abspath(file) for file in source_files], thread_count, repeats)
+        process = subprocess.run([sys.executable, "-c", code], cwd=source_dir, stdout=subprocess.PIPE, check=True)
+        results[backend] = json.loads(process.stdout.decode().strip().splitlines()[-1])
+        reference = results[backend]["reference"]
+        prediction = results[backend]["labels"]
+        accuracy = sum(1 for expected, predicted in zip(reference, prediction) if expected == predicted) / max(len(reference), 1)
+        scores = f1_scores(reference, prediction)
+        print("quantization {}: accuracy {:.2%}, F1 {}, latency {:.3f}s, RSS after loading {:.0f}MB, peak RSS {:.0f}MB".format(backend, accuracy,
+            ", ".join("{} {:.3f}".format(label, score) for label, score in scores.items()), results[backend]["latency"],
+            results[backend]["load_rss"] / (1 << 20), results[backend]["peak_rss"] / (1 << 20)))
+    full_labels = results["torch"]["labels"]
+    quantized_labels = results["int8"]["labels"]
+    agreement = sum(1 for full, quantized in zip(full_labels, quantized_labels) if full == quantized) / max(len(full_labels), 1)
+    print("quantization: {:.2%} of {} words get the same label from both backends".format(agreement, len(full_labels)))
+    print_result("quantization", results["torch"]["latency"], results["int8"]["latency"])
+
+def benchmark_startup(language, load_models, repeats):
+    """Measures the startup time of a new process for every combination of stages and compares it with the startup with all stages, which every run had before
+
+    Args:
+        language (str): language code used for loading the models
+        load_models (bool): if the models are loaded in addition to importing their libraries
+        repeats (int): number of measured calls
+    """
+    import itertools
+    import subprocess
+    from RadioSummarizer import all_stages
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+
+    def startup(stages):
+        code = "import Main, RadioSummarizer\n"
+        # The coarse trim search is the only part of the trimming that imports scipy.signal
+        if "trim" in stages:
+            code += "import scipy.signal\n"
+        conversion_stages = [stage for stage in all_stages if stage in stages]
+        if load_models:
+            code += "RadioSummarizer.setup_logging_summarizer('ERROR')\nRadioSummarizer.setup_models({!r}, stages={!r})\n".format(language, conversion_stages)
+        else:
+            code += "RadioSummarizer.import_stages({!r})\n".format(conversion_stages)
+        return time_call(lambda: subprocess.run([sys.executable, "-c", code], cwd=source_dir, check=True), repeats)
+
+    stage_names = ["trim"] + all_stages
+    legacy_time = startup(stage_names)
+    # A failing argument validation doesn't load any stage
+    print_result("startup of invalid arguments", legacy_time,
+        time_call(lambda: subprocess.run([sys.executable, "Main.py"], cwd=source_dir, stderr=subprocess.DEVNULL), repeats))
+    for count in range(len(stage_names) + 1):
+        for stages in itertools.combinations(stage_names, count):
+            if ("punctuate" in stages or "capitalize" in stages) and "stt" not in stages:
+                continue
+            print_result("startup of {}".format(" ".join(stages) if stages else "no stage"), legacy_time, startup(stages))
+
+suite_scales = {"1m": 60, "1h": 3600, "24h": 86400}
+
+def measure(function, repeats):
+    """Measures the wall time and the peak memory of a function
+
+    Args:
+        function (callable): function without arguments to measure
+        repeats (int): number of measured calls
+
+    Returns:
+        float: the fastest wall time in seconds
+        int: peak of the memory allocated by python and numpy in bytes, measured in a separate call because tracing slows the function down
+    """
+    latency = time_call(function, repeats)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return latency, peak_memory
+
+def check_regression(result, baseline, tolerance):
+    """Compares a result of the suite with its baseline
+
+    Args:
+        result (dict): latency and peak memory of a function
+        baseline (dict): stored latency and peak memory of the function, None if there is no baseline
+        tolerance (float): relative increase that is still accepted
+
+    Returns:
+        list: descriptions of the values that increased by more than the tolerance
+    """
+    if baseline is None:
+        return []
+    regressions = []
+    for value in ["latency", "memory"]:
+        if baseline[value] > 0 and result[value] > baseline[value] * (1 + tolerance):
+            regressions.append("{} {:+.0%}".format(value, result[value] / baseline[value] - 1))
+    return regressions
+
+def benchmark_suite(scales, kind, baseline_file, save_baseline, tolerance, seed, repeats):
+    """Measures the offline functions of the trimming and the text generation on synthetic broadcasts, checks the found offsets and compares the results with stored baselines
+
+    Args:
+        scales (list): names of the measured lengths of the recording, see suite_scales
+        kind (str): kind of the bed the jingles are embedded into, see generate_bed_block()
+        baseline_file (str): path to the JSON file with the baselines
+        save_baseline (bool): if the results should be stored as the new baselines
+        tolerance (float): relative increase of the latency or the memory that is still accepted
+        seed (int): seed of the synthetic data
+        repeats (int): number of measured calls
+
+    Returns:
+        int: number of failed offset checks and regressions
+    """
+    import numpy as np
+    from AudioPreprocessing import read_audio_blocks, find_best_correlation, trim_audio
+    from RadioSummarizer import split_audio, merge_splits, insert_speakers, adjust_text_after_punctuation, adjust_text_after_capitalization, setup_logging_summarizer
+    from Synthetic import sample_rate, generate_jingle, make_template, generate_broadcast, write_wav_blocks
+    import logging
+    setup_logging_summarizer("ERROR")
+    # Every measured call of trim_audio would log the trimmed file
+    logging.getLogger("AudioPreprocessing").setLevel(logging.ERROR)
+    baselines = {}
+    if os.path.exists(baseline_file):
+        with open(baseline_file, "r", encoding="utf-8") as file:
+            baselines = json.load(file)
+    failures = 0
+    for scale in scales:
+        duration = suite_scales[scale]
+        generator = np.random.default_rng(seed)
+        # One template of each kind is not part of the recording, so the search has to pick the right one
+        jingles = [generate_jingle(generator, length) for length in [2.0, 2.5, 1.5, 3.0]]
+        begin_templates = [make_template(jingles[0], "begin.wav"), make_template(jingles[1], "begin_unused.wav")]
+        end_templates = [make_template(jingles[2], "end.wav"), make_template(jingles[3], "end_unused.wav")]
+        work_dir = tempfile.mkdtemp()
+        source_file = os.path.join(work_dir, "synthetic_{}.wav".format(scale))
+        blocks, begin_sample, end_sample = generate_broadcast(generator, duration, jingles[0], jingles[2], kind)
+        write_wav_blocks(source_file, blocks)
+        word_list, diarization_list = generate_transcript(random.Random(seed), duration / 3600)
+        punctuated_text = punctuate_synthetic(insert_speakers(word_list, diarization_list), random.Random(seed))
+        frames = split_audio(source_file, 500, -20)
+
+        def search():
+            peaks = best_peaks(match_templates(read_audio_blocks(source_file, sample_rate), begin_templates + end_templates))
+            return (find_best_correlation(peaks[:len(begin_templates)], sample_rate, begin_templates, -1, True),
+                find_best_correlation(peaks[len(begin_templates):], sample_rate, end_templates, -1))
+
+        (_, begin_offset, begin_file), (_, end_offset, end_file) = search()
+        for name, offset, file, expected_offset, expected_file in [("begin", begin_offset, begin_file, begin_sample / sample_rate, "begin.wav"),
+            ("end", end_offset, end_file, end_sample / sample_rate, "end.wav")]:
+            difference = abs(offset - expected_offset) * 1000
+            if file != expected_file or difference > 10:
+                print("suite {} {} offset: MISMATCH, found {} at {:.2f}s, expected {} at {:.2f}s".format(scale, name, file, offset, expected_file, expected_offset))
+                failures += 1
+            else:
+                print("suite {} {} offset: difference {:.1f}ms".format(scale, name, difference))
+
+        functions = [
+            ("search", search),
+            ("trim_audio", lambda: trim_audio(source_file, begin_templates, end_templates, work_dir, -1, sample_rate, streaming = True)),
+            ("split_audio", lambda: split_audio(source_file, 500, -20)),
+            ("merge_splits", lambda: merge_splits(frames, 10)),
+            ("insert_speakers", lambda: insert_speakers(word_list, diarization_list)),
+            ("adjust_text_after_punctuation", lambda: adjust_text_after_punctuation(punctuated_text)),
+            ("adjust_text_after_capitalization", lambda: adjust_text_after_capitalization(punctuated_text)),
+        ]
+        results = {}
+        for name, function in functions:
+            latency, peak_memory = measure(function, repeats)
+            results[name] = {"latency": latency, "memory": peak_memory}
+            regressions = check_regression(results[name], baselines.get(scale, {}).get(name), tolerance)
+            failures += len(regressions)
+            print("suite {} {}: latency {:.3f}s, throughput {:.0f}x realtime, peak memory {:.1f}MB{}".format(scale, name, latency,
+                duration / max(latency, 1e-9), peak_memory / (1 << 20), " (REGRESSION {})".format(", ".join(regressions)) if regressions else ""))
+        baselines[scale] = results
+        for file in os.listdir(work_dir):
+            os.remove(os.path.join(work_dir, file))
+        os.rmdir(work_dir)
+    if save_baseline:
+        with open(baseline_file, "w", encoding="utf-8") as file:
+            json.dump(baselines, file, indent=4)
+    return failures
+
+def setup_args():
+    """Sets up the flag arguments used by the benchmarks
+
+    Returns:
+        argparse.Namespace: Contains the arguments provided by the user
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--repeats", dest = "repeats", type = int, default = 3, help="Number of measured runs per benchmark")
+    subparsers = parser.add_subparsers(dest = "benchmark", required = True)
+    decode_parser = subparsers.add_parser("decode", help="Decoding of a source file for trimming")
+    decode_parser.add_argument("-i", "--input", dest = "input", required = True, help="Audiofile to decode")
+    search_parser = subparsers.add_parser("search", help="Full resolution and coarse-to-fine search for the sound samples")
+    search_parser.add_argument("-i", "--input", dest = "input", required = True, help="Audiofile to search")
+    search_parser.add_argument("-b", "--begin", dest = "begin_sounds_dir", required = True, help="Directory with sounds played at the begining")
+    search_parser.add_argument("-e", "--end", dest = "end_sounds_dir", required = True, help="Directory with sound played at the ending")
+    search_parser.add_argument("-cc", "--coarse_candidates", dest = "coarse_candidates", type = int, default = 3, help="Number of candidates kept by the coarse search")
+    search_parser.add_argument("-cf", "--coarse_factor", dest = "coarse_factor", type = int, default = 8, help="Decimation factor of the coarse search")
+    stt_parser = subparsers.add_parser("stt", help="Sequential and chunk-parallel speech-to-text conversion")
+    stt_parser.add_argument("-i", "--input", dest = "input", required = True, help="16KHz mono .wav file to convert")
+    stt_parser.add_argument("-mp", "--model_path", dest = "model_path", default = os.path.join("models", "vosk_model"), help="Path to the vosk model")
+    stt_parser.add_argument("-tt", "--stt_threads", dest = "stt_threads", type = int, default = os.cpu_count(), help="Number of threads of the parallel conversion")
+    split_parser = subparsers.add_parser("split", help="Splitting of the audio at silent parts")
+    split_parser.add_argument("-i", "--input", dest = "input", required = True, help="16 bit mono .wav file to split")
+    merge_parser = subparsers.add_parser("merge", help="Merging of the splits of the audio")
+    merge_parser.add_argument("-s", "--sizes", dest = "sizes", type = int, nargs = "+", default = [10000, 100000], help="Numbers of splits to measure")
+    merge_parser.add_argument("-lm", "--legacy_max", dest = "legacy_max", type = int, default = 10000, help="Largest number of splits the former implementation is measured with")
+    merge_parser.add_argument("-cc", "--check_count", dest = "check_count", type = int, default = 10000, help="Number of random inputs that are compared")
+    text_parser = subparsers.add_parser("text", help="Generation and clean up of the transcript")
+    text_parser.add_argument("-ho", "--hours", dest = "hours", type = float, nargs = "+", default = [1, 4], help="Lengths of the measured transcripts in hours")
+    text_parser.add_argument("-cc", "--check_count", dest = "check_count", type = int, default = 200, help="Number of random transcripts that are compared")
+    text_parser.add_argument("-gc", "--golden_corpus", dest = "golden_corpus", default = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden", "transcripts.json"), help="JSON file with the golden transcripts")
+    punctuation_parser = subparsers.add_parser("punctuation", help="Punctuation and capitalization of the whole text and of batched windows")
+    punctuation_parser.add_argument("-i", "--input", dest = "input", required = True, help="Text file with a transcript without punctuation")
+    punctuation_parser.add_argument("-l", "--language", dest = "language", default = "de", help="Language code of the transcript")
+    quantization_parser = subparsers.add_parser("quantization", help="Accuracy, speed and memory of the quantized punctuation model")
+    quantization_parser.add_argument("-i", "--input", dest = "input", nargs = "+", required = True, help="Text files with held-out transcripts with punctuation")
+    quantization_parser.add_argument("-pt", "--punctuation_threads", dest = "punctuation_threads", type = int, default = None, help="Number of threads used by the punctuation model")
+    startup_parser = subparsers.add_parser("startup", help="Startup time of every combination of stages")
+    startup_parser.add_argument("-l", "--language", dest = "language", default = "de", help="Language code used for loading the models")
+    startup_parser.add_argument("-lm", "--load_models", dest = "load_models", action='store_true', help="Load the models in addition to importing their libraries?")
+    suite_parser = subparsers.add_parser("suite", help="Offline functions on synthetic broadcasts with offset checks and baselines")
+    suite_parser.add_argument("-bd", "--bed", dest = "bed", choices = ["noise", "music", "speech"], default = "speech", help="Kind of the bed the jingles are embedded into")
+    suite_parser.add_argument("-bl", "--baseline", dest = "baseline", default = "benchmark_baseline.json", help="JSON file with the baselines")
+    suite_parser.add_argument("-sb", "--save_baseline", dest = "save_baseline", action='store_true', help="Store the results as the new baselines?")
+    suite_parser.add_argument("-sc", "--scales", dest = "scales", nargs = "+", choices = list(suite_scales), default = ["1m", "1h"], help="Lengths of the synthetic recordings")
+    suite_parser.add_argument("-sd", "--seed", dest = "seed", type = int, default = 0, help="Seed of the synthetic data")
+    suite_parser.add_argument("-to", "--tolerance", dest = "tolerance", type = float, default = 0.25, help="Relative increase of the latency or the memory that is flagged as regression")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = setup_args()
+    setup_logging_preprocessing("INFO")
+    if args.benchmark == "decode":
+        benchmark_decode(args.input, args.repeats)
+    elif args.benchmark == "search":
+        benchmark_search(args.input, args.begin_sounds_dir, args.end_sounds_dir, args.coarse_candidates, args.coarse_factor, args.repeats)
+    elif args.benchmark == "stt":
+        benchmark_stt(args.input, args.model_path, args.stt_threads, args.repeats)
+    elif args.benchmark == "split":
+        benchmark_split(args.input, args.repeats)
+    elif args.benchmark == "merge":
+        benchmark_merge(args.sizes, args.legacy_max, args.check_count, args.repeats)
+    elif args.benchmark == "text":
+        if check_golden_corpus(args.golden_corpus) > 0:
+            sys.exit(1)
+        benchmark_text(args.hours, args.check_count, args.repeats)
+    elif args.benchmark == "punctuation":
+        benchmark_punctuation(args.input, args.language, args.repeats)
+    elif args.benchmark == "quantization":
+        benchmark_quantization(args.input, args.punctuation_threads, args.repeats)
+    elif args.benchmark == "startup":
+        benchmark_startup(args.language, args.load_models, args.repeats)
+    elif args.benchmark == "suite":
+        if benchmark_suite(args.scales, args.bed, args.baseline, args.save_baseline, args.tolerance, args.seed, args.repeats) > 0:
+            sys.exit(1)
@@ -0,0 +1,228 @@
+import os
+import gzip
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+cache_version = 1
+
+class Cache:
+    """Content-addressed store for the intermediate results of the conversion.
+    Every entry is addressed by the hash of everything it depends on, so a changed input or setting simply leads to a different entry.
+    """
+
+    def __init__(self, cache_dir):
+        """Opens the cache and creates its directory if necessary
+
+        Args:
+            cache_dir (str): path to the directory in which the entries are stored
+        """
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, stage, *parts):
+        """Computes the address of an entry
+
+        Args:
+            stage (str): name of the stage that produced the entry
+            *parts: JSON serializable values the entry depends on, like the hash of the audio, the settings and the model identity
+
+        Returns:
+            str: key of the entry
+        """
+        description = json.dumps([cache_version, stage] + list(parts), sort_keys=True)
+        return "{}_{}".format(stage, hashlib.sha1(description.encode("utf-8")).hexdigest())
+
+    def path(self, key, extension):
+        """Returns the path of an entry
+
+        Args:
+            key (str): key of the entry
+            extension (str): file extension of the entry
+
+        Returns:
+            str: path to the file of the entry
+        """
+        return os.path.join(self.cache_dir, key + extension)
+
+    def store(self, path, write):
+        """Writes an entry to a temporary file first, so that other processes never read a partially written entry
+
+        Args:
+            path (str): path to the file of the entry
+            write (callable): function that writes the entry to the given open binary file
+        """
+        handle, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as file:
+                write(file)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def load_words(self, key):
+        """Loads a word list of the speech-to-text conversion
+
+        Args:
+            key (str): key of the entry
+
+        Returns:
+            list: recognized words with their start and end time, None if the entry doesn't exist
+        """
+        path = self.path(key, ".npz")
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as stored:
+            return [[word, True, start, end] for word, start, end in zip(stored["words"].tolist(), stored["starts"].tolist(), stored["ends"].tolist())]
+
+    def save_words(self, key, word_list):
+        """Stores a word list of the speech-to-text conversion
+
+        Args:
+            key (str): key of the entry
+            word_list (list): recognized words with their start and end time
+        """
+        self.store(self.path(key, ".npz"), lambda file: np.savez_compressed(file,
+            words=np.array([word[0] for word in word_list], dtype=str),
+            starts=np.array([word[2] for word in word_list], dtype=np.float64),
+            ends=np.array([word[3] for word in word_list], dtype=np.float64)))
+
+    def load_turns(self, key):
+        """Loads the speaker turns of the diarization
+
+        Args:
+            key (str): key of the entry
+
+        Returns:
+            list: speakers with their start and end time, None if the entry doesn't exist
+        """
+        path = self.path(key, ".npz")
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as stored:
+            return [[start, end, speaker] for start, end, speaker in zip(stored["starts"].tolist(), stored["ends"].tolist(), stored["speakers"].tolist())]
+
+    def save_turns(self, key, turns):
+        """Stores the speaker turns of the diarization
+
+        Args:
+            key (str): key of the entry
+            turns (list): speakers with their start and end time
+        """
+        self.store(self.path(key, ".npz"), lambda file: np.savez_compressed(file,
+            starts=np.array([turn[0] for turn in turns], dtype=np.float64),
+            ends=np.array([turn[1] for turn in turns], dtype=np.float64),
+            speakers=np.array([turn[2] for turn in turns], dtype=str)))
+
+    def load_text(self, key):
+        """Loads a text
+
+        Args:
+            key (str): key of the entry
+
+        Returns:
+            str: the text, None if the entry doesn't exist
+        """
+        path = self.path(key, ".txt.gz")
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            return file.read()
+
+    def save_text(self, key, text):
+        """Stores a text
+
+        Args:
+            key (str): key of the entry
+            text (str): the text
+        """
+        self.store(self.path(key, ".txt.gz"), lambda file: file.write(gzip.compress(text.encode("utf-8"))))
+
+    def load_tags(self, key):
+        """Loads the words and their part of speech tags of the capitalization pipeline
+
+        Args:
+            key (str): key of the entry
+
+        Returns:
+            list: every word with its universal part of speech tag, None if the entry doesn't exist
+        """
+        path = self.path(key, ".npz")
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as stored:
+            return list(zip(stored["words"].tolist(), stored["tags"].tolist()))
+
+    def save_tags(self, key, tagged_words):
+        """Stores the words and their part of speech tags of the capitalization pipeline
+
+        Args:
+            key (str): key of the entry
+            tagged_words (list): every word with its universal part of speech tag
+        """
+        self.store(self.path(key, ".npz"), lambda file: np.savez_compressed(file,
+            words=np.array([word for word, _ in tagged_words], dtype=str),
+            tags=np.array([tag or "" for _, tag in tagged_words], dtype=str)))
+
+    def load_files(self, key, output_dir):
+        """Copies the stored audio files of a preprocessing result to the output directory
+
+        Args:
+            key (str): key of the entry
+            output_dir (str): path to the directory the files are copied to
+
+        Returns:
+            bool: if the source file was trimmed or converted successfully, None if the entry doesn't exist
+            list: paths to the copied files
+        """
+        path = self.path(key, ".json")
+        if not os.path.exists(path):
+            return None, []
+        with open(path, "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+        files = []
+        for index, name in enumerate(manifest["files"]):
+            output_file = os.path.join(output_dir, name)
+            # The files are copied instead of linked, because the output files might be overwritten later
+            shutil.copyfile(self.path("{}_{:02d}".format(key, index), ".wav"), output_file)
+            files.append(output_file)
+        return manifest["is_processed"], files
+
+    def save_files(self, key, is_processed, files):
+        """Stores the audio files of a preprocessing result
+
+        Args:
+            key (str): key of the entry
+            is_processed (bool): if the source file was trimmed or converted successfully
+            files (list): paths to the created audio files
+        """
+        for index, file in enumerate(files):
+            self.store(self.path("{}_{:02d}".format(key, index), ".wav"), lambda target: copy_content(file, target))
+        manifest = {"is_processed": is_processed, "files": [os.path.basename(file) for file in files]}
+        # The manifest is written last, so an entry only exists once all of its files exist
+        self.store(self.path(key, ".json"), lambda target: target.write(json.dumps(manifest).encode("utf-8")))
+
+def copy_content(source_file, target):
+    """Copies the content of a file to an open binary file
+
+    Args:
+        source_file (str): path to the file to copy
+        target (file): open binary file
+    """
+    with open(source_file, "rb") as source:
+        shutil.copyfileobj(source, target, 1 << 20)
+
+def hash_text(text):
+    """Computes the sha1 hash of a text
+
+    Args:
+        text (str): the text
+
+    Returns:
+        str: hex digest of the text
+    """
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
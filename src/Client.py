@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+
+socket_path = "radiosummarizer.sock"
+
+def setup_args():
+    """Sets up the flag arguments used by the client
+
+    Returns:
+        argparse.Namespace: Contains the arguments provided by the user
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", dest = "input", nargs = "+", help="Audiofiles to convert")
+    parser.add_argument("-j", "--jobs", dest = "jobs", action='store_true', help="Show the status of all jobs?")
+    parser.add_argument("-l", "--language", dest = "language", default = None, help="Language of the audiofiles, defaults to the one of the server")
+    parser.add_argument("-o", "--output_dir", dest = "output_dir", default = None, help="Output directory, defaults to the one of the server")
+    parser.add_argument("-so", "--socket", dest = "socket", default = socket_path, help="Path of the UNIX socket the server listens on")
+    parser.add_argument("-st", "--status", dest = "status", type = int, default = None, help="Id of the job to show the status of")
+    parser.add_argument("-w", "--wait", dest = "wait", action='store_true', help="Wait until the submitted jobs are finished?")
+    return parser.parse_args()
+
+class Connection:
+    """Connection to the server, each request and answer is a line of JSON"""
+
+    def __init__(self, path):
+        """Connects to the server
+
+        Args:
+            path (str): path of the UNIX socket the server listens on
+        """
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.file = self.socket.makefile("rwb")
+
+    def request(self, request):
+        """Sends a request to the server and waits for its answer
+
+        Args:
+            request (dict): the request with a "command" of "submit", "status" or "jobs"
+
+        Returns:
+            dict: the answer of the server
+        """
+        self.file.write((json.dumps(request) + "\n").encode("utf-8"))
+        self.file.flush()
+        return json.loads(self.file.readline())
+
+    def close(self):
+        """Closes the connection"""
+        self.file.close()
+        self.socket.close()
+
+def print_job(job):
+    """Prints the status of a job
+
+    Args:
+        job (dict): status of the job
+    """
+    text = "Job {}: {} {}".format(job["id"], job["status"], job["file"])
+    if job["error"] is not None:
+        text += " ({})".format(job["error"])
+    for output_file in job["output_files"]:
+        text += "\n    " + output_file
+    print(text)
+
+def wait_for_jobs(connection, job_ids, interval = 1):
+    """Waits until all jobs are finished and prints their status
+
+    Args:
+        connection (Connection): connection to the server
+        job_ids (list): ids of the jobs
+        interval (int, optional): seconds between two status requests. Defaults to 1.
+
+    Returns:
+        bool: if all jobs finished successfully
+    """
+    successful = True
+    for job_id in job_ids:
+        while True:
+            answer = connection.request({"command": "status", "id": job_id})
+            if "error" in answer:
+                print(answer["error"])
+                successful = False
+                break
+            if answer["job"]["status"] in ["done", "failed"]:
+                print_job(answer["job"])
+                successful = successful and answer["job"]["status"] == "done"
+                break
+            time.sleep(interval)
+    return successful
+
+def main():
+    """Submits audio files to the server or shows the status of its jobs"""
+    args = setup_args()
+    if args.input is None and args.status is None and not args.jobs:
+        print("No source file, job or -j provided!")
+        sys.exit(2)
+    try:
+        connection = Connection(args.socket)
+    except OSError as e:
+        print("Can't connect to the server at {}: {}".format(args.socket, e))
+        sys.exit(2)
+    successful = True
+    try:
+        if args.status is not None:
+            answer = connection.request({"command": "status", "id": args.status})
+            if "error" in answer:
+                print(answer["error"])
+                successful = False
+            else:
+                print_job(answer["job"])
+        if args.jobs:
+            for job in connection.request({"command": "jobs"})["jobs"]:
+                print_job(job)
+        job_ids = []
+        for file in args.input or []:
+            request = {"command": "submit", "file": os.path.abspath(file)}
+            if args.output_dir is not None:
+                request["output_dir"] = os.path.abspath(args.output_dir)
+            if args.language is not None:
+                request["language"] = args.language
+            answer = connection.request(request)
+            if "error" in answer:
+                print("{}: {}".format(file, answer["error"]))
+                successful = False
+            else:
+                print_job(answer["job"])
+                job_ids.append(answer["job"]["id"])
+        if args.wait:
+            successful = wait_for_jobs(connection, job_ids) and successful
+    finally:
+        connection.close()
+    sys.exit(0 if successful else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import wave
+import threading
+import contextlib
+from datetime import datetime
+
+metrics_file = None
+profile_stage = None
+profile_dir = None
+active_stage_count = 0
+active_stage_lock = threading.Lock()
+
+def setup_instrumentation(metrics_path = None, stage = None, profile_path = None):
+    """Sets up the recording of the stages, which is disabled until this is called
+
+    Args:
+        metrics_path (str, optional): path to the JSON lines file the measurements are appended to, None disables the measurements. Defaults to None.
+        stage (str, optional): name of the stage that is profiled with cProfile, None disables profiling. Defaults to None.
+        profile_path (str, optional): path to the directory the profiles are written to. Defaults to None.
+    """
+    global metrics_file
+    global profile_stage
+    global profile_dir
+    metrics_file = metrics_path
+    profile_stage = stage
+    profile_dir = profile_path
+    if profile_dir is not None and not os.path.exists(profile_dir):
+        os.makedirs(profile_dir, exist_ok=True)
+
+def get_instrumentation_settings():
+    """Returns the settings of setup_instrumentation(), so that worker processes can be set up the same way
+
+    Returns:
+        dict: keyword arguments of setup_instrumentation()
+    """
+    return {"metrics_path": metrics_file, "stage": profile_stage, "profile_path": profile_dir}
+
+def is_enabled(stage):
+    """Checks if a stage is measured or profiled
+
+    Args:
+        stage (str): name of the stage
+
+    Returns:
+        bool: if measure_stage() records anything for the stage
+    """
+    return metrics_file is not None or profile_stage == stage
+
+def get_audio_duration(audio_file):
+    """Returns the duration of an audio file without decoding it
+
+    Args:
+        audio_file (str): path to the audio file
+
+    Returns:
+        float: duration in seconds, None if it can't be determined
+    """
+    try:
+        if ".wav" in audio_file:
+            with wave.open(audio_file, "rb") as wf:
+                return wf.getnframes() / wf.getframerate()
+        from pydub.utils import mediainfo
+        return float(mediainfo(audio_file)["duration"])
+    except Exception:
+        return None
+
+def reset_peak_rss():
+    """Resets the peak resident memory of the process, only supported on Linux"""
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+def get_rss():
+    """Returns the current resident memory of the process, only supported on Linux
+
+    Returns:
+        int: resident memory in bytes, None if it can't be determined
+    """
+    try:
+        with open("/proc/self/status", "r") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def get_memory_usage(pid = "self"):
+    """Returns how much of the resident memory of a process is shared with other processes, only supported on Linux
+
+    Args:
+        pid (int, optional): id of the process. Defaults to the own process.
+
+    Returns:
+        dict: "rss", "pss", "shared" and "private" memory in bytes, None if it can't be determined
+    """
+    fields = {}
+    try:
+        with open("/proc/{}/smaps_rollup".format(pid), "r") as file:
+            for line in file:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except (OSError, ValueError):
+        return None
+    if "Rss" not in fields:
+        return None
+    # Pss splits every shared page among the processes that map it, so the sum over the processes is their real memory
+    return {"rss": fields["Rss"], "pss": fields.get("Pss"),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)}
+
+def get_peak_rss():
+    """Returns the peak resident memory of the process since the last reset_peak_rss()
+
+    Returns:
+        int: peak resident memory in bytes, None if it can't be determined
+    """
+    try:
+        with open("/proc/self/status", "r") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Without /proc only the peak since the start of the process is known
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+@contextlib.contextmanager
+def measure_stage(stage, source_file, audio_duration = None):
+    """Measures the wall time, the CPU time and the peak resident memory of a stage and appends them as a JSON line to the metrics file.
+    The chosen stage is profiled with cProfile as well.
+    The CPU time and the peak memory belong to the whole process, so stages that run at the same time, like stt and diarize, contain each other.
+
+    Args:
+        stage (str): name of the stage
+        source_file (str): path to the processed file
+        audio_duration (float, optional): duration of the processed audio in seconds, used for the real-time factor. Defaults to None.
+    """
+    global active_stage_count
+    if not is_enabled(stage):
+        yield
+        return
+    with active_stage_lock:
+        # The peak memory of a stage running at the same time isn't reset
+        if active_stage_count == 0:
+            reset_peak_rss()
+        active_stage_count += 1
+    profiler = None
+    if profile_stage == stage:
+        import cProfile
+        profiler = cProfile.Profile()
+    start_time = datetime.now()
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        wall_time = time.perf_counter() - start_wall
+        cpu_time = time.process_time() - start_cpu
+        peak_rss = get_peak_rss()
+        with active_stage_lock:
+            active_stage_count -= 1
+        name = os.path.basename(source_file)
+        if profiler is not None:
+            profiler.dump_stats(os.path.join(profile_dir, "{}_{}_{}.prof".format(name, stage, start_time.strftime("%Y%m%d_%H%M%S"))))
+        if metrics_file is not None:
+            record = {"time": start_time.isoformat(timespec="seconds"), "file": name, "stage": stage, "pid": os.getpid(),
+                "wall_time": round(wall_time, 4), "cpu_time": round(cpu_time, 4), "peak_rss": peak_rss,
+                "audio_duration": audio_duration, "real_time_factor": round(wall_time / audio_duration, 4) if audio_duration else None}
+            write_record(record)
+
+def measure_call(stage, source_file, audio_duration, function, *args):
+    """Calls a function inside measure_stage(), used for stages that run in another thread
+
+    Args:
+        stage (str): name of the stage
+        source_file (str): path to the processed file
+        audio_duration (float): duration of the processed audio in seconds, None if unknown
+        function (callable): the stage
+        *args: arguments of the function
+
+    Returns:
+        the result of the function
+    """
+    with measure_stage(stage, source_file, audio_duration):
+        return function(*args)
+
+def write_record(record):
+    """Appends a record as a single JSON line, so that the lines of several processes aren't mixed
+
+    Args:
+        record (dict): the record
+    """
+    handle = os.open(metrics_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(handle, (json.dumps(record) + "\n").encode("utf-8"))
+    finally:
+        os.close(handle)
@@ -0,0 +1,363 @@
+import logging
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from pydub import AudioSegment
+from Main import setup_logging, does_path_exist, intermediate_dir, template_bank_dir, cache_dir
+from AudioPreprocessing import TemplateMatcher, load_template_bank, suppress_peaks, template_sample_rate, write_wav
+from RadioSummarizer import speech_to_text, setup_models, get_model, all_stages
+
+sample_rate = 16000
+block_size = 8000
+
+def setup_logging_live(log_level):
+    """Sets up the logger for this module
+
+    Args:
+        log_level (str): the selected loglevel
+    """
+    global logger
+    logger = logging.getLogger('Live')
+    logger.propagate = False
+    ch = logging.StreamHandler()
+    if log_level == "INFO":
+        logger.setLevel(logging.INFO)
+        ch.setLevel(logging.INFO)
+    elif log_level == "DEBUG":
+        logger.setLevel(logging.DEBUG)
+        ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(levelname)s:%(name)s: %(message)s')
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+def setup_args():
+    """Sets up the flag arguments used by the live mode
+
+    Returns:
+        argparse.Namespace: Contains the arguments provided by the user
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", "--begin", dest = "begin_sounds_dir", help="Directory with sounds played at the begining")
+    parser.add_argument("-c", "--min_correlation", dest = "min_correlation", help="filter value for the normalized trim correlation (between -1 and 1)")
+    parser.add_argument("-db", "--debug", dest = "debug", action='store_true', help="Show debug information?")
+    parser.add_argument("-dt", "--diarize_threads", dest = "diarize_threads", default = None, help="Number of threads used for the diarization")
+    parser.add_argument("-e", "--end", dest = "end_sounds_dir", help="Directory with sound played at the ending")
+    parser.add_argument("-f", "--follow", dest = "follow", action='store_true', help="Wait for new data at the end of the input file instead of stopping?")
+    parser.add_argument("-i", "--input", dest = "input", default = "-", help="Stream to read, a file, a FIFO or - for stdin")
+    parser.add_argument("-l", "--language",dest ="language", default="de", help="Language used in the stream")
+    parser.add_argument("-ml", "--max_length", dest = "max_length", default = 60, help="Maximum length of a broadcast in minutes")
+    parser.add_argument("-nc", "--no_cache", dest = "no_cache", action='store_true', help="Compute every stage again instead of using the cached results?")
+    parser.add_argument("-o", "--output_dir", dest = "output_dir", default = "output", help="Output directory")
+    parser.add_argument("-r", "--raw", dest = "raw", action='store_true', help="Is the stream raw 16 bit mono PCM with 16KHz instead of a format ffmpeg decodes?")
+    parser.add_argument("-sg", "--stages", dest = "stages", nargs = "+", choices = all_stages, default = None, help="Stages to run besides stt, defaults to all")
+    return parser.parse_args()
+
+def read_stream_blocks(source, raw, follow, block_size = block_size):
+    """Reads a growing stream block by block as mono 16 bit samples with 16KHz
+
+    Args:
+        source (str): path to a file or a FIFO, - for stdin
+        raw (bool): if the stream is raw 16 bit mono PCM with 16KHz, otherwise it is decoded by ffmpeg
+        follow (bool): if the end of a file is waited for new data instead of ending the stream
+        block_size (int, optional): number of samples per block. Defaults to block_size.
+
+    Yields:
+        np.ndarray: consecutive blocks of int16 samples
+    """
+    process = None
+    if raw:
+        stream = sys.stdin.buffer if source == "-" else open(source, "rb")
+    else:
+        command = [AudioSegment.converter, "-v", "error"]
+        if follow and source != "-":
+            #The file protocol of ffmpeg waits for appended data itself
+            command += ["-follow", "1", "-i", "file:" + source]
+        else:
+            command += ["-i", "pipe:0" if source == "-" else source]
+        command += ["-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate), "-"]
+        process = subprocess.Popen(command, stdin=sys.stdin if source == "-" else subprocess.DEVNULL, stdout=subprocess.PIPE)
+        stream = process.stdout
+    rest = b""
+    try:
+        while True:
+            data = stream.read1(2 * block_size)
+            if len(data) == 0:
+                if raw and follow and source != "-":
+                    time.sleep(0.5)
+                    continue
+                break
+            data = rest + data
+            rest = data[len(data) - len(data) % 2:]
+            yield np.frombuffer(data[:len(data) - len(data) % 2], dtype=np.int16)
+    finally:
+        if process is not None:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+        elif stream is not sys.stdin.buffer:
+            stream.close()
+
+class Broadcast:
+    """A broadcast that is recorded and converted to text while the stream arrives"""
+
+    def __init__(self, start, model):
+        """Starts a new broadcast
+
+        Args:
+            start (int): position of the first sample of the broadcast in the stream
+            model (vosk.Model): the vosk model to use
+        """
+        from vosk import KaldiRecognizer
+        self.start = start
+        self.recognizer = KaldiRecognizer(model, sample_rate)
+        self.recognizer.SetWords(True)
+        self.blocks = []
+        self.length = 0
+        self.word_list = []
+        self.started = datetime.now()
+
+    def feed(self, samples):
+        """Records the samples and feeds them to the recognizer
+
+        Args:
+            samples (np.ndarray): next int16 samples of the broadcast
+        """
+        self.blocks.append(samples)
+        self.length += len(samples)
+        if self.recognizer.AcceptWaveform(samples.tobytes()):
+            self.add_words(json.loads(self.recognizer.Result()))
+
+    def add_words(self, part_result):
+        """Adds the recognized words of a result of the recognizer
+
+        Args:
+            part_result (dict): result of the recognizer
+        """
+        if "result" in part_result:
+            for cur_word in part_result["result"]:
+                self.word_list.append([cur_word["word"], True, cur_word["start"], cur_word["end"]])
+
+    def finish(self):
+        """Completes the recognition of the broadcast
+
+        Returns:
+            np.ndarray: int16 samples of the broadcast
+            list: recognized words with their start and end time in the broadcast
+        """
+        self.add_words(json.loads(self.recognizer.FinalResult()))
+        return np.concatenate(self.blocks) if self.blocks else np.zeros(0, dtype=np.int16), self.word_list
+
+class LiveTrimmer:
+    """Finds the broadcasts in a stream with the begin and end sound samples and converts them while the stream arrives.
+    The memory only depends on the length of the sound samples and the maximum length of a broadcast, not on the length of the stream.
+    """
+
+    def __init__(self, begin_templates, end_templates, threshold, max_length, on_broadcast):
+        """Prepares the search for the sound samples
+
+        Args:
+            begin_templates (list): templates of the sound samples played at the begin of a broadcast, see load_template_bank()
+            end_templates (list): templates of the sound samples played at the end of a broadcast, see load_template_bank()
+            threshold (float): minimum normalized correlation a sound sample has to have so that it is valid
+            max_length (int): maximum number of samples of a broadcast
+            on_broadcast (callable): called with the samples, the words and the start time of every finished broadcast
+        """
+        self.begin_templates = begin_templates
+        self.end_templates = end_templates
+        self.matcher = TemplateMatcher(begin_templates + end_templates, None, threshold)
+        self.max_template_len = max(len(template["samples"]) for template in begin_templates + end_templates)
+        self.max_length = max_length
+        self.on_broadcast = on_broadcast
+        self.events = []
+        #Samples of the stream which might still be part of a broadcast, starting at history_start
+        self.history = []
+        self.history_start = 0
+        self.fed_position = 0
+        self.broadcast = None
+
+    def feed(self, block):
+        """Searches the next block of the stream for the sound samples and feeds the current broadcast
+
+        Args:
+            block (np.ndarray): next int16 samples of the stream
+        """
+        self.history.append(block)
+        self.matcher.feed(block.astype(np.float32) / 32768)
+        self.add_events(self.matcher.pop_final_peaks())
+        #All peaks before this position are known, so the audio before it can be handled
+        self.process(self.matcher.position - self.max_template_len)
+
+    def finish(self):
+        """Handles the rest of the stream, an unfinished broadcast is discarded"""
+        self.matcher.finish()
+        self.add_events(self.matcher.pop_final_peaks())
+        self.process(self.history_start + sum(len(block) for block in self.history))
+        if self.broadcast is not None:
+            logger.warning("The stream ended before the end of the broadcast at {:.2f}s".format(self.broadcast.start / sample_rate))
+
+    def add_events(self, final_peaks):
+        """Adds the final peaks of the sound samples as begin and end events
+
+        Args:
+            final_peaks (list): final peaks of each template, see TemplateMatcher.pop_final_peaks()
+        """
+        begin_peaks = suppress_peaks(final_peaks[:len(self.begin_templates)], self.begin_templates, True)
+        end_peaks = suppress_peaks(final_peaks[len(self.begin_templates):], self.end_templates)
+        self.events += [(position, "begin", correlation) for correlation, position in begin_peaks]
+        self.events += [(position, "end", correlation) for correlation, position in end_peaks]
+        self.events.sort()
+
+    def process(self, safe_position):
+        """Handles the events and feeds the audio up to a position up to which all events are known
+
+        Args:
+            safe_position (int): position up to which all events are known
+        """
+        while len(self.events) > 0 and self.events[0][0] <= safe_position:
+            position, kind, correlation = self.events.pop(0)
+            self.feed_broadcast(position)
+            if kind == "begin":
+                if self.broadcast is not None:
+                    logger.warning("No end sound sample found for the broadcast at {:.2f}s".format(self.broadcast.start / sample_rate))
+                logger.info("Broadcast begins at {:.2f}s with correlation {:.3f}".format(position / sample_rate, correlation))
+                self.broadcast = Broadcast(position, get_model("stt"))
+                self.fed_position = position
+            elif self.broadcast is not None:
+                logger.info("Broadcast ends at {:.2f}s with correlation {:.3f}".format(position / sample_rate, correlation))
+                samples, word_list = self.broadcast.finish()
+                self.on_broadcast(samples, word_list, self.broadcast.started)
+                self.broadcast = None
+        self.feed_broadcast(safe_position)
+        self.drop_history(self.fed_position if self.broadcast is not None else safe_position)
+
+    def feed_broadcast(self, position):
+        """Feeds the audio up to a position to the current broadcast
+
+        Args:
+            position (int): position up to which the audio is fed
+        """
+        if self.broadcast is None or position <= self.fed_position:
+            return
+        samples = self.get_history(self.fed_position, position)
+        self.fed_position = position
+        self.broadcast.feed(samples)
+        if self.broadcast.length > self.max_length:
+            logger.warning("The broadcast at {:.2f}s is longer than the maximum length and is discarded".format(self.broadcast.start / sample_rate))
+            self.broadcast = None
+
+    def get_history(self, begin, end):
+        """Returns the samples of the stream between two positions
+
+        Args:
+            begin (int): position of the first sample
+            end (int): position after the last sample
+
+        Returns:
+            np.ndarray: int16 samples
+        """
+        samples = np.concatenate(self.history) if len(self.history) > 1 else self.history[0]
+        self.history = [samples]
+        return samples[max(begin - self.history_start, 0):end - self.history_start]
+
+    def drop_history(self, position):
+        """Forgets the samples of the stream before a position
+
+        Args:
+            position (int): position of the first sample that is kept
+        """
+        while len(self.history) > 0 and self.history_start + len(self.history[0]) <= position:
+            self.history_start += len(self.history.pop(0))
+        if len(self.history) > 0 and position > self.history_start:
+            self.history[0] = self.history[0][position - self.history_start:]
+            self.history_start = position
+
+def save_broadcast(samples, word_list, started, output_dir):
+    """Stores a finished broadcast and converts the recognized words to the text representation
+
+    Args:
+        samples (np.ndarray): int16 samples of the broadcast
+        word_list (list): recognized words with their start and end time in the broadcast
+        started (datetime.datetime): time at which the broadcast began
+        output_dir (str): path to the output directory
+    """
+    file_name = "live_{}".format(started.strftime("%Y%m%d_%H%M%S"))
+    wav_file = os.path.join(output_dir, intermediate_dir, file_name + ".wav")
+    write_wav(wav_file, samples, sample_rate)
+    output_file = os.path.join(output_dir, file_name + ".txt")
+    try:
+        speech_to_text(wav_file, output_file, word_list)
+        logger.info("Transcript of the broadcast saved to {}".format(output_file))
+    except Exception as e:
+        logger.error("Conversion of {} failed: {}".format(file_name, e))
+
+def check_args(args):
+    """Reads the arguments provided by the user and loads the sound samples
+
+    Args:
+        args (argparse.Namespace): The args generated by setup_args()
+
+    Returns:
+        list: templates of the begin sound samples
+        list: templates of the end sound samples
+        float: minimum normalized correlation of the sound samples
+        list: names of the enabled conversion stages
+    """
+    log_level = "DEBUG" if args.debug else "INFO"
+    setup_logging(log_level)
+    setup_logging_live(log_level)
+    if args.input != "-":
+        does_path_exist(args.input, "Input")
+    does_path_exist(args.output_dir, "OutputDir")
+    if args.begin_sounds_dir is None or args.end_sounds_dir is None:
+        logger.error("No directory with begin or end sounds provided!")
+        exit()
+    does_path_exist(args.begin_sounds_dir, "BeginSoundDir")
+    does_path_exist(args.end_sounds_dir, "EndSoundDir")
+    if args.min_correlation is None:
+        logger.error("The live mode requires a minimum correlation!")
+        exit()
+    if float(args.max_length) <= 0:
+        logger.error("Maximum length has to be positive")
+        exit()
+    stages = all_stages if args.stages is None else ["stt"] + [stage for stage in all_stages if stage in args.stages and stage != "stt"]
+    template_bank_path = os.path.join(args.output_dir, template_bank_dir)
+    begin_templates = load_template_bank(args.begin_sounds_dir, template_bank_path)
+    end_templates = load_template_bank(args.end_sounds_dir, template_bank_path)
+    if len(begin_templates) == 0 or len(end_templates) == 0:
+        logger.error("No .mp3 sound samples for trimming provided!")
+        exit()
+    if template_sample_rate(begin_templates + end_templates) != sample_rate:
+        logger.error("Sound samples have to be sampled with {}Hz".format(sample_rate))
+        exit()
+    return begin_templates, end_templates, float(args.min_correlation), stages
+
+def main():
+    """Converts the broadcasts of a stream while it arrives"""
+    args = setup_args()
+    begin_templates, end_templates, min_correlation, stages = check_args(args)
+    intermediate_dir_path = os.path.join(args.output_dir, intermediate_dir)
+    if not os.path.exists(intermediate_dir_path):
+        os.makedirs(intermediate_dir_path)
+    diarize_threads = int(args.diarize_threads) if args.diarize_threads is not None else None
+    setup_models(args.language, diarize_threads, 1, stages, None if args.no_cache else os.path.join(args.output_dir, cache_dir))
+    #Finished broadcasts are converted in the background, so that the stream is read on without a gap
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        on_broadcast = lambda samples, word_list, started: executor.submit(save_broadcast, samples, word_list, started, args.output_dir)
+        trimmer = LiveTrimmer(begin_templates, end_templates, min_correlation, int(float(args.max_length) * 60 * sample_rate), on_broadcast)
+        logger.info("Waiting for broadcasts in {}".format("stdin" if args.input == "-" else args.input))
+        try:
+            for block in read_stream_blocks(args.input, args.raw, args.follow):
+                trimmer.feed(block)
+            trimmer.finish()
+        except KeyboardInterrupt:
+            logger.info("Stopped reading the stream")
+    logger.info("Live mode finished!")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,21 @@
 import logging
 import os 
 import glob
-from AudioPreprocessing import trim_audio, change_rate, setup_logging_preprocessing
-from RadioSummarizer import speech_to_text, setup_logging_summarizer, setup_models
+from AudioPreprocessing import preprocess_files, load_template_bank, setup_logging_preprocessing
+from RadioSummarizer import speech_to_text, setup_logging_summarizer, setup_models, get_missing_stages, all_stages, punctuation_backends
+from WorkerPool import WorkerPool, format_memory_usage
+from ModelPool import language_stages
+from Instrumentation import setup_instrumentation
+from Archive import archive_file
 import argparse
+from collections import Counter
+from concurrent.futures import as_completed
 
 intermediate_dir = "intermediate"
+template_bank_dir = "template_bank"
+cache_dir = "cache"
+metrics_file = "metrics.jsonl"
+profile_dir = "profiles"
 
 def setup_logging(log_level):
     """Sets up the logger for this module
@@ -36,15 +46,34 @@ def setup_args():
         argparse.Namespace: Contains the arguments provided by the user
     """
     parser = argparse.ArgumentParser()
+    parser.add_argument("-a", "--archive", dest = "archive", action='store_true', help="Add the recognized words with their times to the searchable archive?")
     parser.add_argument("-b", "--begin", dest = "begin_sounds_dir", help="Directory with sounds played at the begining")
-    parser.add_argument("-c", "--min_correlation", dest = "min_correlation", default = -1, help="filter value for trim correlation")
+    parser.add_argument("-bw", "--begin_window", dest = "begin_window", default = None, help="Seconds at the begin of a file that are searched for the begin sounds first")
+    parser.add_argument("-c", "--min_correlation", dest = "min_correlation", default = -1, help="filter value for the normalized trim correlation (between -1 and 1)")
+    parser.add_argument("-cc", "--coarse_candidates", dest = "coarse_candidates", default = 0, help="Number of candidates kept by the coarse trim search, 0 disables it")
+    parser.add_argument("-cf", "--coarse_factor", dest = "coarse_factor", default = 8, help="Decimation factor of the coarse trim search")
+    parser.add_argument("-cw", "--conversion_workers", dest = "conversion_workers", default = 1, help="Number of forked processes that convert the files with the models loaded once")
     parser.add_argument("-d", "--delete", dest = "delete", action='store_true', help="Delete contents of intermediate Directory?")
     parser.add_argument("-db", "--debug", dest = "debug", action='store_true', help="Show debug information?")
+    parser.add_argument("-dt", "--diarize_threads", dest = "diarize_threads", default = None, help="Number of threads used for the diarization while the speech-to-text conversion runs")
     parser.add_argument("-e", "--end", dest = "end_sounds_dir", help="Directory with sound played at the ending")
+    parser.add_argument("-ew", "--end_window", dest = "end_window", default = None, help="Seconds at the end of a file that are searched for the end sounds first")
     parser.add_argument("-i", "--input",dest ="input", help="Audiofile/or Directory of files to convert")
+    parser.add_argument("-j", "--jobs", dest = "jobs", default = 1, help="Number of processes used for trimming and converting the audio files")
     parser.add_argument("-l", "--language",dest ="language", default="de", help="Language used in the audiofile")
+    parser.add_argument("-lt", "--language_tags", dest = "language_tags", default = None, help="Text file with a file name and its language code per line, files that aren't listed use -l")
+    parser.add_argument("-m", "--multi", dest = "multi", action='store_true', help="Trim every broadcast of the audio file instead of only one?")
+    parser.add_argument("-me", "--metrics", dest = "metrics", action='store_true', help="Append the wall time, CPU time, peak memory and real-time factor of every stage to a JSON lines file?")
+    parser.add_argument("-mm", "--model_memory", dest = "model_memory", default = None, help="Memory in MB the loaded models may use together, the least recently used ones are released above it")
+    parser.add_argument("-nc", "--no_cache", dest = "no_cache", action='store_true', help="Compute every stage again instead of using the cached results?")
     parser.add_argument("-o", "--output_dir", dest = "output_dir", default = "output", help="Output directory")
+    parser.add_argument("-pb", "--punctuation_backend", dest = "punctuation_backend", choices = punctuation_backends, default = "torch", help="Backend of the punctuation model, int8 uses a dynamically quantized model on the CPU")
+    parser.add_argument("-pr", "--profile", dest = "profile", choices = ["trim", "convert"] + all_stages, default = None, help="Stage to profile with cProfile")
+    parser.add_argument("-pt", "--punctuation_threads", dest = "punctuation_threads", default = None, help="Number of threads used by the punctuation model")
+    parser.add_argument("-s", "--streaming", dest = "streaming", action='store_true', help="Trim the audio file block by block with bounded memory?")
+    parser.add_argument("-sg", "--stages", dest = "stages", nargs = "+", choices = ["trim"] + all_stages, default = None, help="Stages to run, defaults to all conversion stages and trim if -t is used")
     parser.add_argument("-t", "--trimfile", dest = "trimfile", action='store_true', help="Trim the audio file before conversion?")
+    parser.add_argument("-tt", "--stt_threads", dest = "stt_threads", default = 1, help="Number of threads that decode chunks of the audio in parallel")
     return parser.parse_args()
 
 def does_path_exist(current_path, name):
@@ -58,6 +87,27 @@ def does_path_exist(current_path, name):
         logger.error("{} doesn't exist".format(name))
         exit()
         
+def read_language_tags(tags_file):
+    """Reads the languages of the audio files
+
+    Args:
+        tags_file (str): path to a text file with a file name and its language code per line
+
+    Returns:
+        dict: language code of every listed file name
+    """
+    language_tags = {}
+    with open(tags_file, "r") as file:
+        for line_number, line in enumerate(file, 1):
+            parts = line.split()
+            if len(parts) == 0 or parts[0].startswith("#"):
+                continue
+            if len(parts) != 2:
+                logger.error("Line {} of the language tags isn't a file name and a language code".format(line_number))
+                exit()
+            language_tags[os.path.basename(parts[0])] = parts[1]
+    return language_tags
+
 def check_args(args):
     """Reads the arguments provided by the user
 
@@ -66,13 +116,32 @@ def check_args(args):
 
     Returns:
         str: language_code
+        dict: language code of the files with another language, by file name
         str: path to source file
         bool: if file should be trimmed 
-        int: value of the minimum correlation for trimming files
+        float: value of the minimum correlation for trimming files
         str: path to the directory with the sound samples of the beginning of a broadcast
         str: path to the directory with the sound samples of the end of a broadcast
         str: path to the output directory 
         bool: if contents of intermediate directory should be deleted
+        bool: if files should be trimmed block by block
+        int: number of candidates kept by the coarse trim search
+        int: decimation factor of the coarse trim search
+        float: seconds at the begin of a file searched for the begin sounds first, None for the whole file
+        float: seconds at the end of a file searched for the end sounds first, None for the whole file
+        bool: if every broadcast of a file should be trimmed
+        int: number of processes used for preprocessing
+        int: number of forked processes that convert the files
+        int: number of threads used for the diarization, None for all cores not used for speech-to-text
+        int: number of threads used for speech-to-text
+        str: backend of the punctuation model
+        int: number of threads used by the punctuation model, None for the default of torch
+        int: memory in bytes the loaded models may use together, None for no limit
+        list: names of the enabled conversion stages
+        bool: if the cached results should be used
+        bool: if the recognized words should be added to the archive
+        bool: if the stages should be measured
+        str: name of the stage to profile, None for no profiling
     """
     #Reads the input of the -db flag
     is_debug = args.debug
@@ -88,8 +157,15 @@ def check_args(args):
     source_path = args.input
     does_path_exist(source_path, "SourceFile")
     
-    #Reads the input of the -t
+    #Reads the input of the -t and -sg flag
     trim_file = args.trimfile
+    stages = all_stages
+    if args.stages != None:
+        trim_file = trim_file or "trim" in args.stages
+        stages = [stage for stage in all_stages if stage in args.stages]
+    if ("punctuate" in stages or "capitalize" in stages) and "stt" not in stages:
+        logger.error("Punctuation and capitalization require the stt stage!")
+        exit()
     
     #Reads the input of the -b flag
     if(trim_file and args.begin_sounds_dir == None):
@@ -99,6 +175,43 @@ def check_args(args):
     if trim_file:
         does_path_exist(begin_sounds_dir, "BeginSoundDir")
     
+    #Reads the input of the -dt flag
+    diarize_threads = None
+    if args.diarize_threads != None:
+        diarize_threads = int(args.diarize_threads)
+        if diarize_threads < 1:
+            logger.error("Number of diarization threads has to be at least 1")
+            exit()
+    
+    #Reads the input of the -cw flag
+    conversion_workers = int(args.conversion_workers)
+    if conversion_workers < 1:
+        logger.error("Number of conversion workers has to be at least 1")
+        exit()
+    
+    #Reads the input of the -tt flag
+    stt_threads = int(args.stt_threads)
+    if stt_threads < 1:
+        logger.error("Number of speech-to-text threads has to be at least 1")
+        exit()
+    
+    #Reads the input of the -pb and -pt flag
+    punctuation_backend = args.punctuation_backend
+    punctuation_threads = None
+    if args.punctuation_threads != None:
+        punctuation_threads = int(args.punctuation_threads)
+        if punctuation_threads < 1:
+            logger.error("Number of punctuation threads has to be at least 1")
+            exit()
+    
+    #Reads the input of the -mm flag
+    model_memory = None
+    if args.model_memory != None:
+        model_memory = int(float(args.model_memory) * (1 << 20))
+        if model_memory <= 0:
+            logger.error("Model memory has to be more than 0 MB")
+            exit()
+    
     #Reads the input of the -e flag
     if(trim_file and args.end_sounds_dir == None):
         logger.error("No directory with end sounds provided!")
@@ -108,13 +221,58 @@ def check_args(args):
         does_path_exist(end_sounds_dir, "EndSoundDir")
        
     #Reads the input of the -c flag    
-    min_correlation = int(args.min_correlation)
+    min_correlation = float(args.min_correlation)
+    
+    #Reads the input of the -cc and -cf flag
+    coarse_candidates = int(args.coarse_candidates)
+    coarse_factor = int(args.coarse_factor)
+    if coarse_factor < 1:
+        logger.error("Coarse factor has to be at least 1")
+        exit()
+    
+    #Reads the input of the -bw and -ew flag
+    begin_window = None if args.begin_window is None else float(args.begin_window)
+    end_window = None if args.end_window is None else float(args.end_window)
+    if (begin_window is not None and begin_window <= 0) or (end_window is not None and end_window <= 0):
+        logger.error("Search windows have to be longer than 0 seconds")
+        exit()
+    
+    #Reads the input of the -m flag
+    multi = args.multi
+    if multi and min_correlation == -1:
+        logger.error("Trimming every broadcast requires a minimum correlation!")
+        exit()
     
     #Reads the input of the -d flag
     delete_intermediate = args.delete
     
-    #Reads the input of the -l flag
+    #Reads the input of the -j flag
+    jobs = int(args.jobs)
+    if jobs < 1:
+        logger.error("Number of jobs has to be at least 1")
+        exit()
+    
+    #Reads the input of the -l and -lt flag
     language = args.language    
+    language_tags = {}
+    if args.language_tags != None:
+        does_path_exist(args.language_tags, "LanguageTags")
+        language_tags = read_language_tags(args.language_tags)
+
+    #Reads the input of the -s flag
+    streaming = args.streaming
+
+    #Reads the input of the -nc flag
+    use_cache = not args.no_cache
+
+    #Reads the input of the -a flag
+    use_archive = args.archive
+
+    #Reads the input of the -me flag
+    metrics = args.metrics
+
+    #Reads the input of the -pr flag
+    profile_stage = args.profile
 
     #Reads the input of the -o flag
     output_dir = args.output_dir
@@ -123,71 +281,128 @@ def check_args(args):
         logger.error("Entered file as output directory")
         exit()
 
-    return language, source_path, trim_file, min_correlation, begin_sounds_dir, end_sounds_dir, output_dir, delete_intermediate
+    return language, language_tags, source_path, trim_file, min_correlation, begin_sounds_dir, end_sounds_dir, output_dir, delete_intermediate, streaming, coarse_candidates, coarse_factor, begin_window, end_window, multi, jobs, conversion_workers, diarize_threads, stt_threads, punctuation_backend, punctuation_threads, model_memory, stages, use_cache, use_archive, metrics, profile_stage
  
-#Handling of program arguments   
-args = setup_args()
-language, source_path, trim_file, min_correlation, begin_sounds_dir, end_sounds_dir, output_dir, delete_intermediate = check_args(args)
-intermediate_dir_path = os.path.join(output_dir, intermediate_dir)
-if not os.path.exists(intermediate_dir_path):
-    os.makedirs(intermediate_dir_path)
-
-source_files = []
-wav_files = []
-if os.path.isfile(source_path):
-    if ".mp3" in source_path:
-        source_files.append(source_path)
-    elif ".wav" in source_path:
-        wav_files.append(source_path)
-else:
-    for file in glob.glob(os.path.join(source_path, "*")):
-        if ".mp3" in file:
-            source_files.append(file)
-        elif ".wav" in file:
-            wav_files.append(file)     
-
-if len(source_files) == 0 and len(wav_files) == 0:
-    logger.error("No valid source audio/s provided!")
-    exit()    
-
-
-#Trimming and Conversion of the source file
-logger.info("Preparing audiofiles...")
-trimmed_count = 0
-trimmed_files = []
-for file in source_files:
-    if trim_file:    
-        is_trimmed, trimmed_file = trim_audio(file, begin_sounds_dir, end_sounds_dir, intermediate_dir_path, min_correlation)
-        if is_trimmed:
-            trimmed_files.append(trimmed_file)
-            trimmed_count += 1            
-    else:   
-        trimmed_files.append(change_rate(file, intermediate_dir_path))
-        
-if trim_file:
-    if trimmed_count == 1:
-        logger.info("{} of {} was successfully trimmed.".format(trimmed_count, len(source_files)))
+def main():
+    """Runs the trimming and the conversion of the audio files provided by the user"""
+    #Handling of program arguments   
+    args = setup_args()
+    language, language_tags, source_path, trim_file, min_correlation, begin_sounds_dir, end_sounds_dir, output_dir, delete_intermediate, streaming, coarse_candidates, coarse_factor, begin_window, end_window, multi, jobs, conversion_workers, diarize_threads, stt_threads, punctuation_backend, punctuation_threads, model_memory, stages, use_cache, use_archive, metrics, profile_stage = check_args(args)
+    intermediate_dir_path = os.path.join(output_dir, intermediate_dir)
+    if not os.path.exists(intermediate_dir_path):
+        os.makedirs(intermediate_dir_path)
+    cache_dir_path = os.path.join(output_dir, cache_dir) if use_cache else None
+    setup_instrumentation(os.path.join(output_dir, metrics_file) if metrics else None, profile_stage, os.path.join(output_dir, profile_dir) if profile_stage is not None else None)
+
+    source_files = []
+    wav_files = []
+    if os.path.isfile(source_path):
+        if ".mp3" in source_path:
+            source_files.append(source_path)
+        elif ".wav" in source_path:
+            wav_files.append(source_path)
     else:
-        logger.info("{} of {} were successfully trimmed.".format(trimmed_count, len(source_files)))
+        for file in glob.glob(os.path.join(source_path, "*")):
+            if ".mp3" in file:
+                source_files.append(file)
+            elif ".wav" in file:
+                wav_files.append(file)     
 
-if len(trimmed_files) == 0 and len(wav_files) == 0:
-    logger.error("No files for conversion!")
-    exit()
-    
-files_to_convert = trimmed_files + wav_files
-#Conversion of audio to text 
-setup_models(language)
-for file in files_to_convert:
-    file_name = os.path.basename(file)
-    logger.info("Starting conversion of {}".format(file_name))
-    output_file = os.path.join(output_dir, os.path.basename(file).replace(".wav", ".txt"))
-    speech_to_text(file, output_file)
-
-#Deletion of contents in the intermediate folder
-if delete_intermediate:
-    logger.info("Deleting files in Intermediate directory...")
-    files = glob.glob(intermediate_dir_path + "/*")
-    for file in files:
-        os.remove(file)
-
-logger.info("Speech to text conversion finished!")
\ No newline at end of file
+    if len(source_files) == 0 and len(wav_files) == 0:
+        logger.error("No valid source audio/s provided!")
+        exit()    
+
+
+    #Loading of the sound samples used for trimming
+    if trim_file and len(source_files) > 0:
+        template_bank_path = os.path.join(output_dir, template_bank_dir)
+        begin_templates = load_template_bank(begin_sounds_dir, template_bank_path)
+        end_templates = load_template_bank(end_sounds_dir, template_bank_path)
+        if len(begin_templates) == 0 or len(end_templates) == 0:
+            logger.error("No .mp3 sound samples for trimming provided!")
+            exit()
+
+    #Trimming and Conversion of the source file
+    logger.info("Preparing audiofiles...")
+    trimmed_count = 0
+    trimmed_files = []
+    options = {"output_dir": intermediate_dir_path, "trim_file": trim_file, "correlation_threshold": min_correlation, "multi": multi,
+        "streaming": streaming, "coarse_candidates": coarse_candidates, "coarse_factor": coarse_factor, "begin_window": begin_window, "end_window": end_window, "cache_dir": cache_dir_path}
+    if trim_file:
+        options["begin_templates"] = begin_templates
+        options["end_templates"] = end_templates
+    log_level = logging.getLevelName(logger.level)
+    file_languages = {file: language_tags.get(os.path.basename(file), language) for file in wav_files}
+    for file, is_processed, processed_files, error in preprocess_files(source_files, jobs, log_level, **options):
+        if error is not None:
+            logger.error("Preparing {} failed: {}".format(os.path.basename(file), error))
+        elif is_processed:
+            trimmed_files += processed_files
+            # Trimmed broadcasts have the language of their source file
+            for processed_file in processed_files:
+                file_languages[processed_file] = language_tags.get(os.path.basename(file), language)
+            if trim_file:
+                trimmed_count += 1
+            
+    if trim_file:
+        if trimmed_count == 1:
+            logger.info("{} of {} was successfully trimmed.".format(trimmed_count, len(source_files)))
+        else:
+            logger.info("{} of {} were successfully trimmed.".format(trimmed_count, len(source_files)))
+
+    if len(trimmed_files) == 0 and len(wav_files) == 0:
+        logger.error("No files for conversion!")
+        exit()
+        
+    files_to_convert = trimmed_files + wav_files
+    if len(stages) == 0:
+        logger.info("No conversion stage selected, the prepared files are in {}".format(intermediate_dir_path))
+        files_to_convert = []
+    # Files of the same language follow each other, so that every model is only loaded once even with a small model memory
+    files_to_convert.sort(key=lambda file: file_languages[file])
+    #Conversion of audio to text 
+    if len(files_to_convert) > 0:
+        #Models are only loaded for results that aren't cached
+        setup_models(language, diarize_threads, stt_threads, stages, cache_dir_path, lazy = True, punctuation_backend = punctuation_backend, punctuation_threads = punctuation_threads,
+            archive_path = os.path.join(output_dir, archive_file) if use_archive else None, memory_budget = model_memory)
+    if len(files_to_convert) > 0 and conversion_workers > 1:
+        #The workers share the models that are loaded before they are forked, only models of stages that aren't cached are loaded, the most needed first
+        needed_models = Counter((stage, file_languages[file] if stage in language_stages else None) for file in files_to_convert
+            for stage in get_missing_stages(file, file_languages[file]))
+        pool = WorkerPool(min(conversion_workers, len(files_to_convert)), [model for model, _ in needed_models.most_common()])
+        futures = {}
+        for file in files_to_convert:
+            output_file = os.path.join(output_dir, os.path.basename(file).replace(".wav", ".txt"))
+            try:
+                futures[pool.submit(file, output_file, file_languages[file])] = file
+            except Exception as e:
+                logger.error("Converting {} failed: {}".format(os.path.basename(file), e))
+        for future in as_completed(futures):
+            file_name = os.path.basename(futures[future])
+            try:
+                future.result()
+                logger.info("Finished conversion of {}".format(file_name))
+            except Exception as e:
+                logger.error("Converting {} failed: {}".format(file_name, e))
+        #Shared memory of the models isn't copied by the workers
+        for pid, usage in pool.memory_usage().items():
+            logger.info(format_memory_usage(pid, usage))
+        pool.close()
+        files_to_convert = []
+    for file in files_to_convert:
+        file_name = os.path.basename(file)
+        logger.info("Starting conversion of {}".format(file_name))
+        output_file = os.path.join(output_dir, os.path.basename(file).replace(".wav", ".txt"))
+        speech_to_text(file, output_file, language = file_languages[file])
+
+    #Deletion of contents in the intermediate folder
+    if delete_intermediate:
+        logger.info("Deleting files in Intermediate directory...")
+        files = glob.glob(intermediate_dir_path + "/*")
+        for file in files:
+            os.remove(file)
+
+    logger.info("Speech to text conversion finished!")
+
+if __name__ == "__main__":
+    main()
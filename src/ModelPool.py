@@ -0,0 +1,98 @@
+import gc
+import logging
+import threading
+from collections import OrderedDict
+from Instrumentation import get_rss
+
+# Only these stages load a model of their own for every language, the others are shared by all languages
+language_stages = ["stt", "capitalize"]
+
+class ModelPool:
+    """Models of several stages and languages, loaded on their first use.
+    Language-independent models are loaded once for all languages. If the loaded models need more memory than the budget, the least recently used ones are released.
+    """
+
+    def __init__(self, loader, memory_budget = None):
+        """Creates an empty pool
+
+        Args:
+            loader (callable): function that loads the model of a stage and a language, see RadioSummarizer.load_model()
+            memory_budget (int, optional): resident memory in bytes the models may use together, None for no limit. Defaults to None.
+        """
+        self.loader = loader
+        self.memory_budget = memory_budget
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+
+    def key(self, stage, language):
+        """Returns the key under which the model of a stage is stored
+
+        Args:
+            stage (str): name of the stage
+            language (str): language code
+
+        Returns:
+            tuple: the stage and the language, None as language for language-independent models
+        """
+        return (stage, language if stage in language_stages else None)
+
+    def get(self, stage, language):
+        """Returns the model of a stage and a language and loads it if it isn't in the pool
+
+        Args:
+            stage (str): name of the stage
+            language (str): language code
+
+        Returns:
+            the model or pipeline of the stage
+        """
+        key = self.key(stage, language)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+            rss = get_rss()
+            model = self.loader(stage, language)
+            # The growth of the resident memory while loading is the size of the model
+            size = max(get_rss() - rss, 0) if rss is not None else 0
+            self.entries[key] = (model, size)
+            self.evict(key)
+            return model
+
+    def memory(self):
+        """Returns the estimated memory of all loaded models
+
+        Returns:
+            int: resident memory in bytes
+        """
+        with self.lock:
+            return sum(size for _, size in self.entries.values())
+
+    def has_room(self):
+        """Estimates if another model fits into the memory budget without releasing a loaded one, assuming it is as large as the loaded models on average
+
+        Returns:
+            bool: if another model fits, always True without a budget
+        """
+        with self.lock:
+            if self.memory_budget is None or len(self.entries) == 0:
+                return True
+            memory = self.memory()
+            return memory + memory / len(self.entries) <= self.memory_budget
+
+    def evict(self, keep_key):
+        """Releases the least recently used models until the loaded models fit into the memory budget
+
+        Args:
+            keep_key (tuple): key of the model that is about to be used and is never released
+        """
+        if self.memory_budget is None:
+            return
+        while self.memory() > self.memory_budget:
+            key = next((key for key in self.entries if key != keep_key), None)
+            if key is None:
+                break
+            _, size = self.entries.pop(key)
+            logging.getLogger("RadioSummarizer").info("Releasing the {} model{} ({:.0f}MB)".format(key[0], " for " + key[1] if key[1] else "", size / (1 << 20)))
+            # A model that is still used by a running conversion is only freed once the conversion is finished
+            gc.collect()
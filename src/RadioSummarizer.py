@@ -1,15 +1,38 @@
 import logging
 import os
-import wave
 import json
-import stanza
-from pydub import AudioSegment
-from pydub.silence import split_on_silence
-from vosk import Model, KaldiRecognizer, SetLogLevel
-from deepmultilingualpunctuation import PunctuationModel
-from pyannote.audio import Pipeline
+import heapq
+import bisect
+import re
+import importlib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from AudioPreprocessing import map_wav, hash_file
+from Cache import Cache, hash_text
+from Archive import Archive
+from ModelPool import ModelPool
+from Instrumentation import measure_stage, measure_call, get_audio_duration
 
 model_path = os.path.join("models", "vosk_model")
+# The libraries of the models are only imported once a stage that uses them is enabled
+stage_modules = {"stt": ["vosk"], "diarize": ["torch", "pyannote.audio"], "punctuate": ["deepmultilingualpunctuation"], "capitalize": ["stanza"]}
+all_stages = ["stt", "diarize", "punctuate", "capitalize"]
+stage_packages = {"stt": "vosk", "diarize": "pyannote.audio", "punctuate": "deepmultilingualpunctuation", "capitalize": "stanza"}
+diarization_model = "pyannote/speaker-diarization"
+punctuation_model_name = "oliverguhr/fullstop-punctuation-multilang-large"
+punctuation_backends = ["torch", "int8"]
+speaker_begin_pattern = re.compile(r"(\. | )?<---")
+speaker_end_punctuation_pattern = re.compile(r"--->[.,!?:]")
+speaker_punctuation_pattern = re.compile(r"Speaker-?\.?:?,?\??")
+speaker_end_period_pattern = re.compile(r"--->\.?(?: \.)?")
+line_break_pattern = re.compile(r"--->|<--- |[.!?]")
+line_breaks = {"--->": "--->\n", "<--- ": "\n<---", ".": ".\n", "!": "!\n", "?": "?\n"}
+sentence_end_pattern = re.compile(r"(?<=[.!?]) ")
+punctuation_window_size = 230
+punctuation_window_overlap = 5
+punctuation_batch_size = 8
+capitalization_window_size = 20000
+capitalization_batch_size = 4
 
 def setup_logging_summarizer(log_level):
     """Sets up the logger for this module
@@ -31,73 +54,364 @@ def setup_logging_summarizer(log_level):
     ch.setFormatter(formatter)
     logger.addHandler(ch)
     
-def setup_models(language):
+def import_stages(stages):
+    """Imports the libraries used by the models of the stages
+
+    Args:
+        stages (list): names of the enabled stages
+    """
+    for stage in stages:
+        for module in stage_modules.get(stage, []):
+            importlib.import_module(module)
+
+def setup_models(language, diarize_threads = None, stt_threads = 1, stages = all_stages, cache_dir = None, lazy = False, punctuation_backend = "torch", punctuation_threads = None, archive_path = None, memory_budget = None):
     """Sets up all models which will be used for the conversion
 
     Args:
-        language (str): language_code
-    """
-    global vosk_model
-    global diarize_pipeline
-    global punctuation_model
-    global capitalization_pipeline
-    SetLogLevel(-1)
-    logger.info('Setting up speech-to-text model...')
-    vosk_model = Model(model_path)
-    logger.info('Setting up diarization pipeline...')
-    diarize_pipeline = Pipeline.from_pretrained("pyannote/speaker-diarization")
-    logger.info("Setting up punctuation model...")
-    punctuation_model = PunctuationModel(model ="oliverguhr/fullstop-punctuation-multilang-large")
-    logger.info('Setting up capitalization pipeline...')
+        language (str): language_code of the files without their own language
+        diarize_threads (int, optional): number of threads used for the diarization while the speech-to-text conversion runs. Defaults to all cores not used by stt_threads.
+        stt_threads (int, optional): number of threads that decode chunks of the audio in parallel. Defaults to 1.
+        stages (list, optional): names of the enabled stages, the models of the other stages are neither imported nor loaded. Defaults to all_stages.
+        cache_dir (str, optional): path to the cache of the intermediate results, None disables the cache. Defaults to None.
+        lazy (bool, optional): if a model is only loaded once a stage isn't found in the cache. Defaults to False.
+        punctuation_backend (str, optional): "torch" for the full precision punctuation model, "int8" for its dynamically quantized version. Defaults to "torch".
+        punctuation_threads (int, optional): number of threads used by the punctuation model, None keeps the default of torch. Defaults to None.
+        archive_path (str, optional): path to the archive the recognized words are added to, None disables the archive. Defaults to None.
+        memory_budget (int, optional): resident memory in bytes the loaded models may use together, the least recently used ones are released above it. None for no limit. Defaults to None.
+    """
+    global models
+    global model_language
+    global diarize_thread_count
+    global stt_thread_count
+    global enabled_stages
+    global cache
+    global punctuation_backend_name
+    global punctuation_thread_count
+    global archive
+    models = ModelPool(load_model, memory_budget)
+    model_language = language
+    enabled_stages = list(stages)
+    stt_thread_count = stt_threads
+    punctuation_backend_name = punctuation_backend
+    punctuation_thread_count = punctuation_threads
+    diarize_thread_count = diarize_threads if diarize_threads is not None else max(1, (os.cpu_count() or 1) - stt_threads)
+    cache = Cache(cache_dir) if cache_dir is not None else None
+    archive = Archive(archive_path) if archive_path is not None else None
+    if not lazy:
+        for stage in enabled_stages:
+            get_model(stage)
+
+def get_model(stage, language = None):
+    """Returns the model of a stage and loads it on its first use
+
+    Args:
+        stage (str): name of the stage
+        language (str, optional): language code, None for the language of setup_models(). Defaults to None.
+
+    Returns:
+        the model or pipeline of the stage
+    """
+    language = language or model_language
+    if stage == "stt" and get_stt_model_path(language) == model_path:
+        # Languages without a vosk model of their own share the default model
+        language = None
+    return models.get(stage, language)
+
+def load_model(stage, language):
+    """Loads the model of a stage
+
+    Args:
+        stage (str): name of the stage
+        language (str): language code, only used by stt and capitalize. None loads the default vosk model.
+
+    Returns:
+        the model or pipeline of the stage
+    """
+    import_stages([stage])
+    if stage == "stt":
+        from vosk import Model, SetLogLevel
+        SetLogLevel(-1)
+        logger.info('Setting up speech-to-text model{}...'.format(" for " + language if language else ""))
+        return Model(get_stt_model_path(language))
+    elif stage == "diarize":
+        from pyannote.audio import Pipeline
+        logger.info('Setting up diarization pipeline...')
+        return Pipeline.from_pretrained(diarization_model)
+    elif stage == "punctuate":
+        logger.info("Setting up punctuation model...")
+        return load_punctuation_model(punctuation_backend_name)
+    import stanza
+    logger.info('Setting up capitalization pipeline for {}...'.format(language))
     stanza.download(lang = language, logging_level="ERROR")
-    capitalization_pipeline = stanza.Pipeline(processors="tokenize,pos", lang=language, logging_level="ERROR")
-    
+    return stanza.Pipeline(processors="tokenize,pos", lang=language, logging_level="ERROR")
 
-def speech_to_text(source_file, output_file):
-    """Converts source_file to an output file containing the text representation of the broadcast 
+def get_stt_model_path(language):
+    """Returns the path to the vosk model of a language
+
+    Args:
+        language (str): language code, None for the default model
+
+    Returns:
+        str: path to "models/vosk_model_<language>" if it exists, otherwise to the default model
+    """
+    if language is None:
+        return model_path
+    language_model_path = "{}_{}".format(model_path, language)
+    return language_model_path if os.path.isdir(language_model_path) else model_path
+
+def load_punctuation_model(backend):
+    """Loads the punctuation model with the given backend
+
+    Args:
+        backend (str): "torch" for the full precision model, "int8" for its dynamically quantized version
+
+    Returns:
+        deepmultilingualpunctuation.punctuationmodel.PunctuationModel: the model to restore punctuation
+    """
+    from deepmultilingualpunctuation import PunctuationModel
+    model = PunctuationModel(model = punctuation_model_name)
+    if backend == "int8":
+        import torch
+        # The weights of the linear layers are stored as int8 and the activations are quantized on the fly, which is only supported on the CPU
+        model.pipe.model = torch.quantization.quantize_dynamic(model.pipe.model.to("cpu"), {torch.nn.Linear}, dtype=torch.qint8)
+        model.pipe.device = torch.device("cpu")
+    return model
+
+def get_model_identity(stage, language = None):
+    """Describes the model of a stage without loading it, so that cached results of another model aren't used
+
+    Args:
+        stage (str): name of the stage
+        language (str, optional): language code, None for the language of setup_models(). Defaults to None.
+
+    Returns:
+        list: package version and model of the stage
+    """
+    from importlib import metadata
+    try:
+        version = metadata.version(stage_packages[stage])
+    except metadata.PackageNotFoundError:
+        version = None
+    language = language or model_language
+    if stage == "stt":
+        # A replaced vosk model has other modification times
+        stt_model_path = get_stt_model_path(language)
+        model_files = [os.path.join(directory, file) for directory, _, files in os.walk(stt_model_path) for file in files]
+        return [version, os.path.realpath(stt_model_path), max([os.stat(file).st_mtime_ns for file in model_files], default=0)]
+    if stage == "diarize":
+        return [version, diarization_model]
+    if stage == "punctuate":
+        identity = [version, punctuation_model_name, punctuation_window_size, punctuation_window_overlap]
+        # The quantized model predicts slightly different labels, the entries of the full precision model stay valid
+        return identity + [punctuation_backend_name] if punctuation_backend_name != "torch" else identity
+    return [version, language, capitalization_window_size]
+
+def speech_to_text(source_file, output_file, word_list = None, language = None):
+    """Converts source_file to an output file containing the text representation of the broadcast.
+    Only the stages enabled in setup_models() are applied, results found in the cache aren't computed again.
 
     Args:
         source_file (str): path to the source file
         output_file (str): path to the output file
+        word_list (list, optional): words that were already recognized while the audio was recorded, None to convert the speech to text. Defaults to None.
+        language (str, optional): language code of the broadcast, None for the language of setup_models(). Defaults to None.
     """
-    word_list = generate_text(source_file, vosk_model)
-    result_diarization = diarize_text(source_file, diarize_pipeline)
-    text = insert_speakers(word_list, result_diarization)
-    text = punctuate_text(text, punctuation_model)
-    text = adjust_text_after_punctuation(text)
-    text = correct_capitalization(text, capitalization_pipeline)
-    text = adjust_text_after_capitalization(text)
+    if "stt" not in enabled_stages:
+        word_list = []
+    result_diarization = None if "diarize" in enabled_stages else []
+    if cache is not None:
+        audio_hash = hash_file(source_file)
+        if word_list is None:
+            # The chunks decoded in parallel depend on the number of threads
+            words_key = cache.key("stt", get_model_identity("stt", language), audio_hash, stt_thread_count)
+            word_list = cache.load_words(words_key)
+        if result_diarization is None:
+            turns_key = cache.key("diarize", get_model_identity("diarize"), audio_hash)
+            result_diarization = cache.load_turns(turns_key)
+    is_stt_missing = word_list is None
+    is_diarization_missing = result_diarization is None
+    audio_duration = get_audio_duration(source_file)
+    # The audio is mapped once and shared by the speech-to-text conversion, its splitting and the diarization
+    audio = AudioBuffer(source_file) if is_stt_missing or is_diarization_missing else None
+    if is_diarization_missing:
+        import torch
+        #Speech-to-text and diarization are independent of each other, so they run at the same time
+        thread_count = torch.get_num_threads()
+        torch.set_num_threads(diarize_thread_count)
+        # Both models are loaded before the diarization starts, since the model pool measures the size of a model by the memory of the process
+        diarization_model = get_model("diarize")
+        stt_model = get_model("stt", language) if is_stt_missing else None
+        try:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                diarization_future = executor.submit(measure_call, "diarize", source_file, audio_duration, diarize_text, source_file, diarization_model, audio)
+                if is_stt_missing:
+                    word_list = measure_call("stt", source_file, audio_duration, generate_text, source_file, stt_model, stt_thread_count, audio)
+                result_diarization = diarization_future.result()
+        finally:
+            torch.set_num_threads(thread_count)
+    elif is_stt_missing:
+        word_list = measure_call("stt", source_file, audio_duration, generate_text, source_file, get_model("stt", language), stt_thread_count, audio)
+    if cache is not None and is_stt_missing:
+        cache.save_words(words_key, word_list)
+    if cache is not None and is_diarization_missing:
+        cache.save_turns(turns_key, result_diarization)
+    if archive is not None and "stt" in enabled_stages:
+        first_speaker = result_diarization[0][2] if len(result_diarization) > 0 else None
+        if archive.ingest(source_file, hash_file(source_file) if cache is None else audio_hash, build_transcript(word_list, result_diarization), first_speaker):
+            logger.info("Added {} words to the archive".format(len(word_list)))
+    if "stt" in enabled_stages:
+        text = insert_speakers(word_list, result_diarization)
+    else:
+        text = render_speakers(result_diarization)
+    if "punctuate" in enabled_stages:
+        punctuated_text = None
+        if cache is not None:
+            punctuation_key = cache.key("punctuate", get_model_identity("punctuate"), hash_text(text))
+            punctuated_text = cache.load_text(punctuation_key)
+        if punctuated_text is None:
+            model = get_model("punctuate")
+            with measure_stage("punctuate", source_file, audio_duration):
+                punctuated_text = punctuate_text(text, model, thread_count = punctuation_thread_count)
+            if cache is not None:
+                cache.save_text(punctuation_key, punctuated_text)
+        text = adjust_text_after_punctuation(punctuated_text)
+    if "capitalize" in enabled_stages:
+        tagged_words = None
+        if cache is not None:
+            tags_key = cache.key("capitalize", get_model_identity("capitalize", language), hash_text(text))
+            tagged_words = cache.load_tags(tags_key)
+        if tagged_words is None:
+            pipeline = get_model("capitalize", language)
+            with measure_stage("capitalize", source_file, audio_duration):
+                tagged_words = tag_words(text, pipeline)
+            if cache is not None:
+                cache.save_tags(tags_key, tagged_words)
+        text = capitalize_words(tagged_words)
+    if "punctuate" in enabled_stages or "capitalize" in enabled_stages:
+        text = adjust_text_after_capitalization(text)
     logger.info(text)
     save_to_txt(text,output_file) 
 
-def generate_text(source_file, model):
+def get_missing_stages(source_file, language = None):
+    """Finds the enabled stages whose results speech_to_text() can't take from the cache, so their models will be loaded for the file.
+    A stage after a missing one is counted as missing, because its input is only known once the missing stage ran.
+
+    Args:
+        source_file (str): path to the source file
+        language (str, optional): language code of the broadcast, None for the language of setup_models(). Defaults to None.
+
+    Returns:
+        list: names of the stages that need their model
+    """
+    if cache is None:
+        return list(enabled_stages)
+    missing_stages = []
+    audio_hash = hash_file(source_file)
+    word_list = [] if "stt" not in enabled_stages else cache.load_words(cache.key("stt", get_model_identity("stt", language), audio_hash, stt_thread_count))
+    result_diarization = [] if "diarize" not in enabled_stages else cache.load_turns(cache.key("diarize", get_model_identity("diarize"), audio_hash))
+    if word_list is None:
+        missing_stages.append("stt")
+    if result_diarization is None:
+        missing_stages.append("diarize")
+    text_stages = [stage for stage in ["punctuate", "capitalize"] if stage in enabled_stages]
+    if len(missing_stages) > 0:
+        return missing_stages + text_stages
+    text = render_transcript(build_transcript(word_list, result_diarization))
+    if "punctuate" in enabled_stages:
+        punctuated_text = cache.load_text(cache.key("punctuate", get_model_identity("punctuate"), hash_text(text)))
+        if punctuated_text is None:
+            return text_stages
+        text = adjust_text_after_punctuation(punctuated_text)
+    if "capitalize" in enabled_stages and cache.load_tags(cache.key("capitalize", get_model_identity("capitalize", language), hash_text(text))) is None:
+        return ["capitalize"]
+    return []
+
+def preload_models(stages_and_languages):
+    """Loads models in the given order as long as they fit into the memory budget of setup_models(), the other ones are loaded on their first use
+
+    Args:
+        stages_and_languages (list): stage and language code of every model
+
+    Returns:
+        int: number of loaded models
+    """
+    for index, (stage, language) in enumerate(stages_and_languages):
+        if not models.has_room():
+            logger.info("The model memory is full, {} models are loaded on their first use".format(len(stages_and_languages) - index))
+            return index
+        get_model(stage, language)
+    return len(stages_and_languages)
+
+class AudioBuffer:
+    """16 bit mono samples of a .wav file, memory-mapped once and shared by all stages that read the audio"""
+    __slots__ = ("samples", "frame_rate")
+
+    def __init__(self, source_file):
+        """Maps the samples of the file, they are only read from the disk once they are accessed
+
+        Args:
+            source_file (str): path to a mono 16 bit PCM .wav file
+        """
+        self.samples, self.frame_rate = map_wav(source_file)
+
+    def read(self, start, frame_count):
+        """Returns the samples of a part of the audio in the format expected by vosk
+
+        Args:
+            start (int): index of the first frame
+            frame_count (int): number of frames, less are returned at the end of the audio
+
+        Returns:
+            bytes: 16 bit little-endian samples
+        """
+        return self.samples[start:start + frame_count].tobytes()
+
+    def to_waveform(self):
+        """Converts the audio to the in-memory input of pyannote, so that it doesn't load the file again
+
+        Returns:
+            dict: float32 waveform with one channel and its sample rate
+        """
+        import torch
+        waveform = np.divide(self.samples, 32768, dtype=np.float32)
+        return {"waveform": torch.from_numpy(waveform[np.newaxis]), "sample_rate": self.frame_rate}
+
+def generate_text(source_file, model, thread_count = 1, audio = None):
     """Converts the source_file into its text representation
 
     Args:
         source_file (str): path to the source file
         model (vosk.Model): the vosk model to use
+        thread_count (int, optional): number of threads that decode chunks of the audio in parallel. Defaults to 1.
+        audio (AudioBuffer, optional): the already mapped audio of source_file. Defaults to None.
 
     Returns:
         list: list containing the recognized words with their start and end time
     """
-    wf = wave.open(source_file, "rb")
+    if audio is None:
+        audio = AudioBuffer(source_file)
+    if thread_count > 1:
+        return generate_text_parallel(source_file, model, thread_count, audio)
     logger.info('Converting speech to text...')
-    rec = KaldiRecognizer(model, wf.getframerate())
+    from vosk import KaldiRecognizer
+    rec = KaldiRecognizer(model, audio.frame_rate)
     rec.SetWords(True)
 
     word_list = []
-    frames = split_audio(source_file, 500, -20)
+    frames = split_audio(source_file, 500, -20, audio = audio)
     frames = merge_splits(frames, 10)
     logger.debug("Splitted into " + str(len(frames)) + " Segments")
     index = 0
-    rest = wf.getnframes()
+    position = 0
+    rest = len(audio.samples)
     # Convert speech using vosk model
     while True:
         current_frames = rest
         if index < len(frames):
             current_frames = frames[index]
             rest -= current_frames
-        data = wf.readframes(current_frames)
+        data = audio.read(position, current_frames)
+        position += current_frames
         if len(data) == 0:
             break
         if rec.AcceptWaveform(data):
@@ -112,26 +426,213 @@ def generate_text(source_file, model):
             word_list.append([cur_word["word"], True, cur_word["start"], cur_word["end"]])
     return word_list
 
-def split_audio(source_file, min_silence_len, silence_thresh):
+def generate_text_parallel(source_file, model, thread_count, audio):
+    """Converts the source_file into its text representation by decoding chunks between silent parts in parallel
+
+    Args:
+        source_file (str): path to the source file
+        model (vosk.Model): the vosk model shared by all recognizers
+        thread_count (int): number of threads that decode chunks in parallel
+        audio (AudioBuffer): the mapped audio of source_file
+
+    Returns:
+        list: list containing the recognized words with their start and end time
+    """
+    logger.info('Converting speech to text with {} threads...'.format(thread_count))
+    frames = split_audio_at_silence(source_file, 500, -20, audio)
+    #More chunks than threads, so that threads finishing early can take over the remaining chunks
+    frames = merge_splits(frames, max(10, 4 * thread_count))
+    logger.debug("Splitted into " + str(len(frames)) + " Segments")
+    chunks = []
+    offset = 0
+    for current_frames in frames:
+        chunks.append((offset, current_frames))
+        offset += current_frames
+    #Each chunk is only copied out of the mapped audio once a thread decodes it
+    with ThreadPoolExecutor(max_workers=thread_count) as executor:
+        chunk_word_lists = executor.map(lambda chunk: decode_chunk(model, audio.frame_rate, audio.read(chunk[0], chunk[1]), chunk[0] / audio.frame_rate), chunks)
+        word_list = []
+        for chunk_word_list in chunk_word_lists:
+            word_list += chunk_word_list
+    return word_list
+
+def decode_chunk(model, frame_rate, data, offset):
+    """Converts a chunk of the audio with its own recognizer
+
+    Args:
+        model (vosk.Model): the vosk model to use
+        frame_rate (int): sample rate of the audio
+        data (bytes): 16 bit mono samples of the chunk
+        offset (float): start time of the chunk in the audio in seconds
+
+    Returns:
+        list: list containing the recognized words with their start and end time in the audio
+    """
+    from vosk import KaldiRecognizer
+    rec = KaldiRecognizer(model, frame_rate)
+    rec.SetWords(True)
+    results = []
+    step = 8000
+    for start in range(0, len(data), step):
+        if rec.AcceptWaveform(data[start:start + step]):
+            results.append(json.loads(rec.Result()))
+    results.append(json.loads(rec.FinalResult()))
+    word_list = []
+    for part_result in results:
+        if "result" in part_result:
+            for cur_word in part_result["result"]:
+                word_list.append([cur_word["word"], True, cur_word["start"] + offset, cur_word["end"] + offset])
+    return word_list
+
+def split_audio(source_file, min_silence_len, silence_thresh, keep_silence = 100, audio = None):
     """Splits the audio at times where a dB is below silence_thresh
 
     Args:
         source_file (str): path to the source audio
         min_silence_len (int): length of silence_thresh needed to be recognized as separation point
         silence_thresh (int): dB threshold for silent parts
+        keep_silence (int, optional): silence in ms that is kept at the beginning and the end of a chunk. Defaults to 100.
+        audio (AudioBuffer, optional): the already mapped audio of source_file. Defaults to None.
 
     Returns:
         list: Contains the seperated chunks of frames
     """
-    audio = AudioSegment.from_wav(source_file)
-    chunks = split_on_silence(audio, min_silence_len=min_silence_len, silence_thresh=silence_thresh)
+    if audio is None:
+        audio = AudioBuffer(source_file)
+    samples, frame_rate = audio.samples, audio.frame_rate
+    audio_len = get_audio_len(samples, frame_rate)
+    silent_ranges = detect_silent_ranges(samples, frame_rate, min_silence_len, silence_thresh)
+    # Parts between the silent ranges are the chunks
+    if len(silent_ranges) == 0:
+        nonsilent_ranges = [[0, audio_len]]
+    elif silent_ranges[0][0] == 0 and silent_ranges[0][1] == audio_len:
+        nonsilent_ranges = []
+    else:
+        nonsilent_ranges = []
+        prev_end = 0
+        for start, end in silent_ranges:
+            nonsilent_ranges.append([prev_end, start])
+            prev_end = end
+        if prev_end != audio_len:
+            nonsilent_ranges.append([prev_end, audio_len])
+        if nonsilent_ranges[0] == [0, 0]:
+            nonsilent_ranges.pop(0)
+    # Keep some silence around the chunks, overlapping silence is split evenly
+    output_ranges = [[start - keep_silence, end + keep_silence] for start, end in nonsilent_ranges]
+    for range_i, range_ii in zip(output_ranges, output_ranges[1:]):
+        if range_ii[0] < range_i[1]:
+            range_i[1] = (range_i[1] + range_ii[0]) // 2
+            range_ii[0] = range_i[1]
     frames = []
-    for chunk in chunks:
-        frames.append(int(chunk.frame_count()))
+    for start, end in output_ranges:
+        frames.append(ms_to_frame(min(end, audio_len), frame_rate) - ms_to_frame(max(start, 0), frame_rate))
     return frames
 
+def detect_silent_ranges(samples, frame_rate, min_silence_len, silence_thresh, block_len = 60000):
+    """Finds all ranges in which every window of min_silence_len ms has a rms below silence_thresh.
+    The audio is read in blocks, so that the memory stays bounded for long mapped files: the energy of every ms is summed first and the windows are sums over these.
+
+    Args:
+        samples (np.ndarray): 16 bit mono samples of the audio
+        frame_rate (int): sample rate of the audio
+        min_silence_len (int): length of silence_thresh needed to be recognized as separation point
+        silence_thresh (int): dB threshold for silent parts
+        block_len (int, optional): number of windows in ms computed per block. Defaults to 60000.
+
+    Returns:
+        list: start and end in ms of each silent range
+    """
+    audio_len = get_audio_len(samples, frame_rate)
+    if audio_len < min_silence_len:
+        return []
+    threshold = 10 ** (silence_thresh / 20) * 32768
+    window_count = audio_len - min_silence_len + 1
+    silent_ranges = []
+    range_start = last_start = None
+    for block_start in range(0, window_count, block_len):
+        block_end = min(block_start + block_len, window_count)
+        # Frames at the start of every ms covered by the windows of the block, frames after the end of the audio count as silence
+        ms_frames = ms_to_frame(np.arange(block_start, block_end + min_silence_len), frame_rate)
+        read_frames = np.minimum(ms_frames, len(samples))
+        square_sums = np.concatenate(([0], np.cumsum(np.square(samples[read_frames[0]:read_frames[-1]], dtype=np.int64))))
+        ms_energies = np.diff(square_sums[read_frames - read_frames[0]])
+        energy_sums = np.concatenate(([0], np.cumsum(ms_energies)))
+        energies = energy_sums[min_silence_len:] - energy_sums[:-min_silence_len] if min_silence_len > 0 else np.zeros(block_end - block_start, dtype=np.int64)
+        frame_counts = ms_frames[min_silence_len:] - ms_frames[:len(ms_frames) - min_silence_len]
+        rms = np.floor(np.sqrt(np.divide(energies, frame_counts, out=np.zeros(len(energies)), where=frame_counts > 0)))
+        silence_starts = np.flatnonzero(rms <= threshold) + block_start
+        if len(silence_starts) == 0:
+            continue
+        if last_start is not None:
+            # The range of the previous block can continue in this one
+            silence_starts = np.concatenate(([last_start], silence_starts))
+        # Silent windows that overlap are combined into one range
+        gaps = np.diff(silence_starts)
+        breaks = np.flatnonzero((gaps != 1) & (gaps > min_silence_len))
+        range_starts = silence_starts[np.concatenate(([0], breaks + 1))]
+        range_lasts = silence_starts[np.concatenate((breaks, [len(silence_starts) - 1]))]
+        if range_start is not None:
+            range_starts[0] = range_start
+        silent_ranges += [[int(start), int(last) + min_silence_len] for start, last in zip(range_starts[:-1], range_lasts[:-1])]
+        range_start, last_start = range_starts[-1], range_lasts[-1]
+    if range_start is not None:
+        silent_ranges.append([int(range_start), int(last_start) + min_silence_len])
+    return silent_ranges
+
+def get_audio_len(samples, frame_rate):
+    """Returns the length of the audio in ms
+
+    Args:
+        samples (np.ndarray): samples of the audio
+        frame_rate (int): sample rate of the audio
+
+    Returns:
+        int: rounded length in ms
+    """
+    return round(1000 * (len(samples) / frame_rate))
+
+def ms_to_frame(ms, frame_rate):
+    """Converts a time in ms to the index of the frame at that time
+
+    Args:
+        ms (int or np.ndarray): time in ms
+        frame_rate (int): sample rate of the audio
+
+    Returns:
+        int or np.ndarray: index of the frame
+    """
+    if isinstance(ms, np.ndarray):
+        return (ms * (frame_rate / 1000.0)).astype(np.int64)
+    return int(ms * (frame_rate / 1000.0))
+
+def split_audio_at_silence(source_file, min_silence_len, silence_thresh, audio = None):
+    """Splits the audio in the middle of every part where the dB is below silence_thresh
+
+    Args:
+        source_file (str): path to the source audio
+        min_silence_len (int): length of silence_thresh needed to be recognized as separation point
+        silence_thresh (int): dB threshold for silent parts
+        audio (AudioBuffer, optional): the already mapped audio of source_file. Defaults to None.
+
+    Returns:
+        list: Contains the frame count of each chunk, the chunks cover the whole audio
+    """
+    if audio is None:
+        audio = AudioBuffer(source_file)
+    samples, frame_rate = audio.samples, audio.frame_rate
+    frame_count = len(samples)
+    boundaries = [0]
+    for start, end in detect_silent_ranges(samples, frame_rate, min_silence_len, silence_thresh):
+        boundary = int((start + end) / 2 * frame_rate / 1000)
+        if boundaries[-1] < boundary < frame_count:
+            boundaries.append(boundary)
+    boundaries.append(frame_count)
+    return [end - start for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
 def merge_splits(frames, max_split_count):
-    """merges the separated frames together until count of splits is <= max_split_count
+    """merges the separated frames together until count of splits is <= max_split_count.
+    The smallest split (the last one on ties) is merged with its smaller neighbour (the previous one on ties).
+    The splits are kept in a heap and a linked list, so that each merge takes logarithmic time.
 
     Args:
         frames (list): list containing the separated frames
@@ -140,45 +641,57 @@ def merge_splits(frames, max_split_count):
     Returns:
         list: updated list of frames
     """
-    temp = []
-    while len(frames) > max_split_count:
-        temp = [];
-        smallest_index = 0
-        merge_index = -1
-        for index in range(0, len(frames)):
-            if(frames[index] <= frames[smallest_index]):
-                smallest_index = index
-                if(index == 0 and index + 1 == len(frames)):
-                    merge_index = -1
-                elif(index == 0):
-                    merge_index = index + 1
-                elif(index + 1 == len(frames)):
-                    merge_index = index - 1
-                else:
-                    prev_value = frames[index - 1]
-                    next_value = frames[index + 1]
-                    if (prev_value > next_value):
-                        merge_index = index + 1
-                    else:
-                        merge_index = index - 1
-        if(merge_index == -1): 
+    count = len(frames)
+    values = list(frames)
+    if count <= max_split_count or count == 0:
+        return values
+    prev_index = list(range(-1, count - 1))
+    next_index = list(range(1, count + 1))
+    next_index[-1] = -1
+    # A merged split keeps the index of its first frame, so the index still reflects the order of the splits
+    versions = [0] * count
+    heap = [(value, -index, 0) for index, value in enumerate(values)]
+    heapq.heapify(heap)
+    while count > max_split_count:
+        _, index, version = heapq.heappop(heap)
+        index = -index
+        if version != versions[index]:
+            continue
+        prev_split = prev_index[index]
+        next_split = next_index[index]
+        if prev_split == -1 and next_split == -1:
             break
-        for index in range(0, len(frames)):
-            if(index == merge_index):
-                continue
-            if(index == smallest_index):
-                temp.append(frames[smallest_index] + frames[merge_index])
-            else:
-                temp.append(frames[index])
-        frames = temp.copy()
-    return frames   
+        elif prev_split == -1:
+            merge_index = next_split
+        elif next_split == -1:
+            merge_index = prev_split
+        elif values[prev_split] > values[next_split]:
+            merge_index = next_split
+        else:
+            merge_index = prev_split
+        left, right = (merge_index, index) if merge_index == prev_split else (index, merge_index)
+        values[left] += values[right]
+        next_index[left] = next_index[right]
+        if next_index[right] != -1:
+            prev_index[next_index[right]] = left
+        versions[right] = -1
+        versions[left] += 1
+        heapq.heappush(heap, (values[left], -left, versions[left]))
+        count -= 1
+    result = []
+    index = 0
+    while index != -1:
+        result.append(values[index])
+        index = next_index[index]
+    return result
 
-def diarize_text(source_file, pipeline):
+def diarize_text(source_file, pipeline, audio = None):
     """Diarizes the audio in source_file
 
     Args:
         source_file (str): path to the source_file
         pipeline (pyannote.audio.pipelines.speaker_diarization.SpeakerDiarization): the pyannote pipeline to use
+        audio (AudioBuffer, optional): the already mapped audio of source_file, None lets pyannote load the file. Defaults to None.
 
     Returns:
         list: Containging the speakers and the time they spoke
@@ -188,7 +701,7 @@ def diarize_text(source_file, pipeline):
     discarded = False
     discard_limit = 4.0
     
-    diarization = pipeline(source_file)
+    diarization = pipeline(audio.to_waveform() if audio is not None else source_file)
     for turn, _, speaker in diarization.itertracks(yield_label=True):
         if len(result) == 0:
             result.append([turn.start, turn.end, speaker])
@@ -208,6 +721,67 @@ def diarize_text(source_file, pipeline):
 
     return result     
 
+class Token:
+    """A recognized word of the transcript together with the speaker change in front of it"""
+    __slots__ = ("word", "start", "end", "speaker", "speaker_start")
+
+    def __init__(self, word, start, end, speaker = None, speaker_start = None):
+        self.word = word
+        self.start = start
+        self.end = end
+        self.speaker = speaker
+        self.speaker_start = speaker_start
+
+def build_transcript(word_list, diarization_list):
+    """Creates the tokens of the transcript and assigns each speaker change to the first word after its start
+
+    Args:
+        word_list (list): recognized words and their start and end time
+        diarization_list (list): recognized speakers and their start and end time
+
+    Returns:
+        list: tokens of the transcript
+    """
+    offset = 0.1
+    tokens = [Token(word[0], word[2], word[3]) for word in word_list]
+    # Only words marked as recognized can be preceded by a speaker change
+    candidates = [index for index, word in enumerate(word_list) if word[1]]
+    candidate_starts = [tokens[index].start for index in candidates]
+    is_sorted = all(a <= b for a, b in zip(candidate_starts, candidate_starts[1:]))
+    position = 0
+    # The first speaker is always noted at the beginning, so only later changes are assigned
+    for speaker_start, _, speaker in diarization_list[1:]:
+        if is_sorted:
+            position = bisect.bisect_left(candidate_starts, speaker_start - offset, position)
+        else:
+            while position < len(candidates) and speaker_start - offset > candidate_starts[position]:
+                position += 1
+        if position >= len(candidates):
+            break
+        token = tokens[candidates[position]]
+        token.speaker = speaker
+        token.speaker_start = speaker_start
+        # At most one speaker change is noted in front of a word
+        position += 1
+    return tokens
+
+def render_transcript(tokens):
+    """Generates the text of the tokens with the speaker changes in between
+
+    Args:
+        tokens (list): tokens of the transcript
+
+    Returns:
+        str: generated text
+    """
+    parts = ["<---New Speaker 00:00--->"]
+    for token in tokens:
+        if token.speaker_start is not None:
+            parts.append("<---New Speaker {:02d}:{:02d}:--->".format(int(token.speaker_start / 60), int(token.speaker_start) % 60))
+        parts.append(" ")
+        parts.append(token.word)
+    return "".join(parts)
+
 def insert_speakers(word_list, diarization_list):
     """Generates text of the word_list and the speaker changes in between
 
@@ -219,45 +793,100 @@ def insert_speakers(word_list, diarization_list):
         str: generated text
     """
     logger.info('Inserting speakers into text...')
-    word_index = 0
-    word_list_len = len(word_list)
-    speaker_index = 1
-    offset = 0.1
-    result = "<---New Speaker 00:00--->"
-    
-    while word_index < word_list_len:
-        # If the time of the current word is greater than the time of the next speaker, then add a speaker change to the text
-        if word_list[word_index][1] and speaker_index < len(diarization_list) and diarization_list[speaker_index][0] - offset<= word_list[word_index][2]:
-            minutes = int(diarization_list[speaker_index][0] / 60)
-            seconds = int(diarization_list[speaker_index][0]) % 60
-            new_speaker_text = "<---New Speaker "
-            if minutes < 10:
-                new_speaker_text += "0" + str(minutes) + ":"
-            else:
-                new_speaker_text += str(minutes) + ":"
-            if seconds < 10:
-                new_speaker_text += "0" + str(seconds) + ":"
-            else:
-               new_speaker_text += str(seconds) + ":"
-            new_speaker_text += "--->"
-            result = result + new_speaker_text
-            speaker_index += 1
-        result = result + " " + word_list[word_index][0]
-        word_index += 1
-    return result 
-    
-def punctuate_text(text, model):
+    return render_transcript(build_transcript(word_list, diarization_list))
+
+def render_speakers(diarization_list):
+    """Generates a text with a line for every speaker change, used if no speech-to-text conversion is done
+
+    Args:
+        diarization_list (list): recognized speakers and their start and end time
+
+    Returns:
+        str: generated text
+    """
+    logger.info('Listing speakers...')
+    return "\n".join("<---New Speaker {:02d}:{:02d}---> {}".format(int(start / 60), int(start) % 60, speaker) for start, _, speaker in diarization_list)
+
+def punctuate_text(text, model, batch_size = punctuation_batch_size, thread_count = None):
     """Restores punctuation for a given text
 
     Args:
         text (str): text to add punctuation too
         model (deepmultilingualpunctuation.punctuationmodel.PunctuationModel): the model to restore punctuation
+        batch_size (int, optional): number of windows the model processes at once. Defaults to punctuation_batch_size.
+        thread_count (int, optional): number of intra-op threads of torch while the model runs, None keeps the current number. Defaults to None.
 
     Returns:
         str: punctuated version of the text
     """
     logger.info("Adding punctuation...")
-    return model.restore_punctuation(text)
+    words = model.preprocess(text)
+    if not words:
+        return ""
+    if thread_count is None:
+        return model.prediction_to_text(predict_punctuation(words, model, batch_size))
+    import torch
+    previous_thread_count = torch.get_num_threads()
+    torch.set_num_threads(thread_count)
+    try:
+        return model.prediction_to_text(predict_punctuation(words, model, batch_size))
+    finally:
+        torch.set_num_threads(previous_thread_count)
+
+def get_punctuation_windows(word_count):
+    """Computes the overlapping windows of words the punctuation model is applied to, like PunctuationModel.predict does
+
+    Args:
+        word_count (int): number of words of the text
+
+    Returns:
+        list: start and end index of every window and the number of its words that are not used
+    """
+    overlap = punctuation_window_overlap if word_count > punctuation_window_size else 0
+    windows = [[start, min(start + punctuation_window_size, word_count), overlap]
+               for start in range(0, word_count, punctuation_window_size - overlap)]
+    # If the last window is smaller than the overlap, it is already covered by the previous one
+    if windows[-1][1] - windows[-1][0] <= overlap:
+        windows.pop()
+    # The last window is used completely
+    windows[-1][2] = 0
+    return windows
+
+def predict_punctuation(words, model, batch_size):
+    """Predicts the punctuation of the words in batches of overlapping windows
+
+    Args:
+        words (list): words of the text without punctuation
+        model (deepmultilingualpunctuation.punctuationmodel.PunctuationModel): the model to restore punctuation
+        batch_size (int): number of windows the model processes at once
+
+    Returns:
+        list: every word with its predicted label and score
+    """
+    windows = get_punctuation_windows(len(words))
+    tagged_words = []
+    # Only one batch of windows is processed at a time to bound the memory on long texts
+    for batch_start in range(0, len(windows), batch_size):
+        batch = windows[batch_start:batch_start + batch_size]
+        texts = [" ".join(words[start:end]) for start, end, _ in batch]
+        results = model.pipe(texts, batch_size = batch_size)
+        for (start, end, overlap), text, result in zip(batch, texts, results):
+            assert len(text) == result[-1]["end"], "chunk size too large, text got clipped"
+            char_index = 0
+            result_index = 0
+            # The words in the overlap are labeled by the next window, which knows their right context
+            for word in words[start:end - overlap]:
+                char_index += len(word) + 1
+                # If any subtoken of a word is labeled, the whole word gets this label
+                label = "0"
+                score = 0
+                while result_index < len(result) and char_index > result[result_index]["end"]:
+                    label = result[result_index]["entity"]
+                    score = result[result_index]["score"]
+                    result_index += 1
+                tagged_words.append([word, label, score])
+    assert len(tagged_words) == len(words)
+    return tagged_words
 
 def adjust_text_after_punctuation(text):
     """Cleans up the text after punctuation
@@ -268,54 +897,99 @@ def adjust_text_after_punctuation(text):
     Returns:
         str: cleaned up version of the text
     """
-    text = text.replace(". <---", " <---")
-    text = text.replace(" <---", ". <---")
-    text = text.replace("<---", ". <---")
-    text = text.replace("--->.", "---> ")
-    text = text.replace("--->,", "---> ")
-    text = text.replace("--->!", "---> ")
-    text = text.replace("--->?", "---> ")
-    text = text.replace("--->:", "---> ")
-    text = text.replace("Speaker-", "Speaker")
-    text = text.replace("Speaker.", "Speaker")
-    text = text.replace("Speaker:", "Speaker")
-    text = text.replace("Speaker,", "Speaker")
-    text = text.replace("Speaker?", "Speaker")
-    text = text.replace(":--->", "--->")
-    return text
-
-def correct_capitalization(text, pipeline):
+    # Every speaker change gets a sentence end in front of it
+    text = speaker_begin_pattern.sub(lambda match: ". . <---" if match.group(1) else ". <---", text)
+    # Punctuation directly after a speaker change is removed
+    text = speaker_end_punctuation_pattern.sub("---> ", text)
+    text = speaker_punctuation_pattern.sub("Speaker", text)
+    return text.replace(":--->", "--->")
+
+def correct_capitalization(text, pipeline, window_size = capitalization_window_size, batch_size = capitalization_batch_size):
     """Restores the capitalization for a given text
 
     Args:
         text (str): text to capitalize
         pipline (stanza.pipeline.core.Pipeline): the pipeline to restore capitalization
+        window_size (int, optional): number of characters after which the text is split at the next sentence end. Defaults to capitalization_window_size.
+        batch_size (int, optional): number of windows the pipeline processes at once. Defaults to capitalization_batch_size.
 
     Returns:
         str: capitalized text
     """
+    return capitalize_words(tag_words(text, pipeline, window_size, batch_size))
+
+def tag_words(text, pipeline, window_size = capitalization_window_size, batch_size = capitalization_batch_size):
+    """Splits the text into words and tags their part of speech
+
+    Args:
+        text (str): text to tag
+        pipline (stanza.pipeline.core.Pipeline): the pipeline to restore capitalization
+        window_size (int, optional): number of characters after which the text is split at the next sentence end. Defaults to capitalization_window_size.
+        batch_size (int, optional): number of windows the pipeline processes at once. Defaults to capitalization_batch_size.
+
+    Returns:
+        list: every word with its universal part of speech tag
+    """
+    import stanza
     logger.info("Correcting capitalization...")
-    capitalized_text = ""
-    doc = pipeline(text)
+    tagged_words = []
+    windows = split_at_sentence_ends(text, window_size)
+    # Only one batch of windows is processed at a time to bound the memory on long texts
+    for batch_start in range(0, len(windows), batch_size):
+        docs = pipeline([stanza.Document([], text=window) for window in windows[batch_start:batch_start + batch_size]])
+        for doc in docs:
+            for sent in doc.sentences:
+                tagged_words += [(w.text, w.upos) for w in sent.words]
+    return tagged_words
+
+def capitalize_words(tagged_words):
+    """Restores the capitalization of the tagged words and joins them to a text
+
+    Args:
+        tagged_words (list): every word with its universal part of speech tag
+
+    Returns:
+        str: capitalized text
+    """
+    capitalized_text = []
     previous_entry = "."
-    for sent in doc.sentences:
-        for w in sent.words:
-            if w.text[0] == "-":
-                capitalized_text = capitalized_text + w.text
-            elif w.upos in ["PROPN","NOUN"]:
-                capitalized_text = capitalized_text + " " + w.text.capitalize()
-            # Because of earlier transformations two . in sequence are possible -> remove the second one
-            elif previous_entry == "." and w.text  == ".":
-                continue
-            # If a specific punctuation marker is in front of our word, we know that the word must be capitalized
-            elif previous_entry in [".", "?", "!", ":"] or ">" in previous_entry:
-                capitalized_text = capitalized_text + " " + w.text.capitalize()
-            elif w.text in [".", ",", ":", "?", "!", ":"]:
-                capitalized_text = capitalized_text + w.text  
-            else:
-                capitalized_text = capitalized_text + " " + w.text
-            previous_entry = w.text
-    return capitalized_text
+    for text, upos in tagged_words:
+        if text[0] == "-":
+            capitalized_text.append(text)
+        elif upos in ["PROPN","NOUN"]:
+            capitalized_text.append(" " + text.capitalize())
+        # Because of earlier transformations two . in sequence are possible -> remove the second one
+        elif previous_entry == "." and text  == ".":
+            continue
+        # If a specific punctuation marker is in front of our word, we know that the word must be capitalized
+        elif previous_entry in [".", "?", "!", ":"] or ">" in previous_entry:
+            capitalized_text.append(" " + text.capitalize())
+        elif text in [".", ",", ":", "?", "!", ":"]:
+            capitalized_text.append(text)
+        else:
+            capitalized_text.append(" " + text)
+        previous_entry = text
+    return "".join(capitalized_text)
+
+def split_at_sentence_ends(text, window_size):
+    """Splits the text into windows which end at a sentence end
+
+    Args:
+        text (str): text to split
+        window_size (int): number of characters after which the text is split at the next sentence end
+
+    Returns:
+        list: windows of the text, a text shorter than window_size is returned as one window
+    """
+    windows = []
+    window_start = 0
+    for match in sentence_end_pattern.finditer(text):
+        if match.end() - window_start >= window_size:
+            windows.append(text[window_start:match.start()])
+            window_start = match.end()
+    if window_start < len(text) or not windows:
+        windows.append(text[window_start:])
+    return windows
 
 def adjust_text_after_capitalization(text):
     """Cleans up the text after capitalization
@@ -327,15 +1001,9 @@ def adjust_text_after_capitalization(text):
         str: cleaned up version of the text
     """
     text = text.replace(" >",">")
-    text = text.replace("--->.","--->")
-    text = text.replace("---> .","--->")
-    text = text.replace("--->", "--->\n")
-    text = text.replace("<--- ", "\n<---")
-    text = text.replace(".", ".\n")
-    #text = text.replace(":", ":\n")
-    text = text.replace("!", "!\n")
-    text = text.replace("?", "?\n")
-    return text
+    text = speaker_end_period_pattern.sub("--->", text)
+    # Speaker changes and sentence ends are put on their own lines
+    return line_break_pattern.sub(lambda match: line_breaks[match.group(0)], text)
 
 def save_to_txt(text, output_file):
     """saves the text to output_file
@@ -0,0 +1,447 @@
+import logging
+import os
+import glob
+import json
+import time
+import queue
+import signal
+import socket
+import stat
+import threading
+import itertools
+import argparse
+import socketserver
+from collections import OrderedDict
+from Main import setup_logging, does_path_exist, intermediate_dir, template_bank_dir, cache_dir
+from AudioPreprocessing import preprocess_files, load_template_bank
+from RadioSummarizer import speech_to_text, setup_models, all_stages, punctuation_backends
+from WorkerPool import WorkerPool, format_memory_usage
+from Client import socket_path
+from Archive import archive_file
+
+max_finished_jobs = 1000
+
+def setup_logging_server(log_level):
+    """Sets up the logger for this module
+
+    Args:
+        log_level (str): the selected loglevel
+    """
+    global logger 
+    logger = logging.getLogger('Server')
+    logger.propagate = False
+    ch = logging.StreamHandler()
+    if log_level == "INFO":
+        logger.setLevel(logging.INFO)
+        ch.setLevel(logging.INFO)
+    elif log_level == "DEBUG":
+        logger.setLevel(logging.DEBUG)
+        ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(levelname)s:%(name)s: %(message)s')
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+def setup_args():
+    """Sets up the flag arguments used by the server
+
+    Returns:
+        argparse.Namespace: Contains the arguments provided by the user
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-a", "--archive", dest = "archive", action='store_true', help="Add the recognized words with their times to the searchable archive?")
+    parser.add_argument("-b", "--begin", dest = "begin_sounds_dir", help="Directory with sounds played at the begining")
+    parser.add_argument("-bw", "--begin_window", dest = "begin_window", default = None, help="Seconds at the begin of a file that are searched for the begin sounds first")
+    parser.add_argument("-c", "--min_correlation", dest = "min_correlation", default = -1, help="filter value for the normalized trim correlation (between -1 and 1)")
+    parser.add_argument("-cc", "--coarse_candidates", dest = "coarse_candidates", default = 0, help="Number of candidates kept by the coarse trim search, 0 disables it")
+    parser.add_argument("-cf", "--coarse_factor", dest = "coarse_factor", default = 8, help="Decimation factor of the coarse trim search")
+    parser.add_argument("-cw", "--conversion_workers", dest = "conversion_workers", default = 1, help="Number of forked processes that convert the jobs at the same time with the models loaded once")
+    parser.add_argument("-db", "--debug", dest = "debug", action='store_true', help="Show debug information?")
+    parser.add_argument("-dt", "--diarize_threads", dest = "diarize_threads", default = None, help="Number of threads used for the diarization while the speech-to-text conversion runs")
+    parser.add_argument("-e", "--end", dest = "end_sounds_dir", help="Directory with sound played at the ending")
+    parser.add_argument("-ew", "--end_window", dest = "end_window", default = None, help="Seconds at the end of a file that are searched for the end sounds first")
+    parser.add_argument("-l", "--language",dest ="language", default="de", help="Language used in the audiofiles")
+    parser.add_argument("-m", "--multi", dest = "multi", action='store_true', help="Trim every broadcast of the audio file instead of only one?")
+    parser.add_argument("-mm", "--model_memory", dest = "model_memory", default = None, help="Memory in MB the loaded models may use together, the least recently used ones are released above it")
+    parser.add_argument("-nc", "--no_cache", dest = "no_cache", action='store_true', help="Compute every stage again instead of using the cached results?")
+    parser.add_argument("-o", "--output_dir", dest = "output_dir", default = "output", help="Default output directory of the jobs")
+    parser.add_argument("-pb", "--punctuation_backend", dest = "punctuation_backend", choices = punctuation_backends, default = "torch", help="Backend of the punctuation model, int8 uses a dynamically quantized model on the CPU")
+    parser.add_argument("-pt", "--punctuation_threads", dest = "punctuation_threads", default = None, help="Number of threads used by the punctuation model")
+    parser.add_argument("-q", "--queue_size", dest = "queue_size", default = 16, help="Number of jobs that can wait for their conversion")
+    parser.add_argument("-s", "--streaming", dest = "streaming", action='store_true', help="Trim the audio file block by block with bounded memory?")
+    parser.add_argument("-so", "--socket", dest = "socket", default = socket_path, help="Path of the UNIX socket the server listens on")
+    parser.add_argument("-sg", "--stages", dest = "stages", nargs = "+", choices = ["trim"] + all_stages, default = None, help="Stages to run, defaults to all conversion stages and trim if -t is used")
+    parser.add_argument("-sp", "--spool_dir", dest = "spool_dir", default = None, help="Directory that is watched for new audiofiles")
+    parser.add_argument("-t", "--trimfile", dest = "trimfile", action='store_true', help="Trim the audio files before conversion?")
+    parser.add_argument("-tt", "--stt_threads", dest = "stt_threads", default = 1, help="Number of threads that decode chunks of the audio in parallel")
+    return parser.parse_args()
+
+class JobQueue:
+    """Bounded queue of conversion jobs which keeps the status of every job"""
+
+    def __init__(self, max_size):
+        """Creates an empty job queue
+
+        Args:
+            max_size (int): number of jobs that can wait for their conversion
+        """
+        self.queue = queue.Queue(max_size)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    def submit(self, source_file, output_dir, block = False, language = None):
+        """Adds a job for a source file to the queue
+
+        Args:
+            source_file (str): path to the source file
+            output_dir (str): path to the output directory of the job
+            block (bool, optional): if the call waits for a free place in the queue. Defaults to False.
+            language (str, optional): language code of the source file, None for the language of the server. Defaults to None.
+
+        Returns:
+            dict: status of the job, None if the queue is full
+        """
+        with self.lock:
+            job = {"id": next(self.ids), "file": source_file, "output_dir": output_dir, "language": language, "status": "queued",
+                "output_files": [], "error": None, "submitted": time.time(), "started": None, "finished": None}
+            self.jobs[job["id"]] = job
+            answer = dict(job)
+        try:
+            self.queue.put(job, block)
+        except queue.Full:
+            with self.lock:
+                del self.jobs[job["id"]]
+            return None
+        return answer
+
+    def get(self):
+        """Waits for the next job and marks it as running
+
+        Returns:
+            dict: the next job
+        """
+        job = self.queue.get()
+        with self.lock:
+            job["status"] = "running"
+            job["started"] = time.time()
+        return job
+
+    def finish(self, job, output_files, error):
+        """Marks a job as finished and forgets the oldest finished jobs
+
+        Args:
+            job (dict): the finished job
+            output_files (list): paths to the created .txt files
+            error (str): the error message if the job failed, otherwise None
+        """
+        with self.lock:
+            job["status"] = "failed" if error is not None else "done"
+            job["output_files"] = output_files
+            job["error"] = error
+            job["finished"] = time.time()
+            finished_ids = [job_id for job_id, entry in self.jobs.items() if entry["finished"] is not None]
+            for job_id in finished_ids[:max(0, len(finished_ids) - max_finished_jobs)]:
+                del self.jobs[job_id]
+
+    def status(self, job_id = None):
+        """Returns the status of one or all known jobs
+
+        Args:
+            job_id (int, optional): id of the job. Defaults to None for all jobs.
+
+        Returns:
+            list: copies of the job statuses
+        """
+        with self.lock:
+            if job_id is None:
+                return [dict(job) for job in self.jobs.values()]
+            return [dict(self.jobs[job_id])] if job_id in self.jobs else []
+
+def process_job(job, options, pool = None):
+    """Trims or converts the source file of a job and converts it to text with the loaded models
+
+    Args:
+        job (dict): the job to process
+        options (dict): arguments passed to preprocess_file() without the output directory
+        pool (WorkerPool, optional): workers that convert the files, None to convert them in this process. Defaults to None.
+
+    Returns:
+        list: paths to the created .txt files
+    """
+    output_dir = job["output_dir"]
+    intermediate_dir_path = os.path.join(output_dir, intermediate_dir)
+    if not os.path.exists(intermediate_dir_path):
+        os.makedirs(intermediate_dir_path)
+    files_to_convert = []
+    if ".mp3" in job["file"]:
+        log_level = logging.getLevelName(logger.level)
+        for _, is_processed, processed_files, error in preprocess_files([job["file"]], 1, log_level, output_dir = intermediate_dir_path, **options):
+            if error is not None:
+                raise RuntimeError("Preparing {} failed: {}".format(os.path.basename(job["file"]), error))
+            if not is_processed:
+                raise RuntimeError("{} could not be trimmed".format(os.path.basename(job["file"])))
+            files_to_convert += processed_files
+    elif ".wav" in job["file"]:
+        files_to_convert.append(job["file"])
+    else:
+        raise RuntimeError("{} is no .mp3 or .wav file".format(os.path.basename(job["file"])))
+    output_files = []
+    for file in files_to_convert:
+        logger.info("Starting conversion of {}".format(os.path.basename(file)))
+        output_file = os.path.join(output_dir, os.path.basename(file).replace(".wav", ".txt"))
+        if pool is not None:
+            pool.submit(file, output_file, job["language"]).result()
+        else:
+            speech_to_text(file, output_file, language = job["language"])
+        output_files.append(output_file)
+    return output_files
+
+def run_jobs(job_queue, options, pool = None):
+    """Processes the jobs of the queue one after another, as the models are shared.
+    With a pool of workers, one thread per worker runs this, so that the jobs are converted at the same time.
+
+    Args:
+        job_queue (JobQueue): queue of the jobs
+        options (dict): arguments passed to preprocess_file() without the output directory
+        pool (WorkerPool, optional): workers that convert the files, None to convert them in this thread. Defaults to None.
+    """
+    while True:
+        job = job_queue.get()
+        logger.info("Starting job {} for {}".format(job["id"], job["file"]))
+        try:
+            output_files = process_job(job, options, pool)
+            job_queue.finish(job, output_files, None)
+            logger.info("Job {} finished".format(job["id"]))
+            if pool is not None:
+                for pid, usage in pool.memory_usage().items():
+                    logger.debug(format_memory_usage(pid, usage))
+        except Exception as e:
+            job_queue.finish(job, [], str(e))
+            logger.error("Job {} failed: {}".format(job["id"], e))
+
+def watch_spool_dir(spool_dir, job_queue, output_dir, interval = 5):
+    """Submits every new audiofile of the spool directory as a job.
+    A file is only submitted once its size didn't change between two checks, so files that are still written are skipped.
+    Submitted files are moved to the subdirectory processing, so they aren't submitted again after a restart.
+
+    Args:
+        spool_dir (str): path to the watched directory
+        job_queue (JobQueue): queue of the jobs
+        output_dir (str): path to the output directory of the jobs
+        interval (int, optional): seconds between two checks. Defaults to 5.
+    """
+    processing_dir = os.path.join(spool_dir, "processing")
+    os.makedirs(processing_dir, exist_ok=True)
+    seen_files = {}
+    while True:
+        current_files = {}
+        for file in sorted(glob.glob(os.path.join(spool_dir, "*"))):
+            if not (".mp3" in file or ".wav" in file):
+                continue
+            try:
+                stat = os.stat(file)
+            except OSError:
+                continue
+            key = (stat.st_mtime_ns, stat.st_size)
+            if seen_files.get(file) != key:
+                current_files[file] = key
+                continue
+            processing_file = os.path.join(processing_dir, os.path.basename(file))
+            try:
+                os.replace(file, processing_file)
+                # Waits for a free place instead of rejecting the file
+                job = job_queue.submit(os.path.abspath(processing_file), output_dir, block = True)
+            except Exception as e:
+                logger.error("Couldn't submit {}: {}".format(file, e))
+                continue
+            logger.info("Queued job {} for {}".format(job["id"], file))
+        # Only the files that are still waiting are remembered
+        seen_files = current_files
+        time.sleep(interval)
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Answers the requests of a client, each request and answer is a line of JSON"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                answer = handle_request(self.server.job_queue, self.server.output_dir, request)
+            except Exception as e:
+                answer = {"error": str(e)}
+            self.wfile.write((json.dumps(answer) + "\n").encode("utf-8"))
+
+def handle_request(job_queue, output_dir, request):
+    """Executes the command of a client request
+
+    Args:
+        job_queue (JobQueue): queue of the jobs
+        output_dir (str): path to the default output directory of the jobs
+        request (dict): the request with a "command" of "submit", "status" or "jobs", a submit can have an "output_dir" and a "language"
+
+    Returns:
+        dict: the answer to the client
+    """
+    command = request.get("command")
+    if command == "submit":
+        source_file = request["file"]
+        if not os.path.isfile(source_file):
+            return {"error": "{} doesn't exist".format(source_file)}
+        job = job_queue.submit(source_file, request.get("output_dir") or output_dir, language = request.get("language"))
+        if job is None:
+            return {"error": "Queue is full"}
+        logger.info("Queued job {} for {}".format(job["id"], source_file))
+        return {"job": job}
+    if command == "status":
+        jobs = job_queue.status(int(request["id"]))
+        if len(jobs) == 0:
+            return {"error": "Unknown job {}".format(request["id"])}
+        return {"job": jobs[0]}
+    if command == "jobs":
+        return {"jobs": job_queue.status()}
+    return {"error": "Unknown command {}".format(command)}
+
+def check_args(args):
+    """Reads the arguments provided by the user and loads the sound samples used for trimming
+
+    Args:
+        args (argparse.Namespace): The args generated by setup_args()
+
+    Returns:
+        dict: arguments passed to preprocess_file() without the output directory
+        list: names of the enabled conversion stages
+    """
+    log_level = "DEBUG" if args.debug else "INFO"
+    setup_logging(log_level)
+    setup_logging_server(log_level)
+
+    does_path_exist(args.output_dir, "OutputDir")
+    if args.spool_dir is not None:
+        does_path_exist(args.spool_dir, "SpoolDir")
+    if args.model_memory is not None and float(args.model_memory) <= 0:
+        logger.error("Model memory has to be more than 0 MB")
+        exit()
+    if int(args.conversion_workers) < 1:
+        logger.error("Number of conversion workers has to be at least 1")
+        exit()
+    if int(args.queue_size) < 1:
+        logger.error("Queue size has to be at least 1")
+        exit()
+    trim_file = args.trimfile
+    stages = all_stages
+    if args.stages is not None:
+        trim_file = trim_file or "trim" in args.stages
+        stages = [stage for stage in all_stages if stage in args.stages]
+    if len(stages) == 0:
+        logger.error("The server needs at least one conversion stage!")
+        exit()
+    if ("punctuate" in stages or "capitalize" in stages) and "stt" not in stages:
+        logger.error("Punctuation and capitalization require the stt stage!")
+        exit()
+    min_correlation = float(args.min_correlation)
+    if args.multi and min_correlation == -1:
+        logger.error("Trimming every broadcast requires a minimum correlation!")
+        exit()
+    if int(args.coarse_factor) < 1:
+        logger.error("Coarse factor has to be at least 1")
+        exit()
+    begin_window = None if args.begin_window is None else float(args.begin_window)
+    end_window = None if args.end_window is None else float(args.end_window)
+    if (begin_window is not None and begin_window <= 0) or (end_window is not None and end_window <= 0):
+        logger.error("Search windows have to be longer than 0 seconds")
+        exit()
+    options = {"trim_file": trim_file, "correlation_threshold": min_correlation, "multi": args.multi,
+        "streaming": args.streaming, "coarse_candidates": int(args.coarse_candidates), "coarse_factor": int(args.coarse_factor),
+        "begin_window": begin_window, "end_window": end_window,
+        "cache_dir": None if args.no_cache else os.path.abspath(os.path.join(args.output_dir, cache_dir))}
+    if trim_file:
+        if args.begin_sounds_dir is None or args.end_sounds_dir is None:
+            logger.error("No directory with begin or end sounds provided!")
+            exit()
+        does_path_exist(args.begin_sounds_dir, "BeginSoundDir")
+        does_path_exist(args.end_sounds_dir, "EndSoundDir")
+        template_bank_path = os.path.join(args.output_dir, template_bank_dir)
+        options["begin_templates"] = load_template_bank(args.begin_sounds_dir, template_bank_path)
+        options["end_templates"] = load_template_bank(args.end_sounds_dir, template_bank_path)
+        if len(options["begin_templates"]) == 0 or len(options["end_templates"]) == 0:
+            logger.error("No .mp3 sound samples for trimming provided!")
+            exit()
+    return options, stages
+
+def remove_stale_socket(path):
+    """Removes the socket file left behind by a server that isn't running anymore
+
+    Args:
+        path (str): path of the UNIX socket
+
+    Returns:
+        bool: if the path is free for a new server, False if a server answers on it or it isn't a socket
+    """
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return False
+    except FileNotFoundError:
+        return True
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return False
+    except ConnectionRefusedError:
+        # Nobody listens on the socket anymore
+        os.remove(path)
+        return True
+    finally:
+        probe.close()
+
+def main():
+    """Loads the models once and converts the audio files submitted over the socket or the spool directory"""
+    args = setup_args()
+    options, stages = check_args(args)
+    # Checked before the models are loaded, so that a second server stops at once
+    if not remove_stale_socket(args.socket):
+        logger.error("{} is used by a running server or isn't a socket".format(args.socket))
+        exit()
+    stt_threads = int(args.stt_threads)
+    diarize_threads = int(args.diarize_threads) if args.diarize_threads is not None else None
+    punctuation_threads = int(args.punctuation_threads) if args.punctuation_threads is not None else None
+    model_memory = int(float(args.model_memory) * (1 << 20)) if args.model_memory is not None else None
+    setup_models(args.language, diarize_threads, stt_threads, stages, options["cache_dir"], punctuation_backend = args.punctuation_backend, punctuation_threads = punctuation_threads,
+        archive_path = os.path.abspath(os.path.join(args.output_dir, archive_file)) if args.archive else None, memory_budget = model_memory)
+    conversion_workers = int(args.conversion_workers)
+    # The workers are forked before any thread is started
+    pool = WorkerPool(conversion_workers) if conversion_workers > 1 else None
+    job_queue = JobQueue(int(args.queue_size))
+    output_dir = os.path.abspath(args.output_dir)
+
+    try:
+        server = socketserver.ThreadingUnixStreamServer(args.socket, RequestHandler)
+    except OSError as e:
+        logger.error("Can't listen on {}: {}".format(args.socket, e))
+        exit()
+    # Only the socket created here is removed on exit, not one that replaced it
+    socket_inode = os.stat(args.socket).st_ino
+    server.daemon_threads = True
+    server.job_queue = job_queue
+    server.output_dir = output_dir
+    for _ in range(conversion_workers):
+        threading.Thread(target=run_jobs, args=(job_queue, options, pool), daemon=True).start()
+    if args.spool_dir is not None:
+        threading.Thread(target=watch_spool_dir, args=(args.spool_dir, job_queue, output_dir), daemon=True).start()
+    # Stops the server on SIGTERM like on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    logger.info("Waiting for jobs on {}".format(args.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            if os.stat(args.socket).st_ino == socket_inode:
+                os.remove(args.socket)
+        except FileNotFoundError:
+            pass
+    logger.info("Server stopped")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import wave
+import numpy as np
+from AudioPreprocessing import get_fft_size, compute_spectrum, to_template
+
+sample_rate = 16000
+vocabulary = ["nachrichten", "wetter", "berlin", "heute", "und", "der", "die", "das", "regierung", "sport", "morgen", "sonne"]
+
+def generate_jingle(generator, duration, sample_rate = sample_rate):
+    """Generates a jingle as a chirp with harmonics, which is easy to tell apart from the bed
+
+    Args:
+        generator (np.random.Generator): seeded random generator
+        duration (float): length of the jingle in seconds
+        sample_rate (int, optional): sample rate of the jingle. Defaults to sample_rate.
+
+    Returns:
+        np.ndarray: float32 samples between -1 and 1
+    """
+    times = np.arange(int(duration * sample_rate)) / sample_rate
+    low, high = generator.uniform(300, 800), generator.uniform(1500, 3000)
+    phase = 2 * np.pi * (low * times + (high - low) * times * times / (2 * duration))
+    jingle = np.sin(phase) + 0.5 * np.sin(2 * phase) + 0.25 * np.sin(3 * phase)
+    envelope = np.minimum(1, np.minimum(times, duration - times) * 20)
+    return (0.4 * jingle * envelope).astype(np.float32)
+
+def make_template(samples, name, sample_rate = sample_rate):
+    """Creates a template like load_template_bank() does, without decoding a sound file
+
+    Args:
+        samples (np.ndarray): float32 samples of the sound sample
+        name (str): name used as the source file of the template
+        sample_rate (int, optional): sample rate of the samples. Defaults to sample_rate.
+
+    Returns:
+        dict: the template of the sound sample
+    """
+    fft_size = get_fft_size(len(samples))
+    return to_template({"file_hash": name, "sample_rate": sample_rate, "samples": samples, "fft_size": fft_size,
+        "spectrum": compute_spectrum(samples, fft_size)}, name)
+
+def generate_bed_block(generator, length, kind, sample_rate = sample_rate):
+    """Generates a block of the bed the jingles are embedded into
+
+    Args:
+        generator (np.random.Generator): seeded random generator
+        length (int): number of samples
+        kind (str): "noise" for white noise, "music" for changing chords or "speech" for bursts of shaped noise separated by silence
+        sample_rate (int, optional): sample rate of the bed. Defaults to sample_rate.
+
+    Returns:
+        np.ndarray: float32 samples between -1 and 1
+    """
+    if kind == "noise":
+        return (0.05 * generator.standard_normal(length)).astype(np.float32)
+    if kind == "music":
+        times = np.arange(length) / sample_rate
+        block = np.zeros(length)
+        for frequency in generator.uniform(110, 880, 3):
+            block += np.sin(2 * np.pi * frequency * times + generator.uniform(0, 2 * np.pi))
+        return (0.05 * block + 0.005 * generator.standard_normal(length)).astype(np.float32)
+    # Speech alternates between loud bursts of 0.2s to 3s and quiet pauses of 0.1s to 1s
+    block = np.zeros(length, dtype=np.float32)
+    position = 0
+    while position < length:
+        burst = int(generator.uniform(0.2, 3) * sample_rate)
+        pause = int(generator.uniform(0.1, 1) * sample_rate)
+        end = min(position + burst, length)
+        block[position:end] = 0.3 * generator.standard_normal(end - position) * np.abs(np.sin(np.linspace(0, 12, end - position)))
+        block[end:min(end + pause, length)] = 0.001 * generator.standard_normal(min(end + pause, length) - end)
+        position = end + pause
+    return block
+
+def generate_broadcast(generator, duration, begin_jingle, end_jingle, kind = "speech", block_duration = 60, sample_rate = sample_rate):
+    """Generates a recording with one broadcast between a begin and an end jingle at known offsets
+
+    Args:
+        generator (np.random.Generator): seeded random generator
+        duration (float): length of the recording in seconds
+        begin_jingle (np.ndarray): samples of the jingle played at the begin of the broadcast
+        end_jingle (np.ndarray): samples of the jingle played at the end of the broadcast
+        kind (str, optional): kind of the bed, see generate_bed_block(). Defaults to "speech".
+        block_duration (float, optional): length of the generated blocks in seconds. Defaults to 60.
+        sample_rate (int, optional): sample rate of the recording. Defaults to sample_rate.
+
+    Returns:
+        iterator: consecutive float32 blocks of the recording
+        int: position of the first sample after the begin jingle
+        int: position of the first sample of the end jingle
+    """
+    length = int(duration * sample_rate)
+    begin_start = int(generator.uniform(0.05, 0.15) * length)
+    end_start = int(generator.uniform(0.85, 0.95) * length) - len(end_jingle)
+    jingles = [(begin_start, begin_jingle), (end_start, end_jingle)]
+
+    def blocks():
+        block_len = int(block_duration * sample_rate)
+        for start in range(0, length, block_len):
+            block = generate_bed_block(generator, min(block_len, length - start), kind, sample_rate)
+            for jingle_start, jingle in jingles:
+                begin = max(jingle_start, start)
+                end = min(jingle_start + len(jingle), start + len(block))
+                if begin < end:
+                    block[begin - start:end - start] += jingle[begin - jingle_start:end - jingle_start]
+            yield block
+
+    return blocks(), begin_start + len(begin_jingle), end_start
+
+def write_wav_blocks(output_file, blocks, sample_rate = sample_rate):
+    """Writes float blocks as a mono 16 bit .wav file without keeping the whole audio in memory
+
+    Args:
+        output_file (str): path to the .wav file
+        blocks (iterable): consecutive float32 blocks between -1 and 1
+        sample_rate (int, optional): sample rate of the audio. Defaults to sample_rate.
+    """
+    with wave.open(output_file, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        for block in blocks:
+            wav.writeframes((np.clip(block, -1, 1) * 32767).astype(np.int16).tobytes())
+
+def generate_transcript(generator, hours):
+    """Generates a synthetic transcript with speaker changes
+
+    Args:
+        generator (random.Random): seeded random generator
+        hours (float): length of the transcript in hours
+
+    Returns:
+        tuple: list of words with their start and end time, list of speaker turns
+    """
+    word_list = []
+    diarization_list = []
+    time = 0.0
+    while time < hours * 3600:
+        if not diarization_list or generator.random() < 0.01:
+            diarization_list.append([time, time, "SPEAKER_{:02d}".format(generator.randint(0, 3))])
+        duration = generator.uniform(0.1, 0.6)
+        word_list.append([generator.choice(vocabulary), True, round(time, 2), round(time + duration, 2)])
+        time += duration + generator.uniform(0.0, 0.3)
+    return word_list, diarization_list
+
+def punctuate_synthetic(text, generator):
+    """Imitates the punctuation model by appending punctuation to random words
+
+    Args:
+        text (str): text to punctuate
+        generator (random.Random): seeded random generator
+
+    Returns:
+        str: punctuated text
+    """
+    return " ".join(word + generator.choice(["", "", "", "", ".", ",", "?", "!", ":", "-"]) for word in text.split(" "))
@@ -0,0 +1,180 @@
+import gc
+import os
+import queue
+import signal
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future
+from RadioSummarizer import speech_to_text, preload_models
+from Instrumentation import get_memory_usage
+
+class WorkerPool:
+    """Processes that convert audio files to text with the models loaded once by the parent process.
+    The workers are forked after the models were loaded, so they share the memory of the models copy-on-write instead of loading their own copies.
+    Each worker only creates its own recognizers and the state of the file it converts.
+    """
+
+    def __init__(self, worker_count, preload = ()):
+        """Loads the models and forks the workers, the process shouldn't run other threads yet
+
+        Args:
+            worker_count (int): number of worker processes
+            preload (list, optional): stages and language codes of the models that are loaded before forking, the most needed first. The loading stops once the models fill the memory budget, see RadioSummarizer.preload_models().
+                Models that aren't loaded before are loaded by every worker on its own. Defaults to ().
+        """
+        preload_models(list(preload))
+        # Objects that exist before forking are never visited by the garbage collector of the workers, which would copy their pages
+        gc.collect()
+        gc.freeze()
+        context = multiprocessing.get_context("fork")
+        self.task_queue = context.Queue()
+        self.result_queue = context.Queue()
+        self.workers = [context.Process(target=run_worker, args=(self.task_queue, self.result_queue), daemon=True) for _ in range(worker_count)]
+        for worker in self.workers:
+            worker.start()
+        gc.unfreeze()
+        self.futures = {}
+        self.running_jobs = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.collector = threading.Thread(target=self.collect_results, daemon=True)
+        self.collector.start()
+
+    def submit(self, source_file, output_file, language = None):
+        """Queues the conversion of a file for the next free worker
+
+        Args:
+            source_file (str): path to the source file
+            output_file (str): path to the output file
+            language (str, optional): language code of the broadcast, None for the language of setup_models(). Defaults to None.
+
+        Returns:
+            concurrent.futures.Future: resolves to the output file once the conversion is finished
+        """
+        future = Future()
+        with self.lock:
+            if not any(worker.is_alive() for worker in self.workers):
+                raise RuntimeError("No worker is running")
+            job_id = next(self.ids)
+            self.futures[job_id] = future
+        self.task_queue.put((job_id, source_file, output_file, language))
+        return future
+
+    def collect_results(self):
+        """Resolves the futures of the finished jobs and fails the job of a worker that exited unexpectedly"""
+        while True:
+            try:
+                message = self.result_queue.get(timeout=1)
+            except queue.Empty:
+                self.check_workers()
+                continue
+            except (EOFError, OSError):
+                return
+            self.handle_result(message)
+            # A crashed worker is noticed even while the other workers keep sending results
+            with self.lock:
+                has_lost_job = any(not worker.is_alive() and worker.pid in self.running_jobs for worker in self.workers)
+            if has_lost_job:
+                # The results the worker sent before it exited are received first
+                try:
+                    while True:
+                        self.handle_result(self.result_queue.get_nowait())
+                except queue.Empty:
+                    pass
+                self.check_workers()
+
+    def handle_result(self, message):
+        """Records the start of a job or resolves its future once it is finished
+
+        Args:
+            message (tuple): kind of the message, id of the job, process id of the worker and the output file and the error of a finished job
+        """
+        kind, job_id, pid, payload = message
+        with self.lock:
+            if kind == "started":
+                self.running_jobs[pid] = job_id
+                return
+            self.running_jobs.pop(pid, None)
+            future = self.futures.pop(job_id, None)
+        if future is None:
+            return
+        output_file, error = payload
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(output_file)
+
+    def check_workers(self):
+        """Fails the jobs that can't be finished because their worker exited, e.g. when it was killed for using too much memory.
+        Only called once the received results are handled, so that the result a worker sent before it exited isn't lost.
+        """
+        failed = []
+        with self.lock:
+            for worker in self.workers:
+                if worker.is_alive() or worker.pid not in self.running_jobs:
+                    continue
+                job_id = self.running_jobs.pop(worker.pid)
+                failed.append((self.futures.pop(job_id), "Worker {} exited with code {}".format(worker.pid, worker.exitcode)))
+            if not any(worker.is_alive() for worker in self.workers):
+                failed += [(future, "No worker is running") for future in self.futures.values()]
+                self.futures.clear()
+        for future, error in failed:
+            future.set_exception(RuntimeError(error))
+
+    def memory_usage(self):
+        """Returns the current memory of every running worker
+
+        Returns:
+            dict: memory of the worker by process id, see Instrumentation.get_memory_usage()
+        """
+        usage = {}
+        for worker in self.workers:
+            if worker.is_alive():
+                usage[worker.pid] = get_memory_usage(worker.pid)
+        return usage
+
+    def close(self):
+        """Lets the workers finish the queued jobs and waits for them to exit"""
+        for _ in self.workers:
+            self.task_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+def format_memory_usage(pid, usage):
+    """Describes the memory of a worker
+
+    Args:
+        pid (int): id of the worker process
+        usage (dict): memory of the worker, see Instrumentation.get_memory_usage()
+
+    Returns:
+        str: the resident memory and how much of it is shared with the other processes
+    """
+    if usage is None:
+        return "Memory of worker {} is unknown".format(pid)
+    return "Worker {}: {:.0f}MB resident, {:.0f}MB shared, {:.0f}MB private, {:.0f}MB proportional".format(pid,
+        usage["rss"] / (1 << 20), usage["shared"] / (1 << 20), usage["private"] / (1 << 20), usage["pss"] / (1 << 20))
+
+def run_worker(task_queue, result_queue):
+    """Converts the files of the task queue until it receives None
+
+    Args:
+        task_queue (multiprocessing.Queue): jobs with their id, source file, output file and language
+        result_queue (multiprocessing.Queue): start and result of every job
+    """
+    # Ctrl+C only interrupts the parent, whose daemon workers are stopped when it exits
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    pid = os.getpid()
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        job_id, source_file, output_file, language = task
+        result_queue.put(("started", job_id, pid, None))
+        error = None
+        try:
+            speech_to_text(source_file, output_file, language = language)
+        except Exception as e:
+            error = str(e)
+        result_queue.put(("finished", job_id, pid, (output_file, error)))